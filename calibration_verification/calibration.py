@@ -55,14 +55,22 @@ By using this program you agree that:
 ################################################################################
 ## If you need to update values, do that here (e.g. verbosity mode or stimuli.
 ################################################################################
+import argparse
 import csv
 import os
 import math
 import datetime
-import sys
+from types import SimpleNamespace
+
+import results_store
 
 verbose = False  # turn to False if you want it to print less.
 
+# Results are always stored in <dir>_results.db (see results_store.py).  Turn to
+# False to stop also appending them to <dir>_output.csv; the .csv can be
+# exported from the database later.
+write_legacy_csv = True
+
 # Locations of all stimulus. The user can change these.
 locations = {  # "Fix.jpg": [960.0, 540.0],
     "TopLeft_converted.avi": [480.0, 270.0],
@@ -71,41 +79,19 @@ locations = {  # "Fix.jpg": [960.0, 540.0],
     "BottomLeft_converted.avi": [480.0, 810.0],
     "BottomRight_converted.avi": [1440.0, 810.0]}
 
-# This is used for printing the headers to the CSV file at the end.
-header = [
-    'Stimulus',
-    # All for the longest fixation:
-    'Min Euclidean dist. (degrees)',
-    'Coordinates X',
-    'Coordinates Y',
-    'Duration (ms)',
-    'Precision SD X',
-    'Precision SD Y',
-    'Precision RMS X',
-    'Precision RMS Y']
+# For layouts with more targets (e.g. 9- or 13-point grids, or several targets on
+# the screen at once) the targets can be read from a layout file instead (see
+# target_layout.py; --layout on the command line).  Each fixation then goes to
+# the target nearest its average gaze position, not to its MediaName.
+layout = None
+
+# Screen size is read from (and saved to) this file.
+calibration_values_file = "./calibrationvalues.txt"
+
 
 ################################################################################
 ## Import libraries; define functions.
 ################################################################################
-if len(sys.argv) > 1:
-    dirname = sys.argv[1]
-else:
-    from tkinter import Tk
-
-    try:
-        from tkinter.filedialog import askdirectory
-    except:
-        print("Error! Run this script with Python3 (e.g. python3.4).\nExiting.\n")
-        exit()
-
-    # Make sure the TK() window doesn't appear, and doesn't keep the askdirectory up
-    root = Tk()
-    root.withdraw()
-    root.update()
-
-print(__doc__)
-
-
 def find_degree(scriptpix, tobiimm, userpix, usermm):
     """ For converting number of pixels to degree of visual angle.  The user
   needed to have input some of those values (screen resolution in MM and
@@ -153,93 +139,69 @@ def find_sd(points):
     return [tempx, tempy]
 
 
-################################################################################
-## Print some information about the script.
-################################################################################
+def screen_degrees(pixels, distAve, screen):
+    """ Converts <pixels> to degrees of visual angle, averaged over the
+  screen's height and width. """
+    height_screen = find_degree(pixels, distAve, screen['pix_height'], screen['mm_height'])
+    width_screen = find_degree(pixels, distAve, screen['pix_width'], screen['mm_width'])
+    return (height_screen + width_screen) / 2.0
 
-print("Verbose mode is %s\n" % verbose)
 
-################################################################################
-## Script begins.
-################################################################################
-participant_distances = []  # will contain part. name + calculated mean distance from screen
-
-# Choose folder with all cvs's in it
-# dirname = askdirectory()
-print("Using " + dirname)
-print("Printing a script summary to <%s>." % (dirname + '_summary.txt'))
-print("Printing results to file <%s>." % (dirname + '_output.csv'))
-
-# We need the screen size resolution and millimeters to output in degrees.
-mm_height, mm_width = -1., -1.
-pix_height, pix_width = -1., -1.
-usesame = False
-
-try:
-    with open("./calibrationvalues.txt", 'r') as oldvals:
-        mm_height = float(oldvals.readline())
-        mm_width = float(oldvals.readline())
-        pix_height = float(oldvals.readline())
-        pix_width = float(oldvals.readline())
-    print("Do you want to use the same values from last time? \n\
+def read_screen_values(ask=True):
+    """ We need the screen size resolution and millimeters to output in degrees.
+  Offers the values from last time (in calibrationvalues.txt) and asks for new
+  ones if there are none or the user doesn't want them.  With ask=False the
+  saved values are used without asking (None if there are none). """
+    mm_height, mm_width = -1., -1.
+    pix_height, pix_width = -1., -1.
+    usesame = False
+
+    try:
+        with open(calibration_values_file, 'r') as oldvals:
+            mm_height = float(oldvals.readline())
+            mm_width = float(oldvals.readline())
+            pix_height = float(oldvals.readline())
+            pix_width = float(oldvals.readline())
+        if not ask:
+            return {'mm_height': mm_height, 'mm_width': mm_width,
+                    'pix_height': pix_height, 'pix_width': pix_width}
+        print("Do you want to use the same values from last time? \n\
   screen height (MM): %s\n\
   screen width (MM): %s\n\
   screen height (pixels): %s\n\
   screen width (pixels): %s\n\
 You can say 'y', 'Y', 'yes', 'Yes', or anything else (e.g. 'n'):\n"
-          % (mm_height, mm_width,
-             pix_height, pix_width))
-    usesame_response = input()
-    if usesame_response.lower() in ['y', 'yes']:
-        usesame = True
-except:
-    pass
-
-if not usesame:
-    mm_height = float(input("What is your screen *height* \
+              % (mm_height, mm_width,
+                 pix_height, pix_width))
+        usesame_response = input()
+        if usesame_response.lower() in ['y', 'yes']:
+            usesame = True
+    except:
+        if not ask:
+            return None
+
+    if not usesame:
+        mm_height = float(input("What is your screen *height* \
 in millimeters? (e.g. 344): "))
-    mm_width = float(input("What is your screen *width* in \
+        mm_width = float(input("What is your screen *width* in \
 millimeters? (e.g. 594): "))
-    pix_height = float(input("What is your screen *height* \
+        pix_height = float(input("What is your screen *height* \
 (resolution) in pixels? (e.g. 1080): "))
-    pix_width = float(input("What is your screen *width* \
+        pix_width = float(input("What is your screen *width* \
 (resolution) in pixels? (e.g. 1920): "))
-    # and rewrite the file
-    with open("./calibrationvalues.txt", 'w') as newvals:
-        newvals.write('%s\n' % mm_height)
-        newvals.write('%s\n' % mm_width)
-        newvals.write('%s\n' % pix_height)
-        newvals.write('%s\n' % pix_width)
-
-# Properly formatted, information-rich CSVs that got processed.
-csv_names_processed = []
-# Non .csv files that got skipped.
-nonc_names_skipped = []
-# Improperly formatted or information-lacking CSVs that did NOT get processed.
-cvs_names_skipped = []
-
-dirList = os.listdir(dirname)
-dirList = sorted(dirList)
-
-# Make directory for problem files
-problem_dir = dirname + '_problemfiles'
-if os.path.isdir(problem_dir) is False:
-    os.mkdir(problem_dir)
+        # and rewrite the file
+        with open(calibration_values_file, 'w') as newvals:
+            newvals.write('%s\n' % mm_height)
+            newvals.write('%s\n' % mm_width)
+            newvals.write('%s\n' % pix_height)
+            newvals.write('%s\n' % pix_width)
 
-print(dirList)
+    return {'mm_height': mm_height, 'mm_width': mm_width,
+            'pix_height': pix_height, 'pix_width': pix_width}
 
 
-
-for file in dirList:
-
-    print("*********************************************************")
-    filename = dirname + "/" + file
-    # build filename, open, and read...
-    if (filename[-3:] != "csv" and filename[-3:] != "tsv"):
-        print("Found non .tsv/.csv file: \n" + filename)
-        nonc_names_skipped.append(filename)
-        continue
-
+def read_rows(filename):
+    """ Reads a .csv or .tsv export into a list of rows (lists of strings). """
     f = open(filename)
     if (filename[-3:] == "csv"):
         cf = csv.reader(f)
@@ -253,59 +215,53 @@ for file in dirList:
         d.append(row)
 
     f.close()
+    return d
 
-    # Things I need to store per stimulus:
-    # leakDuration["TopLeft.jpg"]["EuclideanDistance"] = 43.3  or whatever.
-    # Euclidean distance, coordinates, length of time, SD, RMS.
-
-    print("Done.\nBuilding data structures and finding the first fixation point... ")
-
-    ########################################################
-    # Process the first GOOD line in the file
-    line = 0
 
-    # Just find the index for the columns you care about, in
-    # case we end up changing where the columns go again.
+def find_columns(d):
+    """ Just find the index for the columns you care about, in
+  case we end up changing where the columns go again.  <d> needs the header
+  and at least one row of data.  Returns None if headers are missing. """
     # I assume the headers / row 0 is something like:
     # ParticipantName, RecordingDate, FixationFilter, MediaName, RecordingTimestamp,
     # FixationIndex, GazeEventDuration, GazePointX (ADCSpx), GazePointY (ADCSpx),
     # ValidityLeft, ValidityRight
 
-    MediaName, RecordingTimestamp = -1, -1
-    FixationIndex, GazeEventDuration = -1, -1
-    GazePointX, GazePointY, ValidityLeft, ValidityRight = -1, -1, -1, -1
-    DistanceLeft, DistanceRight = -1, -1  # Needed for outputting in degrees.
-    ParticipantName = ""
-
-    hasvalidity = True  # If you output ValidLeft and ValidRight columns.
+    col = SimpleNamespace(
+        MediaName=-1, RecordingTimestamp=-1,
+        FixationIndex=-1, GazeEventDuration=-1,
+        GazePointX=-1, GazePointY=-1, ValidityLeft=-1, ValidityRight=-1,
+        DistanceLeft=-1, DistanceRight=-1,  # Needed for outputting in degrees.
+        ParticipantName="",
+        hasvalidity=True)  # If you output ValidLeft and ValidRight columns.
 
     # will anyone want this case insensitive?
     for i in range(len(d[0])):
         if d[0][i] == "MediaName":
-            MediaName = i
+            col.MediaName = i
         elif d[0][i] == "ParticipantName":
-            ParticipantName = d[1][i]  # just store the name; don't need index.
+            col.ParticipantName = d[1][i]  # just store the name; don't need index.
         elif d[0][i] == "RecordingTimestamp":
-            RecordingTimestamp = i
+            col.RecordingTimestamp = i
         elif d[0][i] == "FixationIndex":
-            FixationIndex = i
+            col.FixationIndex = i
         elif d[0][i] == "GazeEventDuration":
-            GazeEventDuration = i
+            col.GazeEventDuration = i
         elif d[0][i] == "GazePointX (ADCSpx)":
-            GazePointX = i
+            col.GazePointX = i
         elif d[0][i] == "GazePointY (ADCSpx)":
-            GazePointY = i
+            col.GazePointY = i
         elif d[0][i] == "ValidityLeft":
-            ValidityLeft = i
+            col.ValidityLeft = i
         elif d[0][i] == "ValidityRight":
-            ValidityRight = i
+            col.ValidityRight = i
         elif d[0][i] == "DistanceLeft":
-            DistanceLeft = i
+            col.DistanceLeft = i
         elif d[0][i] == "DistanceRight":
-            DistanceRight = i
+            col.DistanceRight = i
 
-    if -1 in [MediaName, RecordingTimestamp, FixationIndex, GazeEventDuration,
-              GazePointX, GazePointY, DistanceLeft, DistanceRight]:
+    if -1 in [col.MediaName, col.RecordingTimestamp, col.FixationIndex, col.GazeEventDuration,
+              col.GazePointX, col.GazePointY, col.DistanceLeft, col.DistanceRight]:
         print("************************* ERROR ************************* \n\
 I didn't find some of the headers I was looking for. \
 Please check that your headers include these: \
@@ -317,31 +273,32 @@ Whichever of these values are -1 is a missing header:\n\
 MediaName = %i \nRecordingTimestamp = %i\nFixationIndex = %i\n\
 GazeEventDuration = %i\nGazePointX = %i\nGazePointY = %i\n\
 ValidityLeft = %i\nValidityRight = %i\nDistanceLeft = %i\n\
-DistanceRight = %i" % (MediaName, RecordingTimestamp, FixationIndex,
-                       GazeEventDuration, GazePointX, GazePointY, ValidityLeft, ValidityRight,
-                       DistanceLeft, DistanceRight))
-        cvs_names_skipped.append(filename)
-        print("Skipping file %s." % filename)
-        continue
+DistanceRight = %i" % (col.MediaName, col.RecordingTimestamp, col.FixationIndex,
+                       col.GazeEventDuration, col.GazePointX, col.GazePointY, col.ValidityLeft,
+                       col.ValidityRight, col.DistanceLeft, col.DistanceRight))
+        return None
 
-    if -1 in [ValidityLeft, ValidityRight]:
+    if -1 in [col.ValidityLeft, col.ValidityRight]:
         print("************************* ERROR ************************* \n \
 I didn't see columns for ValidityLeft or ValidityRight. If you have those,\n\
 please re-export your data with those columns.  This script will continue,\
 but I must assume\n\
 all the data you've exported is considered valid for one / both eyes.\n")
-        hasvalidity = False
+        col.hasvalidity = False
+
+    return col
 
-    if verbose:
-        print("Finding participant's average distance from screen...")
 
-        # Handle versions with key events (duplicate time stamps)
+def remove_duplicate_timestamps(d, col):
+    """ Handle versions with key events (duplicate time stamps).  Rows with
+  the same time stamp as the last one kept are removed from <d>, in place;
+  the row after a removed one and the very last row are always kept. """
     i = 1
-    time = d[1][RecordingTimestamp]
+    time = d[1][col.RecordingTimestamp]
     while i < len(d) - 1:  # Remove row with dup time stamp
-        temp = d[i][RecordingTimestamp]
+        temp = d[i][col.RecordingTimestamp]
         if temp == '-9999' or temp == '':
-            i = +1
+            i += 1
         elif temp != time:
             time = temp  # update time
             i += 1
@@ -349,75 +306,76 @@ all the data you've exported is considered valid for one / both eyes.\n")
             r = d.pop(i)
             i += 1
 
-    distLefts = []
-    distRights = []
+
+def distance_values(row, col):
+    """ (left, right) distance from the screen in one row, or None if either
+  one is missing. """
     # Can't use Pandas to import; it floats() them too hard, e.g. 123.01
     # becomes 123.0000000001.
-    for i in range(1, len(d)):
-        distLefts.append(d[i][DistanceLeft])
-        distRights.append(d[i][DistanceRight])
+    distLeft = row[col.DistanceLeft]
+    distRight = row[col.DistanceRight]
+    try:
+        if distLeft in ['', ' ', '0', '-9999']:
+            return None
+        elif distRight in ['', ' ', '0', '-9999']:
+            return None
+        else:
+            return (float(distLeft), float(distRight))
+    except:
+        print("Something went wrong slurping distance left <%s> and distance right <%s>" % (
+            distLeft, distRight))
+        exit()
 
-    newL = []
-    newR = []
-    for i in range(len(distLefts)):
-        try:
-            if distLefts[i] in ['', ' ', '0', '-9999']:
-                pass
-            elif distRights[i] in ['', ' ', '0', '-9999']:
-                pass
-            else:
-                newL.append(float(distLefts[i]))
-                newR.append(float(distRights[i]))
-        except:
-            print("Something went wrong slurping distance left <%s> and distance right <%s>" % (
-            distLefts[i], distRights[i]))
-            exit()
 
+def average_distance(newL, newR):
+    """ Participant's average distance from the screen. """
     if len(newL) != len(newR):
         print("Something went wrong finding average of distance from screen!")
         exit()
 
-    if len(newL) ==0:
-        print("No data - moving to problem directory")
-        # Move file to /problem_dir/
-        bname = os.path.basename(filename)
-        os.rename(filename, os.path.join(problem_dir, bname))
-        continue
-
-
     aveL = sum(newL) / len(newL)
     aveR = sum(newL) / len(newR)
-    distAve = (aveL + aveR) / 2.
+    return (aveL + aveR) / 2.
 
-    participant_distances.append(ParticipantName)
-    participant_distances.append(distAve)
 
-    if verbose: print("Found an average distance from screen of %s." % str(distAve))
+def find_first_stimulus(d, col):
+    """ Find first non-blank one (I assume you don't start immediately with a stim
+  on the screen).  Returns its line, or None. """
+    for i in range(1, len(d)):
+        if d[i][col.MediaName] != '' and d[i][col.MediaName] != '-9999':
+            return i
+    return None
+
+
+def leak_line(d, i, col):
+    """ What gets stored for line <i>, where a new FixationIndex starts. """
+    if col.hasvalidity:
+        return [i, d[i][col.MediaName], d[i][col.RecordingTimestamp],
+                d[i][col.FixationIndex], d[i][col.GazeEventDuration],
+                d[i][col.GazePointX], d[i][col.GazePointY], d[i][col.ValidityLeft],
+                d[i][col.ValidityRight]]
+    else:
+        return [i, d[i][col.MediaName], d[i][col.RecordingTimestamp],
+                d[i][col.FixationIndex], d[i][col.GazeEventDuration],
+                d[i][col.GazePointX], d[i][col.GazePointY]]
 
-    # We'll be using these to trigger changes.
-    currentMedia = ""
-    currentFixevent = -1
 
-    # Find first non-blank one (I assume you don't start immediately with a stim
-    # on the screen).
-    for i in range(1, len(d)):
-        if d[i][MediaName] != '' and d[i][MediaName]!='-9999':
-            currentMedia = d[i][MediaName]
-            currentFixevent = d[i][FixationIndex]
-            line = i
-            break
+def use_layout(filename):
+    """ Reads a target layout file (see target_layout.py).  From then on
+  <locations> holds its targets, and fixations are assigned to the nearest
+  one (see find_target_durations). """
+    global layout, locations
+    import target_layout  # needs numpy, which the MediaName matching doesn't
+    layout = target_layout.read_layout(filename)
+    locations = layout.locations()
+    return layout
 
-    if verbose:
-        print("Starting with stimulus %s, fixation index %s, at line %i..."
-              % (currentMedia, currentFixevent, line))
-        print("Starting at <range(%i, %i)>..." % (line, len(d)))
 
+def blank_durations():
+    """ The durations dictionary before any fixations are added. """
     # Init dictionary to later store longest duration.
     l_dur = {}
 
-    # init lists to later store all potential durations.
-    leakLines = []
-
     # based on stimuli, init blank spots for the dictionaries.
     for each in locations:
         # start a dictionary of fixation numbers, because I'll have to
@@ -427,58 +385,29 @@ all the data you've exported is considered valid for one / both eyes.\n")
         # [-1, -1, -1]
         # which is
         # [start line, end line, calculated duration]
+    return l_dur
 
-    print("Done.\nFinding all possible duration locations...")
-    ##### Find all potential markers for leak, duration
-    # Every time you hit a new FixationIndex, store that information for the Leak list.
-    for i in range(line, len(d)):
-        if currentFixevent != d[i][FixationIndex]:
-            # grab the line that changed.  The blank ones will contain timestamps we want.
-            if hasvalidity:
-                leakLines.append([i, d[i][MediaName], d[i][RecordingTimestamp],
-                                  d[i][FixationIndex], d[i][GazeEventDuration],
-                                  d[i][GazePointX], d[i][GazePointY], d[i][ValidityLeft],
-                                  d[i][ValidityRight]])
-            else:
-                leakLines.append([i, d[i][MediaName], d[i][RecordingTimestamp],
-                                  d[i][FixationIndex], d[i][GazeEventDuration],
-                                  d[i][GazePointX], d[i][GazePointY]])
-            currentFixevent = d[i][FixationIndex]  # and update fixation event.
-
-    ##### Find all potential markers for non leak, duration
-    # reset for non leak duration
-    currentMedia = d[line][MediaName]
-    currentFixevent = d[line][FixationIndex]
-    # every time you hit a new FixationIndex or new MediaName, store
-    # that information for the Leak list.
 
-    ##### Find the max duration actual lines and times.
-    ## Leak, duration
-    print("Finding maximum eye gaze duration...")
+def potential_fixations(leakLines, col):
+    """ Pairs up the lines where fixations start and end.  Returns a list of
+  (MediaName, fixation number, [start line, end line, duration]).
+  <leakLines> is not changed. """
+    fixations = []
 
     # In case the first fixation occurred before the first stimulus, we're not
     # using that at all; throw it away. You'll know because the first stim
     # fixation index is blank.
-
-    # Before you get here, you'll need to KNOW that you got files with some
-    # FixationIndex inside.  If you did not, log that and skip.
-    # This is for improperly formatted or information-lacking CSVs that
-    # did NOT get processed.
-    if len(leakLines) == 0:
-        cvs_names_skipped.append(filename)
-        print("I didn't find any fixations.  Skipping file: \n%s." % filename)
-        continue
-
+    start = 0
     if leakLines[0][3] == '' or leakLines[0][3] == '-9999':
         print("First line in leakLines was bad; removing.")
-        leakLines.pop(0)
+        start = 1
 
     #if leakLines[-1][3] == '' or leakLines[-1][3] == '-9999':
     #    print("Last line in leakLines was bad; removing.")
     #    leakLines.pop(-1)
 
 
-    for i in range(0, len(leakLines), 2): # Should be even number
+    for i in range(start, len(leakLines), 2): # Should be even number
         # If len(leakLines) is odd, don't consider the last index as the start of a fixation
         if i+1==len(leakLines):
           break
@@ -492,7 +421,7 @@ all the data you've exported is considered valid for one / both eyes.\n")
           continue
 
         # Ignore if this duration had invalid eye marks.
-        if hasvalidity:
+        if col.hasvalidity:
             if (leakLines[i][-1] != '0' and leakLines[i][-2] != '0'):
                 print("Invalid eye markers in this line; ignoring that as a \
 potential longest-duration: ")
@@ -506,13 +435,22 @@ potential longest-duration: ")
         templine.append(leakLines[i + 1][0])  # the line to stop reading at (don't include)
         templine.append(int(leakLines[i + 1][2]) - int(leakLines[i][2]))  # actual time this took.
         fixNumber = leakLines[i][3]
+        fixations.append((leakLines[i][1], fixNumber, templine))  # e.g. TopRight.avi
+
+    return fixations
+
+
+def find_durations(leakLines, col):
+    """ Pairs up the lines where fixations start and end into potential
+  durations per stimulus.  <leakLines> is not changed. """
+    l_dur = blank_durations()
 
+    for curKey, fixNumber, templine in potential_fixations(leakLines, col):
         # Compare to the existing longest duration and update if needed.
-        curKey = leakLines[i][1]  # e.g. TopRight.avi
         if curKey in l_dur.keys():
             #print("Key not found! I am looking for <%s> and couldn't it in \ your list of stimuli:" % curKey)
             #print(list(l_dur.keys()))
-            l_dur[leakLines[i][1]][fixNumber] = templine
+            l_dur[curKey][fixNumber] = templine
         #else:  # else keep track because later I'll need to sort by fixation length AND degrees accuracy
             # if templine[-1] > l_dur[leakLines[i][1]][-1]:
             #    l_dur[leakLines[i][1]] = templine
@@ -520,10 +458,166 @@ potential longest-duration: ")
     # At this point, the dictionaries contain stuff like:
     # 'TopLeft.avi': {'4': [6155, 6177, 73], '2': [5444, 5469, 84], '3': [6077, 6101, 80]},
     # 'TopRight.avi': {'1': [3839, 3862, 77]}
+    return l_dur
 
-    print("Loading data for all durations...")
-    # Now we need to go through the lines between e.g. 658 - 688 and
-    # store the X, Y coord pairs, etc etc.
+
+def average_gaze(d, col, start, end, screen):
+    """ Average (x, y) of the samples between lines <start> and <end> that
+  fixation_data() would keep, or None if there are none. """
+    points = []
+    for i in range(start, end):
+        if col.hasvalidity and d[i][col.ValidityLeft] != '0' and d[i][col.ValidityRight] != '0':
+            continue
+        try:
+            x, y = int(d[i][col.GazePointX]), int(d[i][col.GazePointY])
+        except ValueError:
+            continue
+        if 0 < x < int(screen['pix_width']) and 0 < y < int(screen['pix_height']):
+            points.append([x, y])
+    if len(points) == 0:
+        return None
+    return find_ave_xy(points)
+
+
+def find_target_durations(leakLines, d, col, screen):
+    """ find_durations() for a target layout: each potential fixation goes to
+  the target nearest its average gaze position, among the targets allowed
+  for its MediaName.  The targets of all fixations are found in one query. """
+    l_dur = blank_durations()
+
+    found = []
+    for media, fixNumber, templine in potential_fixations(leakLines, col):
+        if media == '' or media == '-9999':  # not during a stimulus
+            continue
+        # a fixation with no valid samples would be removed by add_fixation_data()
+        ave = average_gaze(d, col, templine[0], templine[1], screen)
+        if ave is not None:
+            found.append((media, fixNumber, templine, ave))
+    if len(found) == 0:
+        return l_dur
+
+    # average_gaze() keeps the means on the screen
+    area = (0, 0, int(screen['pix_width']), int(screen['pix_height']))
+    targets = layout.assign([f[3] for f in found], [f[0] for f in found], area)[0]
+    for (media, fixNumber, templine, ave), target in zip(found, targets):
+        if target >= 0:
+            l_dur[layout.names[target]][fixNumber] = templine
+    return l_dur
+
+
+def stimulus_durations(leakLines, d, col, screen):
+    """ Potential durations per stimulus: by MediaName, or by nearest target
+  if a layout is in use. """
+    if layout is None:
+        return find_durations(leakLines, col)
+    return find_target_durations(leakLines, d, col, screen)
+
+
+def fixation_data(d, col, templine, eachstimulus, eachfixation, screen, filename):
+    """ Goes through the lines between e.g. 658 - 688 of one potential
+  fixation and appends the X, Y coord pairs, average coordinates, Euclidean
+  distance to the stimulus, SD and RMS to <templine>.  Returns False if the
+  fixation had such bad data that it should be removed. """
+    keep = True
+    pix_width = screen['pix_width']
+    pix_height = screen['pix_height']
+    GazePointX, GazePointY = col.GazePointX, col.GazePointY
+    ValidityLeft, ValidityRight = col.ValidityLeft, col.ValidityRight
+
+    templine.append([])  # this empty list is about to hold all the (x,y) coordinates.
+    for i in range(templine[0], templine[1]):
+        if col.hasvalidity:
+            if (d[i][ValidityLeft] == '0') or (d[i][ValidityRight] == '0'):
+                if 0 < int(d[i][GazePointX]) < int(pix_width) and 0 < int(d[i][GazePointY]) < int(pix_height):
+                    try:
+                        templine[3].append(
+                            [int(d[i][GazePointX]), int(d[i][GazePointY])])
+                    except:
+                        print("Throwing exception at data line %i." % i)
+                        print("ValidityLeft = %i; ValidityRight = %i" % (ValidityLeft, ValidityRight))
+                        print("GazePointX = %i, GazePointY = %i" % (GazePointX, GazePointY))
+                        print("l_dur[eachstimulus][eachfixation] = ")
+                        print(templine)
+                        print("eachstimilus is currently %s; eachfixation is %s.\n\n\n\n\n" % (
+                        eachstimulus, eachfixation))
+                        exit()
+                elif verbose:
+                    print("The line contained negative values: %i, %i" % (
+                    int(d[i][GazePointX]), int(d[i][GazePointY])))
+
+        else:  # no Validity columns, but still check that it's within specified width and height.
+            if 0 < int(d[i][GazePointX]) < int(pix_width) and 0 < int(d[i][GazePointY]) < int(pix_height):
+                try:
+                    templine[3].append([int(d[i][GazePointX]), int(d[i][GazePointY])])
+                except:
+                    print("I tried to assume this line was valid but I can't find gaze points:")
+                    print(d[i])
+            elif verbose:
+                print("The line contained negative values: %i, %i" % (
+                int(d[i][GazePointX]), int(d[i][GazePointY])))
+
+    # Now dictionary also contains all the right points, e.g.
+    # 'TopRight.avi': {'1': [3839, 3862, 77, [[1442, 275], [1433, 281], [1437, 281], [1441, 287],
+    #   [1445, 272], [1446, 263], [1445, 283], [1454, 277], [1430, 268]]]},
+
+    if verbose:
+        print("Finding average points for %s / fix %s..." % (eachstimulus, eachfixation))
+    # Find the average (x,y) for the set of points.
+
+    try:
+        tempave = find_ave_xy(templine[3])
+    except:
+        tempave = "N/A"
+        print("Couldn't get average points for stimulus %s / fix %s, no values found." % (
+        eachstimulus, eachfixation))
+        if int(eachfixation) > -1:
+            print("\n\tThis fixation had such bad data (couldn't get any data from it)\
+\n\tthat I'll remove it from consideration.  If you think this is in error, you can go\
+\n\tback to the originating file (%s) and look at fixation #%s and verify that it's as\
+\n\tuniformative as I think it is.  Data that has caused this before is that at least\
+\n\tone eye was always a negative value.\n" % (filename.split('/')[-1], eachfixation))
+            keep = False
+
+    templine.append(tempave)
+
+    # Now dictionary contains the average points, e.g.,
+    # {'TopRight.avi': {'1': [3839, 3862, 77, [[1442, 275], [1433, 281], [1437, 281], [1441, 287],
+    # [1445, 283], [1454, 277], [1430, 268]], [1443.0869565217392, 275.95652173913044]]},
+
+    if verbose:
+        print("Finding Euclidean distance from average points to stimulus coordinates for %s / %s..." % (
+        eachstimulus, eachfixation))
+    # using the average points found above, find the Euclidean distance from average to actual stimulus points.
+    try:
+        temppoints = find_euclid_dist(templine[-1], locations[eachstimulus])
+        # [-1] because the last thing found was the average points.
+    except:
+        temppoints = "N/A"
+        print("Couldn't get Euclidean distance points for stimulus %s / %s, no values found." % (
+        eachstimulus, eachfixation))
+    templine.append(temppoints)
+
+    # Now dictionary includes euclidean distance, e.g. nonl_dur["Middle.jpg"] ==
+    # [327, 338, 643, [[979, 533], [977, 541], ... [969, 558], [974, 558]], (974, 554), 19.79898987322333]
+
+    if verbose:
+        print("Finding SD and RMS for points for %s / %s..." % (eachstimulus, eachfixation))
+    # Find the SD and RMS.
+    try:
+        tempsd = find_sd(templine[3])  # the last thing found was the average points.
+        temprms = find_rms(templine[3])
+    except:
+        tempsd = "N/A"
+        temprms = "N/A"
+
+    templine.append(tempsd)
+    templine.append(temprms)
+    return keep
+
+
+def add_fixation_data(l_dur, d, col, screen, filename):
+    """ Loads the data for all durations (see fixation_data) and removes
+  anything that was such bad data I should stop considering it. """
     # Eventually the l_dur[TopRight.jpg] =
     #     [start line, end line, total time, [all X, Y coordinates [][][]],
     #     [Average Coordinates], EuclideanDistance, SD, RMS]
@@ -531,94 +625,9 @@ potential longest-duration: ")
     remKeys = []  # to store datapoints I'll need to remove.
     for eachstimulus in l_dur:
         for eachfixation in l_dur[eachstimulus]:
-            l_dur[eachstimulus][eachfixation].append([])  # this empty list is about to hold all the (x,y) coordinates.
-            for i in range(l_dur[eachstimulus][eachfixation][0], l_dur[eachstimulus][eachfixation][1]):
-                if hasvalidity:
-                    if (d[i][ValidityLeft] == '0') or (d[i][ValidityRight] == '0'):
-                        if 0 < int(d[i][GazePointX]) < int(pix_width) and 0 < int(d[i][GazePointY]) < int(pix_height):
-                            try:
-                                l_dur[eachstimulus][eachfixation][3].append(
-                                    [int(d[i][GazePointX]), int(d[i][GazePointY])])
-                            except:
-                                print("Throwing exception at data line %i." % i)
-                                print("ValidityLeft = %i; ValidityRight = %i" % (ValidityLeft, ValidityRight))
-                                print("GazePointX = %i, GazePointY = %i" % (GazePointX, GazePointY))
-                                print("l_dur[eachstimulus][eachfixation] = ")
-                                print(l_dur[eachstimulus][eachfixation])
-                                print("eachstimilus is currently %s; eachfixation is %s.\n\n\n\n\n" % (
-                                eachstimulus, eachfixation))
-                                exit()
-                        elif verbose:
-                            print("The line contained negative values: %i, %i" % (
-                            int(d[i][GazePointX]), int(d[i][GazePointY])))
-
-                else:  # no Validity columns, but still check that it's within specified width and height.
-                    if 0 < int(d[i][GazePointX]) < int(pix_width) and 0 < int(d[i][GazePointY]) < int(pix_height):
-                        try:
-                            l_dur[eachstimulus][eachfixation][3].append([int(d[i][GazePointX]), int(d[i][GazePointY])])
-                        except:
-                            print("I tried to assume this line was valid but I can't find gaze points:")
-                            print(d[i])
-                    elif verbose:
-                        print("The line contained negative values: %i, %i" % (
-                        int(d[i][GazePointX]), int(d[i][GazePointY])))
-
-            # Now dictionary also contains all the right points, e.g.
-            # 'TopRight.avi': {'1': [3839, 3862, 77, [[1442, 275], [1433, 281], [1437, 281], [1441, 287],
-            #   [1445, 272], [1446, 263], [1445, 283], [1454, 277], [1430, 268]]]},
-
-            if verbose:
-                print("Finding average points for %s / fix %s..." % (eachstimulus, eachfixation))
-            # Find the average (x,y) for the set of points.
-
-            try:
-                tempave = find_ave_xy(l_dur[eachstimulus][eachfixation][3])
-            except:
-                tempave = "N/A"
-                print("Couldn't get average points for stimulus %s / fix %s, no values found." % (
-                eachstimulus, eachfixation))
-                if int(eachfixation) > -1:
-                    print("\n\tThis fixation had such bad data (couldn't get any data from it)\
-\n\tthat I'll remove it from consideration.  If you think this is in error, you can go\
-\n\tback to the originating file (%s) and look at fixation #%s and verify that it's as\
-\n\tuniformative as I think it is.  Data that has caused this before is that at least\
-\n\tone eye was always a negative value.\n" % (filename.split('/')[-1], eachfixation))
-                    remKeys.append((eachstimulus, eachfixation))
-
-            l_dur[eachstimulus][eachfixation].append(tempave)
-
-            # Now dictionary contains the average points, e.g.,
-            # {'TopRight.avi': {'1': [3839, 3862, 77, [[1442, 275], [1433, 281], [1437, 281], [1441, 287],
-            # [1445, 283], [1454, 277], [1430, 268]], [1443.0869565217392, 275.95652173913044]]},
-
-            if verbose:
-                print("Finding Euclidean distance from average points to stimulus coordinates for %s / %s..." % (
-                eachstimulus, eachfixation))
-            # using the average points found above, find the Euclidean distance from average to actual stimulus points.
-            try:
-                temppoints = find_euclid_dist(l_dur[eachstimulus][eachfixation][-1], locations[eachstimulus])
-                # [-1] because the last thing found was the average points.
-            except:
-                temppoints = "N/A"
-                print("Couldn't get Euclidean distance points for stimulus %s / %s, no values found." % (
-                eachstimulus, eachfixation))
-            l_dur[eachstimulus][eachfixation].append(temppoints)
-
-            # Now dictionary includes euclidean distance, e.g. nonl_dur["Middle.jpg"] ==
-            # [327, 338, 643, [[979, 533], [977, 541], ... [969, 558], [974, 558]], (974, 554), 19.79898987322333]
-
-            if verbose:
-                print("Finding SD and RMS for points for %s / %s..." % (eachstimulus, eachfixation))
-            # Find the SD and RMS.
-            try:
-                tempsd = find_sd(l_dur[eachstimulus][eachfixation][3])  # the last thing found was the average points.
-                temprms = find_rms(l_dur[eachstimulus][eachfixation][3])
-            except:
-                tempsd = "N/A"
-                temprms = "N/A"
-
-            l_dur[eachstimulus][eachfixation].append(tempsd)
-            l_dur[eachstimulus][eachfixation].append(temprms)
+            if not fixation_data(d, col, l_dur[eachstimulus][eachfixation], eachstimulus,
+                                 eachfixation, screen, filename):
+                remKeys.append((eachstimulus, eachfixation))
 
     # remove anything that was such bad data I should stop considering it.
     for (es, ef) in remKeys:
@@ -630,11 +639,11 @@ potential longest-duration: ")
     # start, end, duration, [all coordinates],         average coords,   euclid distance, SD, RMS.
     # [3839, 3862, 77, [[1442, 275], ... [1430, 268]], [1443.08, 275.9], 6.7, [7.28, 7.28], [10.65, 9.86]]},
 
-    print("Done.  Figuring out the longest fixations per stimulus less than 6 degrees...")
-    ########################################################
-    # Figure out which one I actually want.  It's got to the
-    # longest fixation under 6 degrees (<, not <=)
 
+def find_longest_fixations(l_dur, distAve, screen):
+    """ Figure out which one I actually want.  It's got to the
+  longest fixation under 6 degrees (<, not <=).  Each stimulus in <l_dur>
+  ends up holding just the fixation chosen. """
     if verbose:
         print("Durations dictionary, before removing fixations >= 6 degrees or finding longest duration:")
         for key in l_dur:
@@ -648,9 +657,7 @@ potential longest-duration: ")
             if eachfix == '-1':
                 pass
             else:
-                height_screen = find_degree(l_dur[eachstim][eachfix][-3], distAve, pix_height, mm_height)
-                width_screen = find_degree(l_dur[eachstim][eachfix][-3], distAve, pix_width, mm_width)
-                euclid_dist = (height_screen + width_screen) / 2.0
+                euclid_dist = screen_degrees(l_dur[eachstim][eachfix][-3], distAve, screen)
                 if euclid_dist >= 6.:
                     print("Stimulus %s, fixation #%s, degrees is %f >= 6, so removing from consideration." % (
                     eachstim, eachfix, euclid_dist))
@@ -677,13 +684,9 @@ potential longest-duration: ")
             # Are you tied? Keep the CLOSET fixation by degree.
             elif longestFixValue == l_dur[eachstim][curfix][2]:
                 # CURRENTLY KNOWN LONGEST FIXATION
-                height_screen = find_degree(l_dur[eachstim][longestFixIndex][-3], distAve, pix_height, mm_height)
-                width_screen = find_degree(l_dur[eachstim][longestFixIndex][-3], distAve, pix_width, mm_width)
-                longestFix_euclid_dist = (height_screen + width_screen) / 2.0
+                longestFix_euclid_dist = screen_degrees(l_dur[eachstim][longestFixIndex][-3], distAve, screen)
                 # THE FIX I JUST SAW
-                height_screen = find_degree(l_dur[eachstim][curfix][-3], distAve, pix_height, mm_height)
-                width_screen = find_degree(l_dur[eachstim][curfix][-3], distAve, pix_width, mm_width)
-                curfix_euclid_dist = (height_screen + width_screen) / 2.0
+                curfix_euclid_dist = screen_degrees(l_dur[eachstim][curfix][-3], distAve, screen)
 
                 print(
                     "There was a tie for longest fixation.  Old index %s / time %s / degree %s; new fix %s / time %s / degree %s." % (
@@ -703,181 +706,314 @@ potential longest-duration: ")
         for key in l_dur:
             print("l_dur[%s]: %s" % (key, str(l_dur[key])))
 
-    print("Done.  Printing to file...")
-
-    ########################################################
-    # Output data.
-    groupdata = []
-
-    # header = [
-    #  'Stimulus',
-    #  'Fix D / Min Euclid. dist.',
-    #  'Fix D coordinates',
-    #  'Fix D duration',
-    #  'SD',
-    #  'RMS']
-    groupdata.append([ParticipantName])
 
+def stimulus_records(l_dur, distAve, screen):
+    """ One record per stimulus, in degrees of visual angle; None if there was
+  no valid fixation. """
     # start, end, duration, [all coordinates], average coords, euclid distance, SD, RMS.
     # [283, 288, 653, [[1426, 796], [1427, 799], [1419, 799], [1419, 803], [1419, 805]], (1422, 800), 20.591260281974, (3, 3), (3, 2)]
     # DURATION -
     # [555, 564, 1789, [[475, 291], [472, 289], ... [491, 300]], (485, 296), 26.476404589747453, (9, 5), (7, 5)]
+    records = {}
+    for stim in locations:
+        if 'N/A' in l_dur[stim]:
+            records[stim] = None
+            continue
+        record = {}
+        ## for min euclid distance, Fix SD and Fix RMS
+        for (key, value) in [('min_dist', l_dur[stim][-3]),
+                             ('prec_sd_x', l_dur[stim][-2][0]), ('prec_sd_y', l_dur[stim][-2][1]),
+                             ('prec_rms_x', l_dur[stim][-1][0]), ('prec_rms_y', l_dur[stim][-1][1])]:
+            record[key] = screen_degrees(value, distAve, screen)
+        record['coord_x'] = l_dur[stim][-4][0]
+        record['coord_y'] = l_dur[stim][-4][1]
+        record['duration'] = l_dur[stim][2]
+        records[stim] = record
+    return records
+
+
+def process_file(filename, screen, problem_dir=None):
+    """ Finds the longest valid fixation on each stimulus in one export.
+  Returns (status, ParticipantName, distAve, records); status is 'processed',
+  'skipped' (e.g. missing headers or no fixations) or 'problem' (no distance
+  data; the file is moved to <problem_dir>). """
+    d = read_rows(filename)
 
-    groupdata.append(header)
+    # Things I need to store per stimulus:
+    # leakDuration["TopLeft.jpg"]["EuclideanDistance"] = 43.3  or whatever.
+    # Euclidean distance, coordinates, length of time, SD, RMS.
 
-    # sort them because it's irritating to be out of order
-    stims = []
-    for stim in locations:
-        stims.append(stim)
-    stims = sorted(stims)
+    print("Done.\nBuilding data structures and finding the first fixation point... ")
 
-    eucliddist_ave = []
-    averageSDD_x = []
-    averageSDD_y = []
-    averageRMSD_x = []
-    averageRMSD_y = []
+    ########################################################
+    # Process the first GOOD line in the file
+    col = find_columns(d)
+    if col is None:
+        print("Skipping file %s." % filename)
+        return 'skipped', None, None, None
+    ParticipantName = col.ParticipantName
 
-    for stim in stims:
-        if 'N/A' in l_dur[stim]:
-            groupdata.append([stim, 'N/A', 'N/A', 'N/A', 'N/A', 'N/A', 'N/A', 'N/A', 'N/A'])
-        else:
-            ## for min euclid distance:
-            height_screen = find_degree(l_dur[stim][-3], distAve, pix_height, mm_height)
-            width_screen = find_degree(l_dur[stim][-3], distAve, pix_width, mm_width)
-            euclid_dist = (height_screen + width_screen) / 2.0
-            eucliddist_ave.append(euclid_dist)
-            ## for Fix SD, X
-            height_screen = find_degree(l_dur[stim][-2][0], distAve, pix_height, mm_height)
-            width_screen = find_degree(l_dur[stim][-2][0], distAve, pix_width, mm_width)
-            fixsd_x = (height_screen + width_screen) / 2.0
-            averageSDD_x.append(fixsd_x)
-            ## for Fix SD, Y
-            height_screen = find_degree(l_dur[stim][-2][1], distAve, pix_height, mm_height)
-            width_screen = find_degree(l_dur[stim][-2][1], distAve, pix_width, mm_width)
-            fixsd_y = (height_screen + width_screen) / 2.0
-            averageSDD_y.append(fixsd_y)
-            ## for Fix RMS, X
-            height_screen = find_degree(l_dur[stim][-1][0], distAve, pix_height, mm_height)
-            width_screen = find_degree(l_dur[stim][-1][0], distAve, pix_width, mm_width)
-            fixrms_x = (height_screen + width_screen) / 2.0
-            averageRMSD_x.append(fixrms_x)
-            ## for Fix RMS, Y
-            height_screen = find_degree(l_dur[stim][-1][1], distAve, pix_height, mm_height)
-            width_screen = find_degree(l_dur[stim][-1][1], distAve, pix_width, mm_width)
-            fixrms_y = (height_screen + width_screen) / 2.0
-            averageRMSD_y.append(fixrms_y)
-
-            groupdata.append([
-                #  'Stimulus',
-                stim,
-                #  'Fix D / Min Euclid. dist.',
-                "%.2f" % euclid_dist,
-                #  'Fix D coordinates',
-                float("%.2f" % (l_dur[stim][-4][0])), float("%.2f" % (l_dur[stim][-4][1])),
-                #  'Fix D duration',
-                "%.2f" % (l_dur[stim][2]),
-                #  'SD',
-                float("%.2f" % fixsd_x), float("%.2f" % fixsd_y),
-                #  'RMS']
-                float("%.2f" % fixrms_x), float("%.2f" % fixrms_y)])
-
-    averageDistD = 0.0
-    averageCoordsD = [0.0, 0.0]
-    averageDurationD = 0.0
-    averageSDD = [0.0, 0.0]
-    averageRMSD = [0.0, 0.0]
-
-    divby = 0  # this will increment ONLY if there were valid values.
-    for stim in stims:
-        if 'N/A' not in l_dur[stim]:
-            divby += 1
-            averageCoordsD[0] += l_dur[stim][-4][0]
-            averageCoordsD[1] += l_dur[stim][-4][1]
-            averageDurationD += l_dur[stim][2]
-
-    if len(eucliddist_ave) > 0:
-        averageDistD = sum(eucliddist_ave) / len(eucliddist_ave)
-        averageSDD[0] = sum(averageSDD_x) / len(averageSDD_x)
-        averageSDD[1] = sum(averageSDD_y) / len(averageSDD_y)
-        averageRMSD[0] = sum(averageRMSD_x) / len(averageRMSD_x)
-        averageRMSD[1] = sum(averageRMSD_y) / len(averageRMSD_y)
+    if verbose:
+        print("Finding participant's average distance from screen...")
+
+    remove_duplicate_timestamps(d, col)
+
+    newL = []
+    newR = []
+    for i in range(1, len(d)):
+        dist = distance_values(d[i], col)
+        if dist is not None:
+            newL.append(dist[0])
+            newR.append(dist[1])
+
+    if len(newL) ==0:
+        print("No data - moving to problem directory")
+        # Move file to /problem_dir/
+        if problem_dir is not None:
+            bname = os.path.basename(filename)
+            os.rename(filename, os.path.join(problem_dir, bname))
+        return 'problem', ParticipantName, None, None
+
+    distAve = average_distance(newL, newR)
+
+    if verbose: print("Found an average distance from screen of %s." % str(distAve))
+
+    # We'll be using these to trigger changes.
+    currentMedia = ""
+    currentFixevent = -1
+    line = find_first_stimulus(d, col)
+    if line is None:
+        line = 0
+    else:
+        currentMedia = d[line][col.MediaName]
+        currentFixevent = d[line][col.FixationIndex]
+
+    if verbose:
+        print("Starting with stimulus %s, fixation index %s, at line %i..."
+              % (currentMedia, currentFixevent, line))
+        print("Starting at <range(%i, %i)>..." % (line, len(d)))
+
+    # init lists to later store all potential durations.
+    leakLines = []
+
+    print("Done.\nFinding all possible duration locations...")
+    ##### Find all potential markers for leak, duration
+    # Every time you hit a new FixationIndex, store that information for the Leak list.
+    for i in range(line, len(d)):
+        if currentFixevent != d[i][col.FixationIndex]:
+            # grab the line that changed.  The blank ones will contain timestamps we want.
+            leakLines.append(leak_line(d, i, col))
+            currentFixevent = d[i][col.FixationIndex]  # and update fixation event.
+
+    ##### Find the max duration actual lines and times.
+    ## Leak, duration
+    print("Finding maximum eye gaze duration...")
 
     # Before you get here, you'll need to KNOW that you got files with some
-    # FixationIndex inside.  If you did not, here is where you log that and skip.
-    # Improperly formatted or information-lacking CSVs that did NOT get processed.
-    if divby == 0:
-        cvs_names_skipped.append(filename)
-        print("I found fixations, but not on stimuli. Skipping file %s." % filename)
-        continue
-
-    averageDistD = "%.2f" % averageDistD
-    averageCoordsD[0] = float("%.2f" % (averageCoordsD[0] / divby))
-    averageCoordsD[1] = float("%.2f" % (averageCoordsD[1] / divby))
-    averageDurationD = "%.2f" % (averageDurationD / divby)
-    averageSDD[0] = float("%.2f" % averageSDD[0])
-    averageSDD[1] = float("%.2f" % averageSDD[1])
-    averageRMSD[0] = float("%.2f" % averageRMSD[0])
-    averageRMSD[1] = float("%.2f" % averageRMSD[1])
-
-    groupdata.append(["Averages:",
-                      averageDistD, averageCoordsD[0], averageCoordsD[1], averageDurationD,
-                      averageSDD[0], averageSDD[1], averageRMSD[0], averageRMSD[1]])
-
-    ## Lastly, print the tally of valid / total stimuli:
-    groupdata.append(["Number valid:", "%s / %s points" % (divby, len(locations))])
-
-    with open(dirname + '_output.csv', 'a', newline='') as fp:
-        wf = csv.writer(fp, delimiter=',')
-        wf.writerows(groupdata)
-
-    print("Done with this file!")
-
-    # Increment tally of good files.
-    csv_names_processed.append(filename)
-
-print("*********************************************************")
-print("\nWrote results to file <%s>.  \nWriting summary to <%s>..."
-      % (dirname + '_output.csv', dirname + '_summary.txt'))
-logf = open(dirname + '_summary.txt', 'a')
-logf.write("------ Script finish at time %s with results: ------" %
-           (str(datetime.datetime.now())))
-logf.write("\n\nNon-csv files skipped: %i" % len(nonc_names_skipped))
-if len(nonc_names_skipped) > 0:
-    logf.write("\nFile names:")
-    for item in nonc_names_skipped:
-        logf.write('\n' + item)
-
-logf.write("\n\nCSV files processed: %i" % len(csv_names_processed))
-if len(csv_names_processed) > 0:
-    logf.write("\nFile names:")
-    for item in csv_names_processed:
-        logf.write('\n' + item)
-
-logf.write("\n\nCSV files skipped (e.g., due to no fixation indices on stimuli, \
+    # FixationIndex inside.  If you did not, log that and skip.
+    # This is for improperly formatted or information-lacking CSVs that
+    # did NOT get processed.
+    if len(leakLines) == 0:
+        print("I didn't find any fixations.  Skipping file: \n%s." % filename)
+        return 'skipped', ParticipantName, distAve, None
+
+    l_dur = stimulus_durations(leakLines, d, col, screen)
+
+    print("Loading data for all durations...")
+    # Now we need to go through the lines between e.g. 658 - 688 and
+    # store the X, Y coord pairs, etc etc.
+    add_fixation_data(l_dur, d, col, screen, filename)
+
+    print("Done.  Figuring out the longest fixations per stimulus less than 6 degrees...")
+    find_longest_fixations(l_dur, distAve, screen)
+
+    return 'processed', ParticipantName, distAve, stimulus_records(l_dur, distAve, screen)
+
+
+def write_summary(dirname, csv_names_processed, nonc_names_skipped, cvs_names_skipped):
+    """ The summary log file lists files processed or skipped. """
+    logf = open(dirname + '_summary.txt', 'a')
+    logf.write("------ Script finish at time %s with results: ------" %
+               (str(datetime.datetime.now())))
+    logf.write("\n\nNon-csv files skipped: %i" % len(nonc_names_skipped))
+    if len(nonc_names_skipped) > 0:
+        logf.write("\nFile names:")
+        for item in nonc_names_skipped:
+            logf.write('\n' + item)
+
+    logf.write("\n\nCSV files processed: %i" % len(csv_names_processed))
+    if len(csv_names_processed) > 0:
+        logf.write("\nFile names:")
+        for item in csv_names_processed:
+            logf.write('\n' + item)
+
+    logf.write("\n\nCSV files skipped (e.g., due to no fixation indices on stimuli, \
 or no fixations at all, etc.): %i" % len(cvs_names_skipped))
-if len(cvs_names_skipped) > 0:
-    logf.write("\nFile names:")
-    for item in cvs_names_skipped:
-        logf.write('\n' + item)
+    if len(cvs_names_skipped) > 0:
+        logf.write("\nFile names:")
+        for item in cvs_names_skipped:
+            logf.write('\n' + item)
+
+    logf.write('\n\n')
+    logf.close()
+
+
+def write_distances(dirname, participant_distances):
+    """ <participant_distances> holds part. name + calculated mean distance
+  from screen, for each file. """
+    logf = open(dirname + '_distances_summary.csv', 'a')
+    aveDist = 0
+
+    logf.write("Participant Name, Ave. Distance\n")
+    for i in range(0, len(participant_distances), 2):
+        logf.write("%s, %s\n" % (participant_distances[i], participant_distances[i + 1]))
+        aveDist += participant_distances[i + 1]
+
+    aveDist /= len(participant_distances) / 2
+    logf.write("Ave. dist. to screen, %s" % aveDist)
+    logf.close()
+
+
+def process_directory(dirname, screen):
+    """ Processes every .csv / .tsv export in <dirname>. """
+    participant_distances = []  # will contain part. name + calculated mean distance from screen
+
+    # Everything besides the input file that changes the results; part of the
+    # key results are stored under.
+    run_params = dict(screen)
+    run_params['locations'] = locations
+    if layout is not None:
+        run_params['layout'] = layout.params()
+    results_db = results_store.connect(dirname + '_results.db')
+
+    # Properly formatted, information-rich CSVs that got processed.
+    csv_names_processed = []
+    # Non .csv files that got skipped.
+    nonc_names_skipped = []
+    # Improperly formatted or information-lacking CSVs that did NOT get processed.
+    cvs_names_skipped = []
+
+    dirList = os.listdir(dirname)
+    dirList = sorted(dirList)
+
+    # Make directory for problem files
+    problem_dir = dirname + '_problemfiles'
+    if os.path.isdir(problem_dir) is False:
+        os.mkdir(problem_dir)
+
+    print(dirList)
+
+
+
+    for file in dirList:
+
+        print("*********************************************************")
+        filename = dirname + "/" + file
+        # build filename, open, and read...
+        if (filename[-3:] != "csv" and filename[-3:] != "tsv"):
+            print("Found non .tsv/.csv file: \n" + filename)
+            nonc_names_skipped.append(filename)
+            continue
+
+        status, ParticipantName, distAve, records = process_file(filename, screen, problem_dir)
+        if status == 'problem':
+            continue
+        if distAve is not None:
+            participant_distances.append(ParticipantName)
+            participant_distances.append(distAve)
+        if status == 'skipped':
+            cvs_names_skipped.append(filename)
+            continue
+
+        print("Done.  Printing to file...")
+
+        groupdata = results_store.legacy_rows(ParticipantName, records, len(locations))
+
+        # Before you get here, you'll need to KNOW that you got files with some
+        # FixationIndex inside.  If you did not, here is where you log that and skip.
+        # Improperly formatted or information-lacking CSVs that did NOT get processed.
+        if groupdata is None:
+            cvs_names_skipped.append(filename)
+            print("I found fixations, but not on stimuli. Skipping file %s." % filename)
+            continue
+
+        results_store.store_results(results_db, results_store.file_hash(filename), run_params,
+                                    ParticipantName, filename, distAve, records)
+
+        if write_legacy_csv:
+            with open(dirname + '_output.csv', 'a', newline='') as fp:
+                wf = csv.writer(fp, delimiter=',')
+                wf.writerows(groupdata)
+
+        print("Done with this file!")
+
+        # Increment tally of good files.
+        csv_names_processed.append(filename)
+
+    results_db.close()
+
+    print("*********************************************************")
+    print("\nWrote results to file <%s>.  \nWriting summary to <%s>..."
+          % (dirname + '_output.csv', dirname + '_summary.txt'))
+    write_summary(dirname, csv_names_processed, nonc_names_skipped, cvs_names_skipped)
+
+    print("*********************************************************")
+    print("\nWriting distance-to-screen summary to <%s>..."
+          % (dirname + '_distances_summary.csv'))
+    write_distances(dirname, participant_distances)
+
+    print("Done!\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Longest valid fixation on each calibration "
+                                                 "stimulus, for every export in a folder.")
+    parser.add_argument('dirname', nargs='?', help="folder of .csv / .tsv exports (default: choose "
+                                                   "one in a dialog)")
+    parser.add_argument('--layout', help="target layout file (see target_layout.py)")
+    args = parser.parse_args()
+
+    if args.dirname is not None:
+        dirname = args.dirname
+    else:
+        from tkinter import Tk
+
+        try:
+            from tkinter.filedialog import askdirectory
+        except:
+            print("Error! Run this script with Python3 (e.g. python3.4).\nExiting.\n")
+            exit()
+
+        # Make sure the TK() window doesn't appear, and doesn't keep the askdirectory up
+        root = Tk()
+        root.withdraw()
+        root.update()
+
+        # Choose folder with all cvs's in it
+        dirname = askdirectory()
 
-logf.write('\n\n')
-logf.close()
+    print(__doc__)
 
-print("*********************************************************")
-print("\nWriting distance-to-screen summary to <%s>..."
-      % (dirname + '_distances_summary.csv'))
-logf = open(dirname + '_distances_summary.csv', 'a')
-aveDist = 0
+    ################################################################################
+    ## Print some information about the script.
+    ################################################################################
 
-logf.write("Participant Name, Ave. Distance\n")
-for i in range(0, len(participant_distances), 2):
-    logf.write("%s, %s\n" % (participant_distances[i], participant_distances[i + 1]))
-    aveDist += participant_distances[i + 1]
+    print("Verbose mode is %s\n" % verbose)
+    if args.layout is not None:
+        use_layout(args.layout)
+        print("Using the %i targets in %s.\n" % (len(layout), args.layout))
 
-aveDist /= len(participant_distances) / 2
-logf.write("Ave. dist. to screen, %s" % aveDist)
-logf.close()
+    ################################################################################
+    ## Script begins.
+    ################################################################################
+    print("Using " + dirname)
+    print("Printing a script summary to <%s>." % (dirname + '_summary.txt'))
+    print("Printing results to file <%s>." % (dirname + '_output.csv'))
+    print("Storing results in <%s>." % (dirname + '_results.db'))
 
-print("Done!\n")
+    screen = read_screen_values()
+    process_directory(dirname, screen)
 
 
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,302 @@
+#!/usr/bin/python3
+# Live calibration quality, while the Tobii export is still being written.
+#
+# Follows a growing .tsv / .csv export (e.g. one the recorder is appending to)
+# and, as rows arrive, updates the fixation runs and the accuracy / precision
+# of the longest valid fixation on each stimulus, so the experimenter can tell
+# during the visit whether the calibration is good enough.  Once the file stops
+# growing (or on Ctrl-C) the results are exactly those calibration.py gives
+# for the finished file.
+#
+#   python3 calibration_live.py path/to/export.tsv
+#   python3 calibration_live.py path/to/export.tsv --screen 344 594 1080 1920 --store dir_results.db
+#   python3 calibration_live.py path/to/export.tsv --layout layouts/five_point.csv
+#
+# Screen size comes from calibrationvalues.txt (run calibration.py once to
+# save it) unless --screen is given.
+import argparse
+import csv
+import io
+import locale
+import os
+import sys
+import time
+from contextlib import redirect_stdout
+
+import calibration
+import results_store
+
+
+class FollowFile:
+    """ Reads the lines appended to a file since the last call.  A line still
+  being written (no newline yet) is held back until it's finished. """
+
+    def __init__(self, filename):
+        self.f = open(filename, 'rb')
+        self.partial = b''
+        self.encoding = locale.getpreferredencoding(False)
+
+    def read_lines(self, final=False):
+        """ New complete lines (decoded, without line endings).  With final=True,
+  an unfinished last line is returned too. """
+        data = self.partial + self.f.read()
+        lines = data.split(b'\n')
+        self.partial = lines.pop()
+        if final and self.partial != b'':
+            lines.append(self.partial)
+            self.partial = b''
+        return [line.rstrip(b'\r').decode(self.encoding) for line in lines]
+
+    def close(self):
+        self.f.close()
+
+
+class LiveCalibration:
+    """ calibration.py's computation for one export, fed a few rows at a
+  time.  Duplicate time stamps are removed, the distance to the screen is
+  averaged and the lines where fixations start are found as rows arrive; the
+  per-fixation data of each finished fixation is only computed once. """
+
+    def __init__(self, filename, screen):
+        self.filename = filename
+        self.screen = screen
+        self.d = []  # header + rows kept, as calibration.py's <d>
+        self.col = None
+        self.n_rows = 0  # rows read, including duplicates
+        # remove_duplicate_timestamps, one row at a time.  The last row read is
+        # held back, because the last row of a file is never examined.
+        self.pending = None
+        self.time = None
+        self.skip_next = False
+        # running sum for average_distance
+        self.sumL = 0
+        self.nDist = 0
+        # leakLines, found as rows are kept
+        self.line = None  # first line with a stimulus
+        self.currentFixevent = -1
+        self.leakLines = []
+        # fixation_data results, by (stimulus, fixation, start line, end line)
+        self.fixations = {}
+        self.finished = False
+
+    def add_rows(self, rows):
+        """ Adds rows (lists of strings) in the order they appear in the
+  file; the first one is the header. """
+        for row in rows:
+            if len(self.d) == 0:
+                self.d.append(row)
+                continue
+            self.n_rows += 1
+            if self.col is None:
+                self.col = calibration.find_columns([self.d[0], row])
+                if self.col is None:
+                    raise ValueError("%s is missing required headers" % self.filename)
+                self.time = row[self.col.RecordingTimestamp]
+            if self.pending is not None:
+                self._examine(self.pending)
+            self.pending = row
+
+    def _examine(self, row):
+        if self.skip_next:  # the row after a removed one is never examined
+            self.skip_next = False
+            self._keep(row)
+            return
+        temp = row[self.col.RecordingTimestamp]
+        if temp == '-9999' or temp == '':
+            self._keep(row)
+        elif temp != self.time:
+            self.time = temp  # update time
+            self._keep(row)
+        else:  # same time stamp as the one before; drop it
+            self.skip_next = True
+
+    def _keep(self, row):
+        self.d.append(row)
+        i = len(self.d) - 1
+
+        dist = calibration.distance_values(row, self.col)
+        if dist is not None:
+            self.sumL += dist[0]
+            self.nDist += 1
+
+        if self.line is None:
+            if row[self.col.MediaName] != '' and row[self.col.MediaName] != '-9999':
+                self.line = i
+                self.currentFixevent = row[self.col.FixationIndex]
+            return
+        self._scan(i)
+
+    def _scan(self, i):
+        if self.currentFixevent != self.d[i][self.col.FixationIndex]:
+            self.leakLines.append(calibration.leak_line(self.d, i, self.col))
+            self.currentFixevent = self.d[i][self.col.FixationIndex]
+
+    def finish(self):
+        """ Call once the file is complete. """
+        if self.finished:
+            return
+        self.finished = True
+        if self.pending is not None:
+            self._keep(self.pending)
+            self.pending = None
+        if self.line is None and len(self.d) > 1:
+            # no stimulus at all; calibration.py then starts from line 0
+            self.line = 0
+            self.currentFixevent = -1
+            for i in range(0, len(self.d)):
+                self._scan(i)
+
+    def distance(self):
+        """ Average distance from the screen so far (None if no data). """
+        if self.nDist == 0:
+            return None
+        aveL = self.sumL / self.nDist
+        aveR = self.sumL / self.nDist
+        return (aveL + aveR) / 2.
+
+    def records(self):
+        """ Stimulus records (see calibration.stimulus_records) for the rows so
+  far, or None if there are no fixations or no distance data yet. """
+        distAve = self.distance()
+        if distAve is None or len(self.leakLines) == 0:
+            return None
+
+        with redirect_stdout(io.StringIO()):
+            l_dur = calibration.stimulus_durations(self.leakLines, self.d, self.col, self.screen)
+
+            remKeys = []
+            for eachstimulus in l_dur:
+                for eachfixation in l_dur[eachstimulus]:
+                    templine = l_dur[eachstimulus][eachfixation]
+                    key = (eachstimulus, eachfixation, templine[0], templine[1])
+                    if key not in self.fixations:
+                        data = list(templine)
+                        keep = calibration.fixation_data(self.d, self.col, data, eachstimulus,
+                                                         eachfixation, self.screen, self.filename)
+                        self.fixations[key] = (data[3:], keep)
+                    (data, keep) = self.fixations[key]
+                    templine.extend(data)
+                    if not keep:
+                        remKeys.append((eachstimulus, eachfixation))
+            for (es, ef) in remKeys:
+                del l_dur[es][ef]
+
+            calibration.find_longest_fixations(l_dur, distAve, self.screen)
+            return calibration.stimulus_records(l_dur, distAve, self.screen)
+
+
+def format_records(records):
+    """ One line per stimulus for the final report. """
+    lines = ["%-26s %9s %8s %8s %8s %8s %8s" % ('Stimulus', 'Dur (ms)', 'Dist', 'SD X', 'SD Y',
+                                                 'RMS X', 'RMS Y')]
+    for stim in sorted(records):
+        rec = records[stim]
+        if rec is None:
+            lines.append("%-26s %9s" % (stim, 'N/A'))
+        else:
+            lines.append("%-26s %9.0f %8.2f %8.2f %8.2f %8.2f %8.2f" % (
+                stim, rec['duration'], rec['min_dist'], rec['prec_sd_x'], rec['prec_sd_y'],
+                rec['prec_rms_x'], rec['prec_rms_y']))
+    return '\n'.join(lines)
+
+
+def format_batch(live, records, n_new, ms):
+    """ Status line printed after each batch of rows. """
+    text = "%7i rows (+%i) in %6.1f ms" % (live.n_rows, n_new, ms)
+    if records is None:
+        return text + "; no fixations on stimuli yet"
+    valid = [s for s in records if records[s] is not None]
+    text += "; distance %.0f mm; %i / %i valid" % (live.distance(), len(valid), len(records))
+    for stim in sorted(valid):
+        text += " | %s %.2f deg %.0f ms" % (stim.split('_')[0], records[stim]['min_dist'],
+                                           records[stim]['duration'])
+    return text
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Follow a growing Tobii export and report "
+                                                 "calibration quality as it is recorded.")
+    parser.add_argument('filename', help=".tsv or .csv export")
+    parser.add_argument('--screen', type=float, nargs=4,
+                        metavar=('MM_HEIGHT', 'MM_WIDTH', 'PIX_HEIGHT', 'PIX_WIDTH'),
+                        help="screen size (default: from calibrationvalues.txt)")
+    parser.add_argument('--interval', type=float, default=0.5, help="seconds between reads (default 0.5)")
+    parser.add_argument('--idle', type=float, default=30.,
+                        help="finish when the file hasn't grown for this many seconds (default 30)")
+    parser.add_argument('--store', help="results database to store the final results in")
+    parser.add_argument('--layout', help="target layout file (see target_layout.py)")
+    args = parser.parse_args(argv)
+
+    if args.layout is not None:
+        calibration.use_layout(args.layout)
+
+    if args.screen is not None:
+        screen = dict(zip(['mm_height', 'mm_width', 'pix_height', 'pix_width'], args.screen))
+    else:
+        screen = calibration.read_screen_values(ask=False)
+        if screen is None:
+            print("No screen size found in %s; run calibration.py once or use --screen."
+                  % calibration.calibration_values_file)
+            exit()
+
+    delimiter = ',' if args.filename[-3:] == "csv" else '\t'
+
+    while not os.path.exists(args.filename):
+        print("Waiting for %s..." % args.filename)
+        time.sleep(max(args.interval, 1.))
+
+    tail = FollowFile(args.filename)
+    live = LiveCalibration(args.filename, screen)
+    print("Following %s (Ctrl-C to finish)" % args.filename)
+
+    def batch(lines):
+        start = time.perf_counter()
+        n_before = live.n_rows
+        live.add_rows(csv.reader(lines, delimiter=delimiter))
+        records = live.records()
+        ms = (time.perf_counter() - start) * 1000.
+        return records, live.n_rows - n_before, ms
+
+    last_growth = time.time()
+    try:
+        while True:
+            lines = tail.read_lines()
+            if len(lines) > 0:
+                records, n_new, ms = batch(lines)
+                print(format_batch(live, records, n_new, ms))
+                last_growth = time.time()
+            elif time.time() - last_growth > args.idle:
+                print("No new data for %g s." % args.idle)
+                break
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        pass
+
+    start = time.perf_counter()
+    live.add_rows(csv.reader(tail.read_lines(final=True), delimiter=delimiter))
+    live.finish()
+    records = live.records()
+    ms = (time.perf_counter() - start) * 1000.
+    tail.close()
+
+    print("\nFinished %s: %i rows, %.1f ms for the last batch." % (args.filename, live.n_rows, ms))
+    if records is None:
+        print("No fixations on stimuli (or no distance data) found.")
+        return
+    print("Participant %s, average distance %.1f mm" % (live.col.ParticipantName, live.distance()))
+    print(format_records(records))
+
+    if args.store is not None:
+        run_params = dict(screen)
+        run_params['locations'] = calibration.locations
+        if calibration.layout is not None:
+            run_params['layout'] = calibration.layout.params()
+        conn = results_store.connect(args.store)
+        results_store.store_results(conn, results_store.file_hash(args.filename), run_params,
+                                    live.col.ParticipantName, args.filename, live.distance(), records)
+        conn.close()
+        print("Stored results in %s" % args.store)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
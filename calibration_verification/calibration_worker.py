@@ -0,0 +1,246 @@
+#!/usr/bin/python3
+# Long-running worker for calibration.py and reformat_calibration_verification.py.
+#
+# Starting a new python3 for every participant directory means paying, each
+# time, for the interpreter, the pandas / NumPy imports of the reformatter,
+# reading the screen size and target layout, and printing calibration.py's
+# banner; for small directories that is most of the run time.  The worker is
+# started once, with the modules and the screen / layout already loaded, and
+# listens on a Unix socket; jobs are run by a pool of processes forked from it.
+# Each job writes exactly the files the command line would
+# (<dir>_output.csv, <dir>_results.db, ...), and its printed output is sent
+# back to the client.
+#
+#   python3 calibration_worker.py serve --jobs 8 &
+#   python3 calibration_worker.py submit calibration path/to/dir1 path/to/dir2
+#   python3 calibration_worker.py submit reformat path/to/dir1_output.csv
+#   python3 calibration_worker.py status
+#   python3 calibration_worker.py stop
+#
+# The screen size comes from calibrationvalues.txt (in the directory the worker
+# is started from) unless --screen is given.
+import argparse
+import concurrent.futures
+import io
+import json
+import multiprocessing
+import os
+import socket
+import socketserver
+import sys
+import tempfile
+import threading
+import time
+import traceback
+from contextlib import redirect_stdout
+
+import calibration
+
+try:
+    import reformat_calibration_verification
+    reformat_error = None
+except ImportError as e:  # e.g. no pandas; calibration jobs still work
+    reformat_calibration_verification = None
+    reformat_error = "%s: %s" % (type(e).__name__, e)
+
+DEFAULT_SOCKET = os.path.join(tempfile.gettempdir(), 'calibration_worker-%i.sock' % os.getuid())
+COMMANDS = ['calibration', 'reformat']
+
+screen = None  # set by serve() before the pool is forked
+
+
+def run_job(command, path):
+    """ Runs one job in a pool process.  Returns a dict with 'status' ('ok' or
+  the error), 'output' (what was printed) and 'seconds'. """
+    start = time.time()
+    out = io.StringIO()
+    status = 'ok'
+    try:
+        with redirect_stdout(out):
+            if command == 'calibration':
+                calibration.process_directory(path, screen)
+            elif reformat_calibration_verification is None:
+                status = "failed: reformat_calibration_verification can't be imported (%s)" % reformat_error
+            else:
+                reformat_calibration_verification.reformat(path)
+    except (Exception, SystemExit):  # calibration.py calls exit() on some bad input
+        status = "failed: %s" % traceback.format_exc().strip().split('\n')[-1]
+        out.write(traceback.format_exc())
+    return {'status': status, 'output': out.getvalue(), 'seconds': time.time() - start}
+
+
+class Handler(socketserver.StreamRequestHandler):
+    """ One request per connection: a line of json, answered with a line of
+  json. """
+
+    def handle(self):
+        line = self.rfile.readline()
+        if line.strip() == b'':
+            return  # socket_in_use() connecting and hanging up
+        try:
+            reply = self.server.dispatch(json.loads(line.decode('utf-8')))
+        except Exception as e:
+            reply = {'status': "failed: %s: %s" % (type(e).__name__, e)}
+        try:
+            self.wfile.write((json.dumps(reply) + '\n').encode('utf-8'))
+        except BrokenPipeError:
+            pass  # the client gave up waiting
+
+
+class WorkerServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path, pool, info):
+        socketserver.UnixStreamServer.__init__(self, path, Handler)
+        self.pool = pool
+        self.info = info
+        self.n_done = 0
+        self.lock = threading.Lock()  # requests are handled in their own threads
+
+    def dispatch(self, request):
+        command = request.get('command')
+        if command == 'status':
+            with self.lock:
+                n_done = self.n_done
+            return dict(self.info, status='ok', jobs_done=n_done)
+        if command == 'stop':
+            threading.Thread(target=self.shutdown).start()
+            return {'status': 'ok'}
+        if command not in COMMANDS:
+            return {'status': "failed: unknown command %r" % command}
+        reply = self.pool.apply(run_job, (command, request['path']))
+        with self.lock:
+            self.n_done += 1
+        return reply
+
+
+def socket_in_use(path):
+    """ Whether a worker is already listening on <path>. """
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        s.connect(path)
+        return True
+    except OSError:
+        return False
+    finally:
+        s.close()
+
+
+def serve(path, jobs, screen_values, layout_file=None):
+    global screen
+    if os.path.exists(path):
+        if socket_in_use(path):
+            print("A worker is already listening on %s." % path)
+            exit(1)
+        os.remove(path)  # left over from a worker that didn't stop cleanly
+    screen = screen_values
+    if layout_file is not None:
+        calibration.use_layout(layout_file)
+
+    # the pool processes are forked from here, so they start with everything
+    # above already imported and loaded
+    pool = multiprocessing.get_context('fork').Pool(jobs)
+    info = {'pid': os.getpid(), 'jobs': jobs, 'screen': screen, 'layout': layout_file,
+            'reformat': reformat_error is None}
+    server = WorkerServer(path, pool, info)
+    print("Calibration worker %i listening on %s (%i processes)" % (os.getpid(), path, jobs))
+    if reformat_error is not None:
+        print("reformat jobs are unavailable: %s" % reformat_error)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        pool.terminate()
+        if os.path.exists(path):
+            os.remove(path)
+    print("Worker stopped after %i jobs." % server.n_done)
+
+
+def request(path, message):
+    """ Sends one request to the worker on <path> and returns its reply. """
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        s.connect(path)
+        s.sendall((json.dumps(message) + '\n').encode('utf-8'))
+        f = s.makefile('rb')
+        line = f.readline()
+        f.close()
+    finally:
+        s.close()
+    if line == b'':
+        raise ConnectionError("the worker closed the connection")
+    return json.loads(line.decode('utf-8'))
+
+
+def submit(path, command, paths):
+    """ Submits one job per path (all at once, so the worker's processes
+  share them) and prints each job's output as it finishes.  Returns the
+  number of jobs that failed. """
+    # relative to where the client runs, but otherwise as given: calibration.py
+    # names its outputs <dirname>_output.csv etc., so a trailing / matters
+    jobs = [p if os.path.isabs(p) else os.path.join(os.getcwd(), p) for p in paths]
+    n_failed = 0
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, len(jobs))) as threads:
+        futures = {threads.submit(request, path, {'command': command, 'path': job}): job
+                   for job in jobs}
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                reply = future.result()
+            except OSError as e:
+                reply = {'status': "failed: %s" % e, 'output': ''}
+            sys.stdout.write(reply.get('output', ''))
+            print("%s: %s (%.2f s)" % (futures[future], reply['status'], reply.get('seconds', 0.)))
+            n_failed += reply['status'] != 'ok'
+    return n_failed
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Long-running worker for calibration.py and "
+                                                 "reformat_calibration_verification.py.")
+    parser.add_argument('--socket', default=DEFAULT_SOCKET, help="default: %s" % DEFAULT_SOCKET)
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('serve', help="start a worker")
+    p.add_argument('--jobs', type=int, default=os.cpu_count(), help="processes (default: number of CPUs)")
+    p.add_argument('--screen', type=float, nargs=4,
+                   metavar=('MM_HEIGHT', 'MM_WIDTH', 'PIX_HEIGHT', 'PIX_WIDTH'),
+                   help="screen size (default: from calibrationvalues.txt)")
+    p.add_argument('--layout', help="target layout file (see target_layout.py)")
+
+    p = sub.add_parser('submit', help="run jobs on the worker")
+    p.add_argument('job', choices=COMMANDS, help="calibration: a directory of exports; "
+                                                 "reformat: a calibration.py _output.csv")
+    p.add_argument('paths', nargs='+')
+
+    sub.add_parser('status', help="show what the worker has loaded")
+    sub.add_parser('stop', help="stop the worker")
+    args = parser.parse_args(argv)
+
+    if args.command == 'serve':
+        if args.screen is not None:
+            screen_values = dict(zip(['mm_height', 'mm_width', 'pix_height', 'pix_width'], args.screen))
+        else:
+            screen_values = calibration.read_screen_values(ask=False)
+            if screen_values is None:
+                print("No screen size found in %s; run calibration.py once or use --screen."
+                      % calibration.calibration_values_file)
+                exit(1)
+        serve(args.socket, max(1, args.jobs), screen_values, args.layout)
+        return
+
+    if not socket_in_use(args.socket):
+        print("No worker is listening on %s; start one with: python3 calibration_worker.py serve"
+              % args.socket)
+        exit(1)
+    if args.command == 'submit':
+        if submit(args.socket, args.job, args.paths) > 0:
+            exit(1)
+    else:
+        reply = request(args.socket, {'command': args.command})
+        print(json.dumps(reply, indent=1))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,253 @@
+#!/usr/bin/python3
+# Precision over time, for whole recordings.
+#
+# calibration.py reports precision (SD and sample-to-sample RMS) only for the
+# longest valid fixation on each stimulus.  This computes the same measures,
+# plus the percentage of data lost, in windows sliding over the whole
+# recording and over each trial (run of samples with the same stimulus), so
+# drift within a session shows up.  Samples count as valid by the same rules
+# as in calibration.py (a validity code of 0 for either eye, gaze on the
+# screen), and RMS is taken between consecutive valid samples within a window,
+# as find_rms() does for a fixation.  Values are in degrees of visual angle,
+# from the participant's average distance to the screen.  Windows are in
+# milliseconds of RecordingTimestamp, not in samples, so a window covers the
+# same stretch of time however many samples were dropped (or removed as
+# duplicates) in it; data loss is counted against the samples expected at
+# --rate.  Rows with no usable RecordingTimestamp are left out, and where the
+# time stamps go back the windows start over.
+#
+# The windows were first strided views over a fixed number of samples
+# (as_strided, as numpy 1.15 has no sliding_window_view).  Windows in time
+# hold different numbers of samples, so they can't be views of one shape;
+# sums over each window are instead taken from cumulative sums, at the rows
+# np.searchsorted() finds for its start and end, which is also one pass over
+# the data however many windows overlap.
+#
+#   python3 precision_series.py path/to/export.tsv
+#   python3 precision_series.py path/to/dir/ --window 500 --step 100 --screen 344 594 1080 1920
+#
+# writes path/to/export_precision.npz for each export, with one row per
+# window: 'trial' (0 for the windows over the whole recording, then 1, 2, ...
+# for the trials named in 'trial_names'), 'start' (first row of the export in
+# the window, after duplicate time stamps are removed; rows in the window are
+# those after it with a time stamp in the window), 'time' (when the
+# window starts), 'width' (ms; shorter than --window for a trial shorter than
+# that), 'n_valid', 'loss' (%), 'sd_x', 'sd_y', 'rms_x', 'rms_y'.
+import argparse
+import os
+import sys
+
+import numpy as np
+
+import calibration
+
+def degrees(pixels, distAve, screen):
+    """ calibration.screen_degrees() for an array of pixel values. """
+    def half_angle(pix, mm):
+        return np.degrees(np.arctan((pixels / 2.) / ((distAve * pix) / mm))) * 2.
+    return (half_angle(screen['pix_height'], screen['mm_height']) +
+            half_angle(screen['pix_width'], screen['mm_width'])) / 2.0
+
+
+def to_float(values):
+    out = np.full(len(values), np.nan)
+    for i, v in enumerate(values):
+        try:
+            out[i] = float(v)
+        except ValueError:
+            pass
+    return out
+
+
+def sample_arrays(d, col, screen):
+    """ Time, gaze, validity and stimulus of each row of an export read by
+  calibration.read_rows() (after calibration.remove_duplicate_timestamps()). """
+    rows = d[1:]
+    time = to_float([r[col.RecordingTimestamp] for r in rows])
+    x = to_float([r[col.GazePointX] for r in rows])
+    y = to_float([r[col.GazePointY] for r in rows])
+    with np.errstate(invalid='ignore'):
+        valid = ((0 < x) & (x < int(screen['pix_width'])) &
+                 (0 < y) & (y < int(screen['pix_height'])))
+    if col.hasvalidity:
+        valid &= (np.array([r[col.ValidityLeft] == '0' for r in rows], dtype=bool) |
+                  np.array([r[col.ValidityRight] == '0' for r in rows], dtype=bool))
+    media = np.array([r[col.MediaName] for r in rows], dtype=object)
+    return time, x, y, valid, media
+
+
+def window_bounds(time, width, step, interval):
+    """ Windows of <width> ms starting every <step> ms from the first time
+  stamp, over samples <interval> ms apart (the last sample covers
+  <interval> too); one window over everything if it's shorter than <width>.
+  Returns (start time, first row, end row, length in ms) of each. """
+    duration = time[-1] - time[0] + interval
+    if duration < width:
+        t = time[:1]
+        width = duration
+    else:
+        t = time[0] + step * np.arange(int(np.floor((duration - width) / step + 1e-9)) + 1)
+    lo = np.searchsorted(time, t, 'left')
+    hi = np.searchsorted(time, t + width, 'left')
+    return t, lo, hi, np.full(len(t), width)
+
+
+def window_stats(time, x, y, valid, width, step, rate):
+    """ n_valid, SD and RMS (in pixels) of x and y in windows of <width> ms of
+  recording time (the whole series if it's shorter) starting every <step>
+  ms, going by the time stamps, so dropped samples shorten a window instead
+  of stretching it.  Returns a dict of arrays: 'start' (first sample of each
+  window), 'time' (when it starts), 'width' (ms) and 'expected' (samples at
+  <rate> Hz). """
+    keys = ['start', 'time', 'width', 'expected', 'n_valid', 'sd_x', 'sd_y', 'rms_x', 'rms_y']
+    if len(x) == 0:
+        return {k: np.zeros(0) for k in keys}
+    t, lo, hi, w = window_bounds(time, width, step, 1000. / rate)
+
+    def window_sum(a):
+        c = np.concatenate([[0.], np.cumsum(a)])
+        return c[hi] - c[lo]
+
+    out = {'start': lo, 'time': t, 'width': w, 'expected': w * rate / 1000.}
+    n_valid = window_sum(valid)
+    out['n_valid'] = n_valid
+
+    # squared step from the previous valid sample; in each window only its
+    # first valid sample steps from outside the window
+    idx = np.arange(len(x))
+    prev = np.maximum.accumulate(np.where(valid, idx, -1))
+    prev = np.concatenate([[-1], prev[:-1]])
+    next_valid = np.minimum.accumulate(np.where(valid, idx, len(x))[::-1])[::-1]
+    first = np.minimum(next_valid[np.minimum(lo, len(x) - 1)], len(x) - 1)
+    has_first = (lo < len(x)) & (first < hi)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for a, key in [(x, 'x'), (y, 'y')]:
+            # centred first, so the sums of squares don't lose precision
+            v = np.where(valid, a - a[valid].mean() if valid.any() else a, 0.)
+            mean = window_sum(v) / n_valid
+            out['sd_' + key] = np.sqrt(np.maximum(window_sum(v ** 2) / n_valid - mean ** 2, 0.))
+            d2 = np.where(valid & (prev >= 0), (v - v[np.maximum(prev, 0)]) ** 2, 0.)
+            steps = np.maximum(window_sum(d2) - np.where(has_first, d2[first], 0.), 0.)
+            out['rms_' + key] = np.sqrt(steps / n_valid)
+    return out
+
+
+def time_runs(time):
+    """ (first row, end row) of each run of rows whose time stamps don't go
+  back. """
+    back = np.flatnonzero(time[1:] < time[:-1]) + 1
+    bounds = np.concatenate([[0], back, [len(time)]])
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def trial_runs(media):
+    """ (name, first row, end row) of each run of rows showing a stimulus. """
+    if len(media) == 0:
+        return []
+    change = np.flatnonzero(media[1:] != media[:-1]) + 1
+    bounds = np.concatenate([[0], change, [len(media)]])
+    return [(media[a], a, b) for a, b in zip(bounds[:-1], bounds[1:])
+            if media[a] not in ('', '-9999')]
+
+
+def precision_series(filename, screen, width, step, rate):
+    """ Sliding-window precision for one export.  Returns (ParticipantName,
+  distAve, trial names, dict of arrays), or None if the export can't be
+  used. """
+    d = calibration.read_rows(filename)
+    col = calibration.find_columns(d)
+    if col is None:
+        return None
+    calibration.remove_duplicate_timestamps(d, col)
+    dists = [calibration.distance_values(row, col) for row in d[1:]]
+    dists = [dist for dist in dists if dist is not None]
+    if len(dists) == 0:
+        print("No distance data in %s; skipping." % filename)
+        return None
+    distAve = calibration.average_distance([dl for dl, dr in dists], [dr for dl, dr in dists])
+
+    time, x, y, valid, media = sample_arrays(d, col, screen)
+    # rows with an empty, -9999 or non-numeric time stamp can't be put in a window
+    rows = np.flatnonzero(np.isfinite(time) & (time != -9999))
+    if len(rows) == 0:
+        print("No time stamps in %s; skipping." % filename)
+        return None
+    time, x, y, valid, media = time[rows], x[rows], y[rows], valid[rows], media[rows]
+    # np.searchsorted() needs the time stamps in order; where they go back
+    # (e.g. a recording restarted), each stretch is windowed on its own
+    pieces = time_runs(time)
+    if len(pieces) > 1:
+        print("%s: time stamps go back %i times; windowing each stretch separately."
+              % (filename, len(pieces) - 1))
+    runs = trial_runs(media)
+    parts = [(0, a, b) for a, b in pieces]
+    parts += [(t + 1, max(a, p), min(b, q)) for t, (name, a, b) in enumerate(runs)
+              for p, q in pieces if max(a, p) < min(b, q)]
+
+    series = []
+    for trial, a, b in parts:
+        stats = window_stats(time[a:b], x[a:b], y[a:b], valid[a:b], width, step, rate)
+        stats['start'] = rows[np.minimum(stats['start'].astype(np.int64) + a, len(rows) - 1)]
+        stats['trial'] = np.full(len(stats['start']), trial, dtype=np.int16)
+        series.append(stats)
+    out = {k: np.concatenate([s[k] for s in series]) for k in series[0]}
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        loss = np.clip(100. * (1. - out['n_valid'] / out['expected']), 0., 100.)
+    result = {'trial': out['trial'], 'start': out['start'], 'time': out['time'],
+              'width': out['width'].astype(np.float32), 'n_valid': out['n_valid'].astype(np.int32),
+              'loss': loss.astype(np.float32)}
+    for key in ['sd_x', 'sd_y', 'rms_x', 'rms_y']:
+        result[key] = degrees(out[key], distAve, screen).astype(np.float32)
+    return col.ParticipantName, distAve, [name for name, a, b in runs], result
+
+
+def export_files(path):
+    if os.path.isfile(path):
+        return [path]
+    return [os.path.join(path, f) for f in sorted(os.listdir(path))
+            if f[-3:] in ('csv', 'tsv') and os.path.isfile(os.path.join(path, f))]
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Precision (SD, RMS) and data loss in windows "
+                                                 "sliding over whole calibration recordings.")
+    parser.add_argument('path', help=".tsv / .csv export, or a directory of them")
+    parser.add_argument('--window', type=float, default=500., help="window length in ms (default 500)")
+    parser.add_argument('--step', type=float, default=100., help="ms between windows (default 100)")
+    parser.add_argument('--rate', type=float, default=300., help="sampling rate in Hz (default 300)")
+    parser.add_argument('--screen', type=float, nargs=4,
+                        metavar=('MM_HEIGHT', 'MM_WIDTH', 'PIX_HEIGHT', 'PIX_WIDTH'),
+                        help="screen size (default: from calibrationvalues.txt)")
+    args = parser.parse_args(argv)
+
+    if args.screen is not None:
+        screen = dict(zip(['mm_height', 'mm_width', 'pix_height', 'pix_width'], args.screen))
+    else:
+        screen = calibration.read_screen_values(ask=False)
+        if screen is None:
+            print("No screen size found in %s; run calibration.py once or use --screen."
+                  % calibration.calibration_values_file)
+            exit()
+    if args.window <= 0 or args.step <= 0:
+        print("--window and --step must be above 0.")
+        exit(1)
+
+    for filename in export_files(args.path):
+        result = precision_series(filename, screen, args.window, args.step, args.rate)
+        if result is None:
+            continue
+        name, distAve, trial_names, series = result
+        out_file = os.path.splitext(filename)[0] + '_precision.npz'
+        np.savez_compressed(out_file, trial_names=np.array(trial_names, dtype=str),
+                            participant=name, dist_ave=distAve, window=args.window, step=args.step,
+                            rate=args.rate, **series)
+        whole = series['trial'] == 0
+        print("%s: %i windows, %i trials; median RMS %.2f / %.2f deg, median loss %.1f%% -> %s" % (
+            name, whole.sum(), len(trial_names), np.nanmedian(series['rms_x'][whole]),
+            np.nanmedian(series['rms_y'][whole]), np.nanmedian(series['loss'][whole]), out_file))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -36,73 +36,74 @@ def pull_participant_data(df_slice):
 	df_slice.index=[partic]*len(df_slice)
 	return df_slice
 
-filename = sys.argv[1]
-#filename = '/Users/sifre002/Box/sifre002/9_ExcelSpreadsheets/Dancing_Ladies/CalVer_output/DL1_output.csv'
-base_name = os.path.basename(filename)
-base_name = os.path.splitext(base_name)[0]
-
-dir_name = os.path.dirname(filename)
-print('- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -')
-print('Reformatting data, input file =' + filename)
-print('- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -')
-
-########################################
-# Read data 
-#######################################
-
-# Check that file type is either a .csv or .tsv
-if(filename[-3:] != "csv" and filename[-3:] != "tsv"):
-	print("Found non .tsv/.csv file: \n" + filename + "\n terminating script")
-	quit()
-	
-
-# Read in file
-if(filename[-3:]=="csv"):
-	df = pd.read_csv(filename, header=1)
-else:
-	df = pd.read_csv(filename, header=1, delimiter='\t')
-
-# Rename columns for easier programming
-df = df.rename(columns={'Min Euclidean dist. (degrees)': "MinDist", 
-					'Coordinates X': 'CoordX',
-					'Coordinates Y': 'CoordY',
-					'Duration (ms)': 'Dur',
-					'Precision SD X': 'PrecSDx',
-					'Precision SD Y': 'PrecSDy',
-					'Precision RMS X': 'PrecRMSx',
-					'Precision RMS Y': 'PrecRMSy'})
-
-# Add first ID back in
-partic_id = return_first_id(filename)
-temp = pd.DataFrame([[partic_id, np.nan,np.nan,np.nan,np.nan,np.nan,np.nan,np.nan,np.nan]], columns=list(df.columns))
-df = temp.append(df, ignore_index = True)
-
-# Remove all the sub-headers
-df=df.loc[~df.Stimulus.str.contains('Stimulus'), :]
-df.index=range(len(df))
-
-########################################
-# Reformat 
-#######################################
-
-# Loop through DataFrame and reformat data. Save in <output>.
-output = pd.DataFrame(columns={"Stimulus", "MinDist", "CoordX","CoordY", "Dur", "PrecSDx", "PrecSDy", "PrecRMSx", "PrecRMSy"})
-partic_indices =  find_new_participant_row(df)
-for i in range(0, len(partic_indices)-1):
-	if i==len(partic_indices): # special case - last participant in spreadsheet
-		data_slice=df.iloc[partic_indices[i]:df.shape[0]] 
+def reformat(filename):
+	# Reformats one calibration.py output file (<dir>_output.csv) into
+	# <dir>_output_reformatted.csv.  Returns the path written, or None.
+	#filename = '/Users/sifre002/Box/sifre002/9_ExcelSpreadsheets/Dancing_Ladies/CalVer_output/DL1_output.csv'
+	base_name = os.path.basename(filename)
+	base_name = os.path.splitext(base_name)[0]
+
+	dir_name = os.path.dirname(filename)
+	print('- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -')
+	print('Reformatting data, input file =' + filename)
+	print('- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -')
+
+	########################################
+	# Read data 
+	#######################################
+
+	# Check that file type is either a .csv or .tsv
+	if(filename[-3:] != "csv" and filename[-3:] != "tsv"):
+		print("Found non .tsv/.csv file: \n" + filename + "\n terminating script")
+		return None
+
+
+	# Read in file
+	if(filename[-3:]=="csv"):
+		df = pd.read_csv(filename, header=1)
 	else:
-		data_slice=df.iloc[partic_indices[i]:partic_indices[i+1]]
-	output=output.append(pull_participant_data(data_slice),sort=True)
-
-########################################
-# Save
-#######################################
-{dir_name + "/" + base_name + "_reformatted.csv"}
-output.to_csv (dir_name + "/" + base_name + "_reformatted.csv", index = True, header=True)
-
-
-
-
-
-
+		df = pd.read_csv(filename, header=1, delimiter='\t')
+
+	# Rename columns for easier programming
+	df = df.rename(columns={'Min Euclidean dist. (degrees)': "MinDist", 
+						'Coordinates X': 'CoordX',
+						'Coordinates Y': 'CoordY',
+						'Duration (ms)': 'Dur',
+						'Precision SD X': 'PrecSDx',
+						'Precision SD Y': 'PrecSDy',
+						'Precision RMS X': 'PrecRMSx',
+						'Precision RMS Y': 'PrecRMSy'})
+
+	# Add first ID back in
+	partic_id = return_first_id(filename)
+	temp = pd.DataFrame([[partic_id, np.nan,np.nan,np.nan,np.nan,np.nan,np.nan,np.nan,np.nan]], columns=list(df.columns))
+	df = temp.append(df, ignore_index = True)
+
+	# Remove all the sub-headers
+	df=df.loc[~df.Stimulus.str.contains('Stimulus'), :]
+	df.index=range(len(df))
+
+	########################################
+	# Reformat 
+	#######################################
+
+	# Loop through DataFrame and reformat data. Save in <output>.
+	output = pd.DataFrame(columns={"Stimulus", "MinDist", "CoordX","CoordY", "Dur", "PrecSDx", "PrecSDy", "PrecRMSx", "PrecRMSy"})
+	partic_indices =  find_new_participant_row(df)
+	for i in range(0, len(partic_indices)-1):
+		if i==len(partic_indices): # special case - last participant in spreadsheet
+			data_slice=df.iloc[partic_indices[i]:df.shape[0]] 
+		else:
+			data_slice=df.iloc[partic_indices[i]:partic_indices[i+1]]
+		output=output.append(pull_participant_data(data_slice),sort=True)
+
+	########################################
+	# Save
+	#######################################
+	{dir_name + "/" + base_name + "_reformatted.csv"}
+	output.to_csv (dir_name + "/" + base_name + "_reformatted.csv", index = True, header=True)
+	return dir_name + "/" + base_name + "_reformatted.csv"
+
+
+if __name__ == '__main__':
+	reformat(sys.argv[1])
@@ -0,0 +1,232 @@
+#!/usr/bin/python3
+# Structured results store for calibration.py.
+#
+# calibration.py keeps one row per participant x stimulus in a SQLite database
+# (<dir>_results.db) next to its usual outputs.  Rows are keyed by the hash of
+# the input file and of the parameters it was processed with (screen size,
+# stimulus locations), so re-running a file replaces its rows instead of
+# appending another block.  The database is in WAL mode, so many
+# calibration.py processes can write to it at once.
+#
+# To export the legacy <dir>_output.csv layout, or long-formatted data (the
+# same layout as reformat_calibration_verification.py's output):
+#   python3 results_store.py export path/to/dir_results.db path/to/output.csv
+#   python3 results_store.py export --long path/to/dir_results.db path/to/reformatted.csv
+import csv
+import datetime
+import hashlib
+import json
+import sqlite3
+import sys
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    file_hash TEXT NOT NULL,
+    params_hash TEXT NOT NULL,
+    participant TEXT NOT NULL,
+    source_file TEXT,
+    params TEXT,  -- json
+    distance REAL,  -- average eye-to-screen distance (mm)
+    n_stimuli INTEGER,
+    processed_at TEXT,
+    PRIMARY KEY (file_hash, params_hash)
+);
+CREATE TABLE IF NOT EXISTS results (
+    file_hash TEXT NOT NULL,
+    params_hash TEXT NOT NULL,
+    stimulus TEXT NOT NULL,
+    participant TEXT NOT NULL,
+    -- NULL when there was no valid fixation on the stimulus
+    min_dist REAL,  -- degrees
+    coord_x REAL,
+    coord_y REAL,
+    duration REAL,  -- ms
+    prec_sd_x REAL,  -- degrees
+    prec_sd_y REAL,
+    prec_rms_x REAL,
+    prec_rms_y REAL,
+    PRIMARY KEY (file_hash, params_hash, stimulus)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS results_participant ON results (participant, stimulus);
+"""
+
+# order of the measures in a stimulus record, and in the legacy .csv
+MEASURES = ['min_dist', 'coord_x', 'coord_y', 'duration', 'prec_sd_x', 'prec_sd_y',
+            'prec_rms_x', 'prec_rms_y']
+
+# This is used for printing the headers to the CSV file.
+header = [
+    'Stimulus',
+    # All for the longest fixation:
+    'Min Euclidean dist. (degrees)',
+    'Coordinates X',
+    'Coordinates Y',
+    'Duration (ms)',
+    'Precision SD X',
+    'Precision SD Y',
+    'Precision RMS X',
+    'Precision RMS Y']
+
+# Column names used by reformat_calibration_verification.py
+long_header = ['', 'CoordX', 'CoordY', 'Dur', 'MinDist', 'PrecRMSx', 'PrecRMSy', 'PrecSDx',
+               'PrecSDy', 'Stimulus']
+
+
+def connect(db_path):
+    """ Opens (and if needed creates) a results database.  WAL mode lets
+  readers and one writer at a time work in parallel; other writers wait for
+  the lock instead of failing. """
+    conn = sqlite3.connect(db_path, timeout=300, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def file_hash(filename):
+    """ sha1 of the contents of <filename>. """
+    h = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def params_hash(params):
+    """ <params> is a dict of everything (besides the input file) that
+  changes the results, e.g. screen size and stimulus locations. """
+    return hashlib.sha1(json.dumps(params, sort_keys=True).encode()).hexdigest()
+
+
+def store_results(conn, fhash, params, participant, source_file, distance, records):
+    """ Upserts the results for one input file.  <records> maps stimulus name to a
+  dict of MEASURES (unrounded), or to None if there was no valid fixation. """
+    phash = params_hash(params)
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute("""INSERT INTO runs VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (file_hash, params_hash) DO UPDATE SET
+            participant = excluded.participant, source_file = excluded.source_file,
+            distance = excluded.distance, n_stimuli = excluded.n_stimuli,
+            processed_at = excluded.processed_at""",
+                     (fhash, phash, participant, source_file, json.dumps(params, sort_keys=True),
+                      distance, len(records), str(datetime.datetime.now())))
+        conn.execute("DELETE FROM results WHERE file_hash = ? AND params_hash = ?", (fhash, phash))
+        conn.executemany("INSERT INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                         [[fhash, phash, stim, participant] +
+                          [None if rec is None else rec[m] for m in MEASURES]
+                          for stim, rec in records.items()])
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+
+
+def legacy_rows(participant, records, n_locations):
+    """ Builds the rows calibration.py appends to <dir>_output.csv for one
+  participant: name, header, one row per stimulus (sorted), averages and the
+  number of valid stimuli.  Returns None if no stimulus had a valid fixation. """
+    groupdata = [[participant], header]
+    valid = []
+    for stim in sorted(records):
+        rec = records[stim]
+        if rec is None:
+            groupdata.append([stim, 'N/A', 'N/A', 'N/A', 'N/A', 'N/A', 'N/A', 'N/A', 'N/A'])
+            continue
+        valid.append(rec)
+        groupdata.append([
+            stim,
+            "%.2f" % rec['min_dist'],
+            float("%.2f" % rec['coord_x']), float("%.2f" % rec['coord_y']),
+            "%.2f" % rec['duration'],
+            float("%.2f" % rec['prec_sd_x']), float("%.2f" % rec['prec_sd_y']),
+            float("%.2f" % rec['prec_rms_x']), float("%.2f" % rec['prec_rms_y'])])
+
+    divby = len(valid)
+    if divby == 0:
+        return None
+
+    def average(m):
+        return sum([rec[m] for rec in valid]) / divby
+
+    averageCoordsD = [0.0, 0.0]
+    averageDurationD = 0.0
+    for rec in valid:
+        averageCoordsD[0] += rec['coord_x']
+        averageCoordsD[1] += rec['coord_y']
+        averageDurationD += rec['duration']
+
+    groupdata.append(["Averages:",
+                      "%.2f" % average('min_dist'),
+                      float("%.2f" % (averageCoordsD[0] / divby)),
+                      float("%.2f" % (averageCoordsD[1] / divby)),
+                      "%.2f" % (averageDurationD / divby),
+                      float("%.2f" % average('prec_sd_x')), float("%.2f" % average('prec_sd_y')),
+                      float("%.2f" % average('prec_rms_x')), float("%.2f" % average('prec_rms_y'))])
+
+    ## Lastly, print the tally of valid / total stimuli:
+    groupdata.append(["Number valid:", "%s / %s points" % (divby, n_locations)])
+    return groupdata
+
+
+def load_runs(conn, phash=None):
+    """ Yields (participant, records, n_stimuli) for each stored input file,
+  in the order they were first processed. """
+    sql = "SELECT rowid, file_hash, params_hash, participant, n_stimuli FROM runs"
+    args = []
+    if phash is not None:
+        sql += " WHERE params_hash = ?"
+        args.append(phash)
+    for (_, fhash, ph, participant, n_stimuli) in conn.execute(sql + " ORDER BY rowid", args).fetchall():
+        records = {}
+        for row in conn.execute("SELECT stimulus, %s FROM results WHERE file_hash = ? AND params_hash = ?"
+                                % ', '.join(MEASURES), (fhash, ph)):
+            if row[1] is None:
+                records[row[0]] = None
+            else:
+                records[row[0]] = dict(zip(MEASURES, row[1:]))
+        yield participant, records, n_stimuli
+
+
+def export_legacy(conn, out_path, phash=None):
+    """ Writes the stored results in the layout of <dir>_output.csv. """
+    with open(out_path, 'w', newline='') as fp:
+        wf = csv.writer(fp, delimiter=',')
+        for participant, records, n_stimuli in load_runs(conn, phash):
+            groupdata = legacy_rows(participant, records, n_stimuli)
+            if groupdata is not None:
+                wf.writerows(groupdata)
+
+
+def export_long(conn, out_path, phash=None):
+    """ Writes one row per participant x stimulus, in the layout of
+  reformat_calibration_verification.py's output (missing values left blank). """
+    with open(out_path, 'w', newline='') as fp:
+        wf = csv.writer(fp, delimiter=',')
+        wf.writerow(long_header)
+        for participant, records, n_stimuli in load_runs(conn, phash):
+            for stim in sorted(records):
+                rec = records[stim]
+                if rec is None:
+                    values = [''] * len(MEASURES)
+                else:
+                    values = [round(rec[m], 2) for m in MEASURES]
+                (min_dist, coord_x, coord_y, duration, sd_x, sd_y, rms_x, rms_y) = values
+                wf.writerow([participant, coord_x, coord_y, duration, min_dist, rms_x, rms_y,
+                             sd_x, sd_y, stim])
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    if len(args) < 3 or args[0] != 'export':
+        print("Usage: python3 results_store.py export [--long] <results.db> <output.csv>")
+        exit()
+    long_format = '--long' in args
+    args = [a for a in args[1:] if a != '--long']
+    conn = connect(args[0])
+    if long_format:
+        export_long(conn, args[1])
+    else:
+        export_legacy(conn, args[1])
+    conn.close()
+    print("Wrote " + args[1])
@@ -0,0 +1,198 @@
+#!/usr/bin/python3
+# Calibration target layouts, and a grid index for finding the nearest target.
+#
+# calibration.py matches each fixation to the stimulus it was recorded on by
+# MediaName, using the five locations set at its top.  For protocols with more
+# targets (9- or 13-point grids) or several targets shown at once, a layout
+# file lists the targets instead, and each fixation goes to the target nearest
+# its mean gaze position.  A layout is a .csv with a header line:
+#
+#   target,x,y,media
+#   TopLeft,480,270,TopLeft_converted.avi
+#   Grid5,960,540,
+#
+# x and y are in pixels, like GazePointX / GazePointY.  media is optional: if
+# given (several can be separated by ';'), the target is only considered for
+# fixations recorded while one of those MediaNames was shown; a target with no
+# media can be matched during any stimulus.
+#
+#   python3 calibration.py path/to/data/ --layout layouts/five_point.csv
+#   python3 target_layout.py layouts/five_point.csv   (check a layout)
+import csv
+import sys
+
+import numpy as np
+
+BLOCK = 2 ** 20  # distances worked out at a time, when comparing with every target
+
+
+class TargetGrid:
+    """ Nearest-target lookup for a fixed set of (x, y) targets.  The box
+  around the targets and <area> (x0, y0, x1, y1; e.g. the screen, where the
+  queried points are) is cut into about one cell per target, and each cell
+  keeps the few targets that can be the nearest to some point in it, so a
+  query measures the distance to those only, however many targets there
+  are. """
+
+    def __init__(self, xy, area=None):
+        self.xy = np.asarray(xy, dtype=np.float64).reshape(-1, 2)
+        if len(self.xy) == 0:
+            raise ValueError("no targets")
+        self.lo = self.xy.min(axis=0)
+        hi = self.xy.max(axis=0)
+        if area is not None:
+            self.lo = np.minimum(self.lo, area[:2])
+            hi = np.maximum(hi, area[2:])
+        span = np.maximum(hi - self.lo, 1.)
+        self.cell = np.sqrt(span[0] * span[1] / len(self.xy))
+        # floor + 1, so points on the far edge of the box are in a cell too
+        self.shape = tuple(np.floor(span / self.cell).astype(int) + 1)
+
+        # a point in a cell is at most <half> from its centre, so its nearest
+        # target is within (distance from the centre to the nearest target) + 2 * half
+        # of the centre
+        ix, iy = np.meshgrid(np.arange(self.shape[0]), np.arange(self.shape[1]), indexing='ij')
+        centres = self.lo + (np.stack([ix.ravel(), iy.ravel()], axis=1) + 0.5) * self.cell
+        half = self.cell * np.sqrt(2.) / 2.
+        cands = []
+        step = max(1, BLOCK // len(self.xy))
+        for b in range(0, len(centres), step):
+            c = centres[b:b + step]
+            d = np.hypot(c[:, None, 0] - self.xy[None, :, 0], c[:, None, 1] - self.xy[None, :, 1])
+            near = d <= d.min(axis=1)[:, None] + 2. * half + 1e-9 * self.cell
+            cands += [np.flatnonzero(row) for row in near]
+        # candidates of each cell in target order, padded with its first one
+        k = max(len(c) for c in cands)
+        self.table = np.array([np.concatenate([c, np.full(k - len(c), c[0])]) for c in cands],
+                              dtype=np.int64)
+
+    def nearest(self, points):
+        """ Index of, and distance to, the nearest target for each point of
+  <points> (n x 2); -1 and nan for points that aren't finite.  Ties go to
+  the first target. """
+        p = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        index = np.full(len(p), -1, dtype=np.int64)
+        dist = np.full(len(p), np.nan)
+        finite = np.isfinite(p).all(axis=1)
+        cell = np.zeros(p.shape, dtype=np.int64)
+        cell[finite] = np.floor((p[finite] - self.lo) / self.cell)
+        inside = finite & (cell >= 0).all(axis=1) & (cell < self.shape).all(axis=1)
+
+        if inside.any():
+            cand = self.table[np.ravel_multi_index(cell[inside].T, self.shape)]
+            q = p[inside]
+            d = np.hypot(q[:, None, 0] - self.xy[cand, 0], q[:, None, 1] - self.xy[cand, 1])
+            j = d.argmin(axis=1)
+            index[inside] = cand[np.arange(len(q)), j]
+            dist[inside] = d[np.arange(len(q)), j]
+
+        # only points outside the box (off-screen means, with the screen as
+        # <area>) are compared with every target
+        outside = np.flatnonzero(finite & ~inside)
+        step = max(1, BLOCK // len(self.xy))
+        for b in range(0, len(outside), step):
+            rows = outside[b:b + step]
+            d = np.hypot(p[rows, None, 0] - self.xy[None, :, 0], p[rows, None, 1] - self.xy[None, :, 1])
+            index[rows] = d.argmin(axis=1)
+            dist[rows] = d.min(axis=1)
+        return index, dist
+
+
+class TargetLayout:
+    """ Named targets, each with the MediaNames it can be matched during
+  (empty for any). """
+
+    def __init__(self, names, xy, media):
+        if len(set(names)) != len(names):
+            raise ValueError("target names must be unique")
+        self.names = list(names)
+        self.xy = np.asarray(xy, dtype=np.float64).reshape(-1, 2)
+        self.media = [tuple(m) for m in media]
+        self._grids = {}
+
+    def __len__(self):
+        return len(self.names)
+
+    def locations(self):
+        """ {target: [x, y]}, like calibration.locations. """
+        return {name: [float(x), float(y)] for name, (x, y) in zip(self.names, self.xy)}
+
+    def params(self):
+        """ The layout as plain lists (stored with the results). """
+        return [[name, float(x), float(y), list(m)] for name, (x, y), m in
+                zip(self.names, self.xy, self.media)]
+
+    def allowed(self, media):
+        """ Indices of the targets that can be matched while <media> is shown
+  (all of them for media=None). """
+        return np.array([t for t, m in enumerate(self.media)
+                         if media is None or len(m) == 0 or media in m], dtype=np.int64)
+
+    def _grid(self, media, area):
+        if (media, area) not in self._grids:
+            allowed = self.allowed(media)
+            self._grids[media, area] = (allowed, TargetGrid(self.xy[allowed], area)
+                                        if len(allowed) > 0 else None)
+        return self._grids[media, area]
+
+    def assign(self, points, media=None, area=None):
+        """ The target nearest each of <points> (n x 2), and the distance to it
+  in pixels.  With <media> (the MediaName of each point), only the targets
+  allowed for that MediaName are considered; a point with none gets -1.
+  <area> (x0, y0, x1, y1) is where the points usually are, e.g. the screen:
+  points outside it and the targets are slower to look up. """
+        p = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        if area is not None:
+            area = tuple(float(v) for v in area)
+        if media is None:
+            allowed, grid = self._grid(None, area)
+            index, dist = grid.nearest(p)
+            return np.where(index >= 0, allowed[np.maximum(index, 0)], -1), dist
+        media = np.asarray(media, dtype=object)
+        index = np.full(len(p), -1, dtype=np.int64)
+        dist = np.full(len(p), np.nan)
+        for m in set(media.tolist()):
+            rows = np.flatnonzero(media == m)
+            allowed, grid = self._grid(m, area)
+            if grid is None:
+                continue
+            i, d = grid.nearest(p[rows])
+            index[rows] = np.where(i >= 0, allowed[np.maximum(i, 0)], -1)
+            dist[rows] = d
+        return index, dist
+
+
+def read_layout(filename):
+    """ Reads a layout file (see the top of this file). """
+    names, xy, media = [], [], []
+    with open(filename, newline='') as f:
+        reader = csv.DictReader(f)
+        missing = {'target', 'x', 'y'} - set(reader.fieldnames or [])
+        if len(missing) > 0:
+            raise ValueError("%s: no %s column" % (filename, ', '.join(sorted(missing))))
+        for row in reader:
+            if (row['target'] or '').strip() == '':
+                continue
+            names.append(row['target'].strip())
+            try:
+                xy.append([float(row['x']), float(row['y'])])
+            except (TypeError, ValueError):
+                raise ValueError("%s: bad coordinates for target %s" % (filename, names[-1]))
+            media.append([m.strip() for m in (row.get('media') or '').split(';') if m.strip() != ''])
+    if len(names) == 0:
+        raise ValueError("%s: no targets" % filename)
+    return TargetLayout(names, xy, media)
+
+
+def main(argv):
+    if len(argv) != 1:
+        print("usage: python3 target_layout.py layout.csv")
+        exit(1)
+    layout = read_layout(argv[0])
+    print("%i targets" % len(layout))
+    for name, x, y, media in layout.params():
+        print("  %-26s %7.1f %7.1f  %s" % (name, x, y, '; '.join(media) if media else '(any stimulus)'))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,211 @@
+# On-disk column store: one .npy file per column, written a chunk at a time.
+#
+# A store is a directory holding <column>.npy for every column and meta.json
+# (number of rows, dtypes, the categories of text columns and any other
+# attributes).  Text columns (participant name, media, ...) are stored as
+# int32 codes into a list of categories.  Columns can be appended to without
+# holding the whole column in memory, and rows already written can be
+# overwritten in place (e.g. once an interpolated gap is closed).  The store is
+# written to <path>.partial and renamed when it's closed, so a store that
+# exists is complete.
+#
+# Columns are read back memory-mapped, so reading a slice only touches that
+# part of the file:
+#
+#   store = ColumnStore('data/JE000053_03/v03/JE000053_03_03_Parsed_columns')
+#   x = store['gazeX_int'][1000:2000]
+#   media = store.column('media', 0, 100)   # text columns come back as str
+import json
+import os
+import shutil
+
+import numpy as np
+
+META = 'meta.json'
+HEADER_LEN = 128  # fixed .npy header length, so it can be rewritten in place
+CATEGORY = 'category'
+
+
+def _header(dtype, n_rows):
+    """ .npy (version 1.0) header for a 1-d array of <n_rows>, padded to
+  HEADER_LEN bytes. """
+    d = "{'descr': %r, 'fortran_order': False, 'shape': (%i,), }" % (
+        np.lib.format.dtype_to_descr(np.dtype(dtype)), n_rows)
+    n_pad = HEADER_LEN - 10 - len(d) - 1
+    if n_pad < 0:
+        raise ValueError("header too long for dtype %s" % dtype)
+    d = d + ' ' * n_pad + '\n'
+    return b'\x93NUMPY\x01\x00' + np.uint16(len(d)).tobytes() + d.encode('latin1')
+
+
+def source_attrs(source):
+    """ Attrs recording which file a store was made from (see is_current). """
+    st = os.stat(source)
+    return {'source': os.path.basename(source), 'source_size': st.st_size,
+            'source_mtime': st.st_mtime}
+
+
+def is_current(path, source):
+    """ Whether the store at <path> was made from <source> as it is now. """
+    try:
+        with open(os.path.join(path, META)) as f:
+            attrs = json.load(f)['attrs']
+    except (OSError, ValueError, KeyError):
+        return False
+    return all(attrs.get(k) == v for k, v in source_attrs(source).items())
+
+
+class ColumnWriter:
+    """ Writes a column store.  <columns> maps column names to numpy dtypes,
+  or to 'category' for text.  <missing> optionally maps integer columns to
+  the value that stands for a missing value (-9999) in them, for types too
+  small to hold -9999 itself. """
+
+    def __init__(self, path, columns, attrs=None, missing=None):
+        self.path = path
+        self.tmp_path = path + '.partial'
+        if os.path.isdir(self.tmp_path):
+            shutil.rmtree(self.tmp_path)
+        os.makedirs(self.tmp_path)
+        self.dtypes = {}
+        self.categories = {}
+        self.files = {}
+        for name, dtype in columns.items():
+            if dtype == CATEGORY:
+                self.categories[name] = {}
+                dtype = np.int32
+            self.dtypes[name] = np.dtype(dtype)
+            self.files[name] = open(os.path.join(self.tmp_path, name + '.npy'), 'wb+')
+            self.files[name].write(_header(self.dtypes[name], 0))
+        self.attrs = dict(attrs or {})
+        self.missing = dict(missing or {})
+        self.n_rows = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def encode(self, name, values):
+        """ Codes of the strings in <values> for category column <name>. """
+        cats = self.categories[name]
+        values = np.asarray(values, dtype=object)
+        if len(values) == 0:
+            return np.zeros(0, dtype=np.int32)
+        uniq, first, inverse = np.unique(values.astype(str), return_index=True, return_inverse=True)
+        # new categories get codes in order of first appearance
+        for i in np.argsort(first, kind='stable'):
+            cats.setdefault(str(uniq[i]), len(cats))
+        lookup = np.array([cats[str(u)] for u in uniq], dtype=np.int32)
+        return lookup[inverse.ravel()]
+
+    def _as_column(self, name, values):
+        if name in self.categories:
+            return self.encode(name, values)
+        return np.asarray(values, dtype=self.dtypes[name])
+
+    def append(self, values):
+        """ Appends rows; <values> maps every column name to an array of the
+  same length. """
+        n = None
+        for name, f in self.files.items():
+            column = self._as_column(name, values[name])
+            if n is None:
+                n = len(column)
+            elif len(column) != n:
+                raise ValueError("column %s has %i rows, expected %i" % (name, len(column), n))
+            f.write(column.tobytes())
+        self.n_rows += n or 0
+
+    def patch(self, name, start, values):
+        """ Overwrites rows <start>, <start> + 1, ... of one column. """
+        column = self._as_column(name, values)
+        if start < 0 or start + len(column) > self.n_rows:
+            raise IndexError("rows %i-%i aren't written yet" % (start, start + len(column)))
+        f = self.files[name]
+        f.seek(HEADER_LEN + start * self.dtypes[name].itemsize)
+        f.write(column.tobytes())
+        f.seek(0, os.SEEK_END)
+
+    def view(self, name):
+        """ The rows of one column written so far, memory-mapped read-only
+  (codes for text columns). """
+        f = self.files[name]
+        f.flush()
+        if self.n_rows == 0:
+            return np.zeros(0, dtype=self.dtypes[name])
+        return np.memmap(f.name, dtype=self.dtypes[name], mode='r', offset=HEADER_LEN,
+                         shape=(self.n_rows,))
+
+    def close(self):
+        meta = {'n_rows': self.n_rows, 'columns': {}, 'attrs': self.attrs}
+        for name, f in self.files.items():
+            f.seek(0)
+            f.write(_header(self.dtypes[name], self.n_rows))
+            f.close()
+            info = {'dtype': np.lib.format.dtype_to_descr(self.dtypes[name])}
+            if name in self.categories:
+                info['categories'] = sorted(self.categories[name], key=self.categories[name].get)
+            if name in self.missing:
+                info['missing'] = int(self.missing[name])
+            meta['columns'][name] = info
+        with open(os.path.join(self.tmp_path, META), 'w') as f:
+            json.dump(meta, f)
+        if os.path.isdir(self.path):
+            shutil.rmtree(self.path)
+        os.rename(self.tmp_path, self.path)
+
+    def abort(self):
+        for f in self.files.values():
+            f.close()
+        shutil.rmtree(self.tmp_path, ignore_errors=True)
+
+
+class ColumnStore:
+    """ Reads a store written by ColumnWriter. """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, META)) as f:
+            self.meta = json.load(f)
+        self.attrs = self.meta['attrs']
+        self._columns = {}
+
+    def __len__(self):
+        return self.meta['n_rows']
+
+    def __contains__(self, name):
+        return name in self.meta['columns']
+
+    @property
+    def columns(self):
+        return list(self.meta['columns'])
+
+    def categories(self, name):
+        """ The strings a text column's codes refer to (None for other
+  columns). """
+        return self.meta['columns'][name].get('categories')
+
+    def missing_code(self, name):
+        """ The value standing for -9999 in an integer column too small to
+  hold it (None for other columns). """
+        return self.meta['columns'][name].get('missing')
+
+    def __getitem__(self, name):
+        """ One column, memory-mapped (codes for text columns). """
+        if name not in self._columns:
+            self._columns[name] = np.load(os.path.join(self.path, name + '.npy'), mmap_mode='r')
+        return self._columns[name]
+
+    def column(self, name, start=None, stop=None):
+        """ Rows <start>:<stop> of one column, in memory; text columns are
+  decoded into an object array of str. """
+        values = np.array(self[name][start:stop])
+        cats = self.categories(name)
+        if cats is not None:
+            return np.asarray(cats, dtype=object)[values]
+        return values
@@ -0,0 +1,511 @@
+# Catalog of processed eye-tracking visits, for interactive / cohort work in
+# Python.
+#
+# Visits are found once under data/<participant>/<visit>/ and the list is
+# cached in data/.et_catalog.json, so opening the catalog again only has to
+# check that the directories haven't changed.  Data are loaded on first
+# access, one column at a time, and kept in a memory-capped LRU cache:
+#
+#   import et_catalog
+#   cat = et_catalog.Catalog('~/process-et-data/data', max_bytes=2e9)
+#   visit = cat['JE000053_03']['v03']
+#   trial = visit.trial('01_converted.avi')
+#   x = trial['gazeX']                      # one column of one trial
+#   xy = trial.columns(['gazeX_int', 'gazeY_int'])
+#   segs = visit.segments(['x', 'y', 'amp'])
+#   rec = visit.recording('parsed')         # all trials, typed (see recording.py)
+#
+# .mat files written by MATLAB's default save() can't be read in pieces, so
+# the first access to a column decodes the file once and converts that
+# column, for every trial, into a typed array; the rest of the file isn't kept.
+# Where mat_to_columns.py has converted a file (and the file hasn't changed
+# since), columns are read from the converted store instead.
+import collections
+import json
+import os
+import re
+
+import numpy as np
+
+import recording
+from column_store import ColumnStore, is_current
+from mat_io import as_cell_list, as_cell_rows, cell_column, load_mat
+
+MANIFEST = '.et_catalog.json'
+MANIFEST_VERSION = 1
+
+# file suffix of each kind of output, as written by the MATLAB pipeline
+FILE_KINDS = collections.OrderedDict([
+    ('raw', '_RawData.mat'),
+    ('parsed', '_Parsed.mat'),
+    ('segmented', '_segmentedTimeSeries.mat'),
+    ('calver', '_calVerTimeSeries.mat'),
+    ('quality', '_quality.csv')])
+
+# columns that hold text; everything else is converted to float64
+STRING_COLS = ['id', 'date', 'media', 'gazeEventType', 'project', 'recordingres', 'trial']
+
+# ParticData.Data columns 2 and 3 (see interpolate_data.m and add_fix_faces.m)
+PARSED_EXTRA_COLS = ['gazeX_int', 'gazeY_int', 'aoi']
+
+# column stores (see column_store.py) are directories named <file>_columns
+STORE_SUFFIX = '_columns'
+
+
+def store_path(path):
+    """ Where mat_to_columns.py puts the store for a .mat file. """
+    return os.path.splitext(path)[0] + STORE_SUFFIX
+
+
+def file_kind(name):
+    """ Which kind of pipeline output <name> is (see FILE_KINDS), or None. """
+    for kind, suffix in FILE_KINDS.items():
+        if name.lower().endswith(suffix.lower()):
+            return kind
+    return None
+
+
+def scan(root):
+    """ Walks <root> and returns the manifest: every directory that holds
+  pipeline outputs is a visit.  The first directory level under <root> is the
+  participant; the rest of the path is the visit (e.g. 'v03'). """
+    visits = []
+    dir_mtimes = {}
+    for path, dirs, files in os.walk(root):
+        dirs[:] = sorted(d for d in dirs if not d.startswith('.') and
+                         not d.endswith((STORE_SUFFIX, STORE_SUFFIX + '.partial')))
+        dir_mtimes[os.path.relpath(path, root)] = os.path.getmtime(path)
+        found = {}
+        for f in sorted(files):
+            kind = file_kind(f)
+            if kind is not None and kind not in found:
+                st = os.stat(os.path.join(path, f))
+                found[kind] = {'name': f, 'size': st.st_size, 'mtime': st.st_mtime}
+        if len(found) == 0:
+            continue
+        rel = os.path.relpath(path, root).split(os.sep)
+        first = list(found.values())[0]['name']
+        visits.append({'participant': rel[0],
+                       'visit': '/'.join(rel[1:]) if len(rel) > 1 else '',
+                       'path': os.path.relpath(path, root),
+                       'id': first[:len(first) - len(FILE_KINDS[file_kind(first)])],
+                       'files': found})
+    return {'version': MANIFEST_VERSION, 'dirs': dir_mtimes, 'visits': visits}
+
+
+def load_manifest(root, refresh=False):
+    """ Reads the cached manifest, or rescans <root> if it's missing or any
+  directory has changed since it was written. """
+    manifest_path = os.path.join(root, MANIFEST)
+    if not refresh and os.path.isfile(manifest_path):
+        try:
+            with open(manifest_path) as f:
+                manifest = json.load(f)
+            if manifest.get('version') == MANIFEST_VERSION and all(
+                    os.path.isdir(os.path.join(root, d)) and
+                    os.path.getmtime(os.path.join(root, d)) == mtime
+                    for d, mtime in manifest['dirs'].items()):
+                return manifest
+        except (ValueError, KeyError, OSError):
+            pass
+    manifest = scan(root)
+    try:
+        if not os.path.exists(manifest_path):
+            open(manifest_path, 'w').close()
+        # the manifest lives in <root>, so creating it changes root's mtime
+        manifest['dirs']['.'] = os.path.getmtime(root)
+        with open(manifest_path, 'w') as f:
+            json.dump(manifest, f)
+    except OSError:
+        pass  # read-only data directory; just don't cache
+    return manifest
+
+
+class LRUCache(object):
+    """ Least-recently-used cache of numpy arrays, capped by total bytes. """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._items = collections.OrderedDict()
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def get(self, key):
+        value = self._items[key]
+        self._items.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        if key in self._items:
+            self.nbytes -= self._items.pop(key).nbytes
+        self._items[key] = value
+        self.nbytes += value.nbytes
+        while self.nbytes > self.max_bytes and len(self._items) > 1:
+            _, old = self._items.popitem(last=False)
+            self.nbytes -= old.nbytes
+
+    def clear(self):
+        self._items.clear()
+        self.nbytes = 0
+
+
+def typed_column(cells, col, name):
+    if name in STRING_COLS:
+        return cell_column(cells, col, dtype=object)
+    return cell_column(cells, col)
+
+
+def store_column(store, name, start=None, stop=None):
+    """ Rows of a store column as typed_column() gives them from the .mat:
+  text as str, and numbers as float64 with -9999 where missing (stores made
+  by mat_to_columns.py keep integer columns in smaller types). """
+    values = store.column(name, start, stop)
+    if values.dtype == object:
+        return values
+    code = store.missing_code(name)
+    out = values.astype(np.float64)
+    if code is not None:
+        out[values == code] = recording.MISSING
+    return out
+
+
+def parsed_extra(trials, t, column):
+    """ ParticData.Data column 2 (interpolated x / y) or 3 (AOI hits) of
+  trial <t>, as float64; empty if the .mat has nothing there. """
+    i = PARSED_EXTRA_COLS.index(column)
+    value = np.asarray(trials[t, 1] if i < 2 else trials[t, 2], dtype=np.float64)
+    if i < 2:
+        value = value.reshape(-1, 2)[:, i] if value.size > 0 else value
+    return value.ravel()
+
+
+class Catalog(object):
+    """ All visits under a data directory.  Index by participant, e.g.
+  catalog['JE000053_03']['v03']. """
+
+    def __init__(self, root, max_bytes=2 * 1024 ** 3, refresh=False):
+        self.root = os.path.abspath(os.path.expanduser(root))
+        self.cache = LRUCache(max_bytes)
+        self._participants = collections.OrderedDict()
+        for entry in load_manifest(self.root, refresh)['visits']:
+            p = self._participants.setdefault(entry['participant'],
+                                              Participant(self, entry['participant']))
+            p.visits[entry['visit']] = Visit(self, entry)
+
+    @property
+    def participants(self):
+        return list(self._participants.keys())
+
+    def __getitem__(self, participant):
+        return self._participants[participant]
+
+    def __iter__(self):
+        return iter(self._participants.values())
+
+    def __len__(self):
+        return len(self._participants)
+
+    def visits(self):
+        """ Every visit of every participant. """
+        return [v for p in self for v in p.visits.values()]
+
+    def refresh(self):
+        self.__init__(self.root, self.cache.max_bytes, refresh=True)
+
+    def __repr__(self):
+        return "Catalog(%r, %i participants, %i visits)" % (self.root, len(self), len(self.visits()))
+
+
+class Participant(object):
+    def __init__(self, catalog, name):
+        self.catalog = catalog
+        self.name = name
+        self.visits = collections.OrderedDict()
+
+    def __getitem__(self, visit):
+        return self.visits[visit]
+
+    def __iter__(self):
+        return iter(self.visits.values())
+
+    def __repr__(self):
+        return "Participant(%r, visits=%r)" % (self.name, list(self.visits.keys()))
+
+
+class Visit(object):
+    """ One visit's outputs.  Nothing is read until a column is asked for. """
+
+    def __init__(self, catalog, entry):
+        self.catalog = catalog
+        self.participant = entry['participant']
+        self.name = entry['visit']
+        self.id = entry['id']
+        self.path = os.path.join(catalog.root, entry['path'])
+        self.files = entry['files']
+        self._info = {}
+
+    def __repr__(self):
+        return "Visit(%r, %r, files=%r)" % (self.participant, self.name, list(self.files.keys()))
+
+    def file(self, kind):
+        if kind not in self.files:
+            raise KeyError("%s has no %s file" % (self.path, FILE_KINDS[kind]))
+        return os.path.join(self.path, self.files[kind]['name'])
+
+    def store(self, kind):
+        """ The store mat_to_columns.py made from a file, or None if there
+  isn't one or the file has changed since. """
+        key = (kind, 'store')
+        if key not in self._info:
+            path = self.file(kind)
+            store = ColumnStore(store_path(path)) if is_current(store_path(path), path) else None
+            self._info[key] = store
+        return self._info[key]
+
+    def _small(self, kind, variable):
+        """ Small variables (dataCol, PrefBin, segSummaryCol) are kept with the visit. """
+        key = (kind, variable)
+        if key not in self._info:
+            store = self.store(kind)
+            if store is not None and variable in store.attrs:
+                self._info[key] = store.attrs[variable]
+            else:
+                self._info[key] = load_mat(self.file(kind), [variable]).get(variable)
+        return self._info[key]
+
+    @property
+    def dataCol(self):
+        return self._small('raw', 'dataCol')
+
+    @property
+    def PrefBin(self):
+        return self._small('parsed', 'PrefBin')
+
+    def trial_names(self):
+        """ PrefBin.MovieListAsPresented """
+        return [str(m) for m in np.atleast_1d(self.PrefBin['MovieListAsPresented'])]
+
+    @property
+    def trials(self):
+        return [Trial(self, i, name) for i, name in enumerate(self.trial_names())]
+
+    def trial(self, which):
+        """ A trial by position in MovieListAsPresented, or by movie name (the
+  first presentation). """
+        names = self.trial_names()
+        if not isinstance(which, (int, np.integer)):
+            which = names.index(which)
+        return Trial(self, which, names[which])
+
+    def _parsed_cols(self):
+        """ Column numbers of ParticData.Data{t,1}: dataCol, plus the blink
+  column process_individual.m adds before parsing, plus the interpolated
+  coordinates and AOI hits (ParticData.Data columns 2 and 3). """
+        cols = dict(self.dataCol)
+        if 'blink' not in cols:
+            cols['blink'] = max(cols.values()) + 1
+        return cols
+
+    def _load(self, key, loader):
+        """ Returns <key> from the cache, or runs <loader> (which returns a dict
+  of cache keys to arrays, including <key>) and caches what it returns. """
+        cache = self.catalog.cache
+        if key in cache:
+            return cache.get(key)
+        loaded = loader()
+        for k, value in loaded.items():
+            cache.put(k, value)
+        return loaded[key]
+
+    def raw(self, columns):
+        """ Columns of the continuous data in _RawData.mat, by dataCol name. """
+        missing = [c for c in columns if ('raw', self.path, c) not in self.catalog.cache]
+        loaded = {}
+        if len(missing) > 0:
+            store = self.store('raw')
+            data = load_mat(self.file('raw'), ['data'])['data'] if store is None else None
+            for c in missing:
+                if store is not None:
+                    loaded[c] = store_column(store, c)
+                else:
+                    loaded[c] = typed_column(data, self.dataCol[c], c)
+                self.catalog.cache.put(('raw', self.path, c), loaded[c])
+        return {c: loaded[c] if c in loaded else self.catalog.cache.get(('raw', self.path, c))
+                for c in columns}
+
+    def _load_parsed(self, column):
+        """ Decodes ParticData once and converts <column> for every trial. """
+        store = self.store('parsed')
+        if store is not None:
+            out = {}
+            for t, tr in enumerate(store.attrs['trials']):
+                if column in tr.get('empty', []):
+                    value = np.zeros(0)
+                else:
+                    value = store_column(store, column, tr['first_row'], tr['first_row'] + tr['n_rows'])
+                out[('parsed', self.path, t, column)] = value
+            return out
+        trials = self._particdata()
+        out = {}
+        for t in range(trials.shape[0]):
+            key = ('parsed', self.path, t, column)
+            if column in PARSED_EXTRA_COLS:
+                out[key] = parsed_extra(trials, t, column)
+            else:
+                out[key] = typed_column(trials[t, 0], self._parsed_cols()[column], column)
+        return out
+
+    def _particdata(self):
+        return as_cell_rows(load_mat(self.file('parsed'), ['ParticData'])['ParticData']['Data'], 3)
+
+    def trial_column(self, index, column):
+        return self._load(('parsed', self.path, index, column), lambda: self._load_parsed(column))
+
+    def recording(self, kind='parsed'):
+        """ A whole output ('raw', 'parsed', 'segmented' or 'calver') as a
+  recording.Recording, with the trials (or segments) one after another and
+  attrs['trials'] (or attrs['segments']) saying where each is; Trial.recording()
+  and Recording.segments() are views into it.  Read from the store made by
+  mat_to_columns.py if there is one. """
+        key = ('recording', self.path, kind)
+        return self._load(key, lambda: {key: self._recording(kind)})
+
+    def _recording(self, kind):
+        store = self.store(kind)
+        if store is not None:
+            return recording.from_store(store)
+        # otherwise the .mat is decoded straight into typed columns, one column
+        # at a time, bypassing the (float64) column cache
+        if kind == 'raw':
+            data = load_mat(self.file('raw'), ['data'])['data']
+            cols = self.dataCol
+            return recording.from_columns((c, typed_column(data, cols[c], c))
+                                          for c in sorted(cols, key=cols.get))
+        if kind == 'parsed':
+            return self._parsed_recording()
+        return self._segments_recording(kind)
+
+    def _parsed_recording(self):
+        cols = self._parsed_cols()
+        names = sorted(cols, key=cols.get)
+        trials = self._particdata()
+        n_trials = trials.shape[0]
+        lengths = [len(typed_column(trials[t, 0], cols[names[0]], names[0])) for t in range(n_trials)]
+        labels = self.trial_names()
+        table, first = [], 0
+        for t, n in enumerate(lengths):
+            # extra columns that are empty in the .mat (padded with NaN)
+            empty = [c for c in PARSED_EXTRA_COLS if len(parsed_extra(trials, t, c)) == 0]
+            table.append({'name': labels[t] if t < len(labels) else '', 'first_row': first,
+                          'n_rows': n, 'empty': empty})
+            first += n
+
+        def extra(t, c):
+            value = parsed_extra(trials, t, c)
+            return value if len(value) == lengths[t] else np.full(lengths[t], np.nan)
+
+        def columns():
+            for c in names:
+                yield c, np.concatenate([typed_column(trials[t, 0], cols[c], c) for t in range(n_trials)])
+            for c in PARSED_EXTRA_COLS:
+                yield c, np.concatenate([extra(t, c) for t in range(n_trials)])
+            yield 'trial', np.repeat(np.arange(1, n_trials + 1, dtype=np.int32), lengths)
+        if n_trials == 0:
+            return recording.from_columns({}, {'trials': table})
+        return recording.from_columns(columns(), {'trials': table})
+
+    def _segments_recording(self, kind):
+        if kind == 'segmented':
+            var, cols = 'segmentedData', self._small(kind, 'segSummaryCol')
+        else:
+            var, cols = 'segmentedData_calVer', self._small(kind, 'calVerCol')
+        names = [c for c in sorted(cols, key=cols.get) if c not in ('trial', 'seg')]
+        segs = [s for s in as_cell_list(load_mat(self.file(kind), [var])[var]) if np.size(s) > 0]
+        table, first = [], 0
+        for seg in segs:
+            label = {'trial': str(typed_column(seg, cols['trial'], 'trial')[0])}
+            if 'seg' in cols:
+                label['seg'] = int(typed_column(seg, cols['seg'], 'seg')[0])
+            n = len(typed_column(seg, cols[names[0]], names[0]))
+            table.append(dict(label, first_row=first, n_rows=n))
+            first += n
+        lengths = [t['n_rows'] for t in table]
+
+        def columns():
+            yield 'trial', np.repeat(np.array([t['trial'] for t in table], dtype=object), lengths)
+            if 'seg' in cols:
+                yield 'seg', np.repeat(np.array([t['seg'] for t in table], dtype=np.float64), lengths)
+            for c in names:
+                yield c, np.concatenate([typed_column(seg, cols[c], c) for seg in segs])
+            yield 'segment', np.repeat(np.arange(1, len(segs) + 1, dtype=np.int32), lengths)
+        if len(segs) == 0:
+            return recording.from_columns({}, {'segments': table})
+        return recording.from_columns(columns(), {'segments': table})
+
+    def segments(self, columns, kind='segmented', trial=None):
+        """ Columns of each time-series segment (_segmentedTimeSeries.mat, or
+  _calVerTimeSeries.mat with kind='calver').  Returns a list of dicts, one per
+  segment, with the trial name (and segment number) of each.  <trial> is an
+  optional regular expression the trial name has to match. """
+        if kind == 'segmented':
+            var, cols = 'segmentedData', self._small(kind, 'segSummaryCol')
+        else:
+            var, cols = 'segmentedData_calVer', self._small(kind, 'calVerCol')
+        wanted = ['trial'] + (['seg'] if 'seg' in cols else [])
+        wanted += [c for c in columns if c not in wanted]
+
+        cache = self.catalog.cache
+        n = self._info.get((kind, 'n_segments'))
+        loaded = {}
+        if n is None or any((kind, self.path, i, c) not in cache for i in range(n) for c in wanted):
+            store = self.store(kind)
+            if store is not None:
+                segs = [(s['first_row'], s['first_row'] + s['n_rows']) for s in store.attrs['segments']]
+            else:
+                segs = [s for s in as_cell_list(load_mat(self.file(kind), [var])[var]) if np.size(s) > 0]
+            n = self._info[(kind, 'n_segments')] = len(segs)
+            for i, seg in enumerate(segs):
+                for c in wanted:
+                    if store is not None:
+                        value = store_column(store, c, *seg)
+                    else:
+                        value = typed_column(seg, cols[c], c)
+                    loaded[(kind, self.path, i, c)] = value
+                    cache.put((kind, self.path, i, c), value)
+
+        out = []
+        for i in range(n):
+            seg = {}
+            for c in wanted:
+                key = (kind, self.path, i, c)
+                seg[c] = loaded[key] if key in loaded else cache.get(key)
+            seg['trial'] = str(seg['trial'][0])
+            if 'seg' in seg:
+                seg['seg'] = int(seg['seg'][0])
+            if trial is None or re.fullmatch(trial, seg['trial']):
+                out.append(seg)
+        return out
+
+
+class Trial(object):
+    """ One trial (row of ParticData.Data) of a visit. """
+
+    def __init__(self, visit, index, name):
+        self.visit = visit
+        self.index = index
+        self.name = name
+
+    def __repr__(self):
+        return "Trial(%r, %i, %r)" % (self.visit.id, self.index, self.name)
+
+    def __getitem__(self, column):
+        return self.visit.trial_column(self.index, column)
+
+    def columns(self, columns):
+        return {c: self[c] for c in columns}
+
+    def recording(self):
+        """ This trial's rows of Visit.recording('parsed') (a view). """
+        return self.visit.recording('parsed').trials()[self.index][1]
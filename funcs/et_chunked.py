@@ -0,0 +1,399 @@
+# Blinks, trials and interpolation for recordings too long to hold in memory.
+#
+# Does what et_processing.process_recording() (and so the blinks / trials /
+# interpolate stages of process_individual.m) does, reading the .txt written
+# by prep_tobii_output_individual.R a fixed number of rows at a time and
+# writing the result to a column store (see column_store.py), so peak memory
+# depends on --chunk-rows and not on the length of the recording.  The result
+# is the same as for the whole recording at once:
+#   - smoothing the pupil for blink detection needs a few samples on either
+#     side, so the last samples of each window are carried into the next one
+#     (the halo) and smoothed there;
+#   - a blink's onset is found from the last rise of the smoothed pupil before
+#     it (which may be any number of windows back, so only its position is
+#     kept), and its offset from the first fall after it (which may be in a
+#     later window, so the blink waits until then);
+#   - a row is kept or dropped as a duplicate time stamp depending on the next
+#     row, so the last row of each window is held back;
+#   - trials and the gaps in the gaze data run on from one window into the
+#     next; a gap's rows are written as missing and overwritten once the next
+#     valid sample shows what to interpolate to.
+# Blink positions depend on the whole recording (consecutive sets are joined
+# and duplicates removed at the end), so the blink column is filled in last.
+# Time stamps (after duplicates are removed) must increase.
+#
+#   python3 et_chunked.py data/JE000053_03/v03
+#   python3 et_chunked.py data/JE000053_03/v03/JE000053_03_03.txt --chunk-rows 50000
+#
+# writes data/JE000053_03/v03/JE000053_03_03_Interpolated_columns/, with a
+# row per row kept (columns as dataCol, plus 'row' (line of the .txt, from 0),
+# 'blink', 'trial' (from 1; 0 between trials), 'gazeX_int' and 'gazeY_int');
+# the trials (name, first row, number of rows, proportion interpolated) and
+# blinks are in its attrs:
+#
+#   store = column_store.ColumnStore('.../JE000053_03_03_Interpolated_columns')
+#   store.attrs['trials'][0]
+import argparse
+import collections
+import itertools
+import os
+import resource
+import sys
+
+import numpy as np
+
+import et_processing as etp
+from column_store import CATEGORY, ColumnWriter
+
+CHUNK_ROWS = 200000
+PATCH_ROWS = 65536  # rows of a long gap overwritten at a time
+OUT_SUFFIX = '_Interpolated_columns'
+
+
+def output_columns():
+    """ Columns of the store (name: dtype). """
+    columns = collections.OrderedDict()
+    for name in etp.TXT_COLS:
+        columns[name] = CATEGORY if name in etp.STRING_COLS else np.float64
+    columns['row'] = np.int64
+    columns['blink'] = np.int8
+    columns['trial'] = np.int32
+    columns['gazeX_int'] = np.float64
+    columns['gazeY_int'] = np.float64
+    return columns
+
+
+class BlinkStream:
+    """ etp.detect_blinks(), fed the pupil signal a window at a time. """
+
+    def __init__(self, sampling_rate=etp.SAMPLING_RATE, gap_interval=etp.GAP_INTERVAL,
+                 smooth_ms=etp.SMOOTH_MS):
+        self.si = 1000. / sampling_rate
+        self.gap_interval = gap_interval
+        self.span = etp.smooth_span(self.si, smooth_ms)
+        self.h = (self.span - 1) // 2
+        self.n = 0  # samples fed
+        self.tail = np.zeros(0)  # samples still needed for smoothing
+        self.last_zero = None  # whether the last sample fed was 0
+        self.n_starts = 0  # blink candidates found
+        self.n_stops = 0
+        self.n_smoothed = 0
+        self.last_smoothed = None
+        self.last_rise = None  # last m >= 2 with diff(smoothed)(m) > 0 (1-based)
+        # candidates waiting for the smoothed pupil, and onsets / offsets
+        # waiting to be paired up
+        self.pending_starts = collections.deque()
+        self.pending_stops = collections.deque()
+        self.onsets = collections.deque()
+        self.offsets = collections.deque()
+        self.working = []
+        self.prev_offset = -1
+
+    def feed(self, pupil):
+        if len(pupil) == 0:
+            return
+        z = pupil == 0
+        if self.last_zero is None:
+            if z[0]:  # the data start with a blink
+                self.onsets.append(etp.blink_onset(-1, None))
+            zz, first = z, 0
+        else:
+            zz, first = np.concatenate([[self.last_zero], z]), self.n - 1
+        starts = np.flatnonzero(~zz[:-1] & zz[1:]) + first + 1
+        stops = np.flatnonzero(zz[:-1] & ~zz[1:]) + first + 2
+        self.pending_starts.extend(int(k) for k in starts)
+        self.pending_stops.extend(int(j) for j in stops)
+        self.n_starts += len(starts)
+        self.n_stops += len(stops)
+        self.last_zero = bool(z[-1])
+
+        base = self.n - len(self.tail)
+        p = np.concatenate([self.tail, pupil])
+        self.n += len(pupil)
+        # samples whose window doesn't reach past the last one fed
+        self._smooth(p, base, self.n - self.h)
+        keep_from = max(0, self.n_smoothed - self.h)
+        self.tail = p[keep_from - base:]
+
+    def _smooth(self, p, base, stop, n=None):
+        if stop <= self.n_smoothed:
+            return
+        smoothed = etp.moving_average(p, self.span, self.n_smoothed, stop, n, base)
+        smoothed[smoothed == 0] = np.nan
+        first = max(self.n_smoothed, 1)  # 1-based index of the first diff
+        if self.last_smoothed is not None:
+            smoothed = np.concatenate([[self.last_smoothed], smoothed])
+        d = np.diff(smoothed)
+        m = np.arange(first, first + len(d))
+        self.n_smoothed = stop
+        self.last_smoothed = smoothed[-1]
+        self._resolve(m[(d > 0) & (m >= 2)], m[d < 0])
+
+    def _resolve(self, rises, falls):
+        # every diff up to n_smoothed - 1 is known
+        while len(self.pending_starts) > 0 and self.pending_starts[0] <= self.n_smoothed - 1:
+            k = self.pending_starts.popleft()
+            i = np.searchsorted(rises, k, 'right') - 1
+            if i >= 0:
+                self.onsets.append(int(rises[i]) + 1)
+            elif self.last_rise is not None:
+                self.onsets.append(self.last_rise + 1)
+            else:
+                self.onsets.append(k + 2)
+        if len(rises) > 0:
+            self.last_rise = int(rises[-1])
+        while len(self.pending_stops) > 0:
+            i = np.searchsorted(falls, self.pending_stops[0], 'left')
+            if i == len(falls):
+                break
+            self.pending_stops.popleft()
+            self.offsets.append(int(falls[i]) + 1)
+        self._pair()
+
+    def _pair(self):
+        while len(self.onsets) > 0 and len(self.offsets) > 0:
+            working, self.prev_offset = etp.join_blinks(
+                [self.onsets.popleft()], [self.offsets.popleft()], self.si, self.gap_interval,
+                self.prev_offset)
+            self.working += working
+
+    def finish(self):
+        """ Blink (onset, offset) positions, as etp.detect_blinks(). """
+        base = self.n - len(self.tail)
+        self._smooth(self.tail, base, self.n, self.n)
+        while len(self.pending_stops) > 0:  # no fall after it
+            self.pending_stops.popleft()
+            self.offsets.append(self.n)
+        if self.last_zero:  # the data end with a blink
+            self.offsets.append(self.n)
+        self._pair()
+        if self.n_starts == 0 or self.n_stops == 0:
+            return np.zeros((0, 2), dtype=np.int64)
+        return etp.clean_blinks(self.working, self.si)
+
+
+class ChunkedRecording:
+    """ etp.process_recording() a window of rows at a time, writing to
+  <writer> (a ColumnWriter with output_columns()). """
+
+    def __init__(self, writer, sampling_rate=etp.SAMPLING_RATE, strict=True):
+        self.writer = writer
+        self.strict = strict
+        self.blinks = BlinkStream(sampling_rate)
+        self.n_raw = 0  # rows read
+        self.held = None  # the last row read, kept or not depending on the next
+        self.last_time = None  # time stamp of the last row kept
+        self.run_key = None  # media of the current run of rows (lower case)
+        self.run = None
+        self.n_trials = 0
+        self.trials = []
+        self.gap = None  # gap in the gaze data still open at the end of a window
+        self.before = None  # last valid (x, y) of the current trial
+
+    def process(self, columns):
+        """ Adds the next rows of the .txt (as etp.parse_lines()). """
+        n = len(columns['timestamp'])
+        if n == 0:
+            return
+        columns = dict(columns)
+        columns['row'] = np.arange(self.n_raw, self.n_raw + n)
+        self.n_raw += n
+        self.blinks.feed(etp.pupil_signal(columns['pupL'], columns['pupR']))
+
+        if self.held is not None:
+            columns = {k: np.concatenate([self.held[k], v]) for k, v in columns.items()}
+        time = columns['timestamp']
+        keep = time[:-1] != time[1:]
+        self.held = {k: v[-1:] for k, v in columns.items()}
+        self._add_rows({k: v[:-1][keep] for k, v in columns.items()})
+
+    def _add_rows(self, rows):
+        n = len(rows['row'])
+        if n == 0:
+            return
+        time = rows['timestamp']
+        t = time if self.last_time is None else np.concatenate([[self.last_time], time])
+        bad = np.flatnonzero(~(np.diff(t) > 0))
+        if len(bad) > 0:
+            i = bad[0] if self.last_time is None else bad[0] - 1
+            raise ValueError("time stamp at line %i of the .txt isn't after the one before; "
+                             "chunked processing needs increasing time stamps"
+                             % (rows['row'][i + 1] + 1))
+        self.last_time = time[-1]
+
+        row0 = self.writer.n_rows
+        out = dict(rows)
+        out['blink'] = np.zeros(n, dtype=np.int8)
+        out['trial'] = np.zeros(n, dtype=np.int32)
+        valid = etp.valid_gaze(rows['validityL'], rows['validityR'], self.strict)
+        x = np.where(valid, rows['gazeX'], etp.MISSING)
+        y = np.where(valid, rows['gazeY'], etp.MISSING)
+        out['gazeX_int'] = x.copy()
+        out['gazeY_int'] = y.copy()
+
+        keys = np.array([m.lower() for m in rows['media']], dtype=object)
+        bounds = np.concatenate([[0], np.flatnonzero(keys[1:] != keys[:-1]) + 1, [n]])
+        for i, j in zip(bounds[:-1], bounds[1:]):
+            if keys[i] != self.run_key:
+                self._start_run(rows['media'][i], keys[i], row0 + i)
+            self.run['n'] += j - i
+            if self.run['trial'] > 0:
+                out['trial'][i:j] = self.run['trial']
+                self._interpolate(row0 + i, time[i:j], x[i:j], y[i:j],
+                                  out['gazeX_int'][i:j], out['gazeY_int'][i:j])
+        self.writer.append(out)
+
+    def _start_run(self, name, key, first):
+        self._end_run()
+        trial = 0
+        if not etp.same_media(name, str(etp.MISSING)):  # between trials
+            self.n_trials += 1
+            trial = self.n_trials
+        self.run = {'name': name, 'first': first, 'n': 0, 'trial': trial, 'missing': 0}
+        self.run_key = key
+        self.before = None
+
+    def _end_run(self):
+        # a gap still open touches the end of the trial, so stays missing
+        self.gap = None
+        if self.run is not None and self.run['trial'] > 0:
+            self.trials.append((self.run['name'], self.run['first'], self.run['n'],
+                                self.run['missing'] / self.run['n']))
+
+    def _interpolate(self, row0, time, x, y, x_int, y_int):
+        """ etp.interpolate_trial() for the next rows (starting at row <row0>
+  of the store) of the current trial; fills in x_int / y_int and overwrites
+  the rows of gaps that started in an earlier window. """
+        missing = x == etp.MISSING
+        n = len(x)
+        self.run['missing'] += int(missing.sum())
+        if self.gap is not None and not missing[0]:  # the gap ended with the last window
+            self._fill_gap(self.gap, (x[0], y[0]), x_int[:0], y_int[:0])
+            self.gap = None
+        edges = np.diff(np.concatenate([[0], missing.astype(np.int8), [0]]))
+        for a, b in zip(np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)):
+            if a == 0 and self.gap is not None:
+                gap = self.gap
+            else:
+                before = (x[a - 1], y[a - 1]) if a > 0 else self.before  # None at the trial's start
+                gap = {'first': row0 + a, 'time': time[a], 'n': 0, 'before': before}
+            self.gap = None
+            gap['last_time'] = time[b - 1]
+            if b == n:
+                gap['n'] += b - a
+                self.gap = gap
+            else:
+                self._fill_gap(gap, (x[b], y[b]), x_int[a:b], y_int[a:b])
+        valid = np.flatnonzero(~missing)
+        if len(valid) > 0:
+            self.before = (x[valid[-1]], y[valid[-1]])
+
+    def _fill_gap(self, gap, after, x_int, y_int):
+        """ Interpolates a gap whose first gap['n'] rows are in the store and the
+  rest in x_int / y_int. """
+        if gap['before'] is None or gap['last_time'] - gap['time'] >= etp.MAX_INTERPOLATE:
+            return
+        (bx, by), (ax, ay) = [[etp.nan_missing(v) for v in xy] for xy in (gap['before'], after)]
+        n_prev = gap['n']
+        n_gap = n_prev + len(x_int)
+        x_int[:] = etp.interpolate_gap(bx, ax, n_gap, n_prev, n_gap)
+        y_int[:] = etp.interpolate_gap(by, ay, n_gap, n_prev, n_gap)
+        for start in range(0, n_prev, PATCH_ROWS):
+            stop = min(start + PATCH_ROWS, n_prev)
+            self.writer.patch('gazeX_int', gap['first'] + start,
+                              etp.interpolate_gap(bx, ax, n_gap, start, stop))
+            self.writer.patch('gazeY_int', gap['first'] + start,
+                              etp.interpolate_gap(by, ay, n_gap, start, stop))
+
+    def finish(self):
+        """ Call after the last rows; fills in the blink column and puts the
+  trials and blinks in the store's attrs. """
+        self.held = None  # the last row is always dropped
+        if self.run is not None and self.run['n'] == 1 and self.run['first'] == self.writer.n_rows - 1:
+            # a run starting on the last row isn't a trial
+            if self.run['trial'] > 0:
+                self.writer.patch('trial', self.run['first'], [0])
+                self.n_trials -= 1
+            self.run = None
+        self._end_run()
+        self.run = None
+
+        blinks = self.blinks.finish()
+        rows = self.writer.view('row')
+        for onset, offset in blinks:
+            lo = np.searchsorted(rows, max(onset, 1) - 1, 'left')
+            hi = np.searchsorted(rows, offset - 1, 'right')
+            if hi > lo:
+                self.writer.patch('blink', lo, np.ones(hi - lo, dtype=np.int8))
+        del rows
+
+        self.writer.attrs['trials'] = [
+            {'name': name, 'first_row': int(first), 'n_rows': int(n), 'prop_interpolated': prop}
+            for name, first, n, prop in self.trials]
+        self.writer.attrs['blinks'] = blinks.tolist()
+        return self.trials, blinks
+
+
+def process_txt(filename, out_path, chunk_rows=CHUNK_ROWS, sampling_rate=etp.SAMPLING_RATE,
+                strict=True):
+    """ Runs a .txt through ChunkedRecording into a store at <out_path>.
+  Returns the trials and blinks. """
+    index = etp.column_indices(etp.read_colnames(etp.txt_files(filename)))
+    attrs = {'source': os.path.basename(filename), 'sampling_rate': sampling_rate,
+             'strict': strict}
+    with ColumnWriter(out_path, output_columns(), attrs) as writer:
+        recording = ChunkedRecording(writer, sampling_rate, strict)
+        with open(filename) as f:
+            lines = (line for line in f if line.strip() != '')
+            while True:
+                chunk = list(itertools.islice(lines, chunk_rows))
+                if len(chunk) == 0:
+                    break
+                recording.process(etp.parse_lines(chunk, index))
+        return recording.finish()
+
+
+def find_txt(path):
+    """ The .txt files (not _colnames.txt) in a visit directory, or <path>
+  itself if it's a file. """
+    if os.path.isfile(path):
+        return [path]
+    return [os.path.join(path, f) for f in sorted(os.listdir(path))
+            if f.endswith('.txt') and 'colnames' not in f]
+
+
+def out_path(filename):
+    """ Where the store for a .txt goes: <id>_Interpolated_columns, id being
+  the first three parts of the file name (as in process_individual.m). """
+    base = os.path.basename(filename)[:-len('.txt')]
+    return os.path.join(os.path.dirname(filename), '_'.join(base.split('_')[:3]) + OUT_SUFFIX)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Blinks, trials and interpolation for a "
+                                                 "recording, a window of rows at a time.")
+    parser.add_argument('path', help="visit directory or .txt file (from prep_tobii_output_individual.R)")
+    parser.add_argument('--chunk-rows', type=int, default=CHUNK_ROWS,
+                        help="rows per window (default %i)" % CHUNK_ROWS)
+    parser.add_argument('--rate', type=float, default=etp.SAMPLING_RATE,
+                        help="sampling rate in Hz (default %i)" % etp.SAMPLING_RATE)
+    parser.add_argument('--lenient', action='store_true',
+                        help="only treat missing gaze as invalid (not validity codes above 1)")
+    parser.add_argument('--out', help="store to write (default <id>%s next to the .txt)" % OUT_SUFFIX)
+    args = parser.parse_args(argv)
+
+    files = find_txt(args.path)
+    if len(files) == 0:
+        print("No .txt file in %s" % args.path)
+        exit(1)
+    for filename in files:
+        out = args.out if args.out is not None and len(files) == 1 else out_path(filename)
+        print("Processing %s" % filename)
+        trials, blinks = process_txt(filename, out, args.chunk_rows, args.rate, not args.lenient)
+        print("%i trials, %i blinks -> %s" % (len(trials), len(blinks), out))
+    # ru_maxrss is in kB on Linux
+    print("Peak memory %.0f MB" % (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
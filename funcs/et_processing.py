@@ -0,0 +1,437 @@
+# Python port of the first stages of process_individual.m: reading the .txt
+# written by prep_tobii_output_individual.R, blink detection
+# (blinkDetection.m), splitting the recording into trials
+# (parse_et_totrials.m) and interpolating gaps in the gaze data
+# (interpolate_data.m, 'strict').
+#
+# These functions work on a whole recording held in memory and are the
+# reference for et_chunked.py, which does the same a window at a time.  The
+# quirks of the MATLAB code (e.g. the blink onset being moved 2 samples past
+# the last rise of the smoothed pupil, the last row of a recording being
+# dropped with the duplicate time stamps) are kept on purpose, so both give
+# what the MATLAB pipeline gives.
+#
+#   import et_processing
+#   columns = et_processing.read_txt('data/JE000053_03/v03/JE000053_03_03.txt')
+#   result = et_processing.process_recording(columns)
+#   result['trials']   # name, first row, number of rows, proportion interpolated
+import collections
+import io
+import locale
+import os
+
+import numpy as np
+
+import recording
+import trial_pool
+
+MISSING = -9999
+
+# dataCol order (see read_et_data_individual.m) and the column of the .txt
+# each one comes from (matched case-insensitively, as MATLAB's contains())
+TXT_COLS = collections.OrderedDict([
+    ('timestamp', 'RecordingTimeStamp'),
+    ('id', 'ParticipantName'),
+    ('date', 'RecordingDate'),
+    ('gazeLx', 'GazePointLeftX'),
+    ('gazeLy', 'GazePointLeftY'),
+    ('pupL', 'PupilL'),
+    ('distL', 'DistanceLeft'),
+    ('validityL', 'ValidityLeft'),
+    ('gazeRx', 'GazePointRightX'),
+    ('gazeRy', 'GazePointRightY'),
+    ('pupR', 'PupilR'),
+    ('validityR', 'ValidityRight'),
+    ('distR', 'DistanceRight'),
+    ('fixIdx', 'FixationIndex'),
+    ('gazeX', 'GazePointX'),
+    ('gazeY', 'GazePointY'),
+    ('media', 'MediaName'),
+    ('gazeEventType', 'GazeEventType'),
+    ('gazeEventDur', 'GazeEventDuration'),
+    ('saccIdx', 'SaccadeIndex'),
+    ('saccAmp', 'SaccadicAmplitude'),
+    ('project', 'StudioProjectName'),
+    ('recordingres', 'RecordingResolution')])
+
+# columns that hold text (as in et_catalog.py); everything else is float64
+STRING_COLS = ['id', 'date', 'media', 'gazeEventType', 'project', 'recordingres']
+
+# blinkDetection.m defaults, for 300 Hz data
+SAMPLING_RATE = 300
+GAP_INTERVAL = 100
+BLINK_MIN_MS = 100
+BLINK_MAX_MS = 400
+SMOOTH_MS = 10
+
+MAX_INTERPOLATE = 100000000  # interpolate_data.m's maxInt (ms)
+
+MIN_PARALLEL_BYTES = 8 * 1024 ** 2  # smaller .txt files are read in one piece
+
+
+## Reading the .txt
+
+def read_colnames(filename):
+    """ Column names from a _colnames.txt. """
+    with open(filename) as f:
+        line = f.readline()
+    return line.strip().strip('"').split(',')
+
+
+def column_indices(headers):
+    """ Index into a .txt row of each dataCol column (None where the .txt
+  doesn't have it). """
+    index = {}
+    for name, pattern in TXT_COLS.items():
+        match = [i for i, h in enumerate(headers) if pattern.lower() in h.lower()]
+        index[name] = match[0] if len(match) > 0 else None
+    return index
+
+
+def to_number(s):
+    try:
+        return float(s)
+    except ValueError:
+        return np.nan
+
+
+def parse_lines(lines, index):
+    """ Columns (dict of arrays) from lines of the .txt. """
+    rows = [line.strip().strip('"').split(',') for line in lines]
+    columns = {}
+    for name, i in index.items():
+        if name in STRING_COLS:
+            values = np.empty(len(rows), dtype=object)
+            values[:] = [r[i] if i is not None and i < len(r) else '' for r in rows]
+        else:
+            values = np.array([to_number(r[i]) if i is not None and i < len(r) else np.nan
+                               for r in rows], dtype=np.float64)
+        columns[name] = values
+    return columns
+
+
+def txt_files(filename):
+    """ The _colnames.txt that goes with a .txt. """
+    return filename[:-len('.txt')] + '_colnames.txt'
+
+
+def read_txt(filename, jobs=1):
+    """ A whole .txt as columns.  With jobs > 1, a large file is parsed in
+  pieces by that many processes (see trial_pool.py). """
+    index = column_indices(read_colnames(txt_files(filename)))
+    jobs = trial_pool.usable_jobs(jobs, os.path.getsize(filename), MIN_PARALLEL_BYTES)
+    if jobs <= 1:
+        with open(filename) as f:
+            return parse_lines([line for line in f if line.strip() != ''], index)
+    pieces = trial_pool.map_parallel(read_piece, line_ranges(filename, 4 * jobs), jobs,
+                                     (filename, index))
+    columns = {}
+    for name in index:
+        if name in STRING_COLS:
+            columns[name] = join_codes([p[name] for p in pieces])
+        else:
+            columns[name] = np.concatenate([p[name] for p in pieces])
+    return columns
+
+
+def line_ranges(filename, n_pieces):
+    """ (start, stop) byte offsets cutting a file into about <n_pieces>
+  pieces, at line ends. """
+    size = os.path.getsize(filename)
+    bounds = [0]
+    with open(filename, 'rb') as f:
+        for k in range(1, n_pieces):
+            f.seek(max(size * k // n_pieces, bounds[-1]))
+            f.readline()
+            bounds.append(min(f.tell(), size))
+    bounds.append(size)
+    return [(a, b) for a, b in zip(bounds[:-1], bounds[1:]) if b > a]
+
+
+def read_piece(piece, filename, index):
+    """ parse_lines() for the lines in a (start, stop) byte range, with text
+  columns as (codes, categories), which are much quicker to send back to
+  the parent process than the strings. """
+    start, stop = piece
+    with open(filename, 'rb') as f:
+        f.seek(start)
+        text = f.read(stop - start).decode(locale.getpreferredencoding(False))
+    lines = [line for line in io.StringIO(text, newline=None) if line.strip() != '']
+    columns = parse_lines(lines, index)
+    for name in STRING_COLS:
+        columns[name] = recording.encode(columns[name])
+    return columns
+
+
+def join_codes(parts):
+    """ An object array of str from (codes, categories) parts. """
+    categories = sorted(set(c for codes, cats in parts for c in cats))
+    lookup = {c: i for i, c in enumerate(categories)}
+    codes = np.concatenate([np.array([lookup[c] for c in cats], dtype=np.int64)[codes]
+                            for codes, cats in parts])
+    return np.asarray(categories, dtype=object)[codes]
+
+
+## Blink detection (blinkDetection.m)
+
+def pupil_signal(pupL, pupR):
+    """ Mean of the two pupils, ignoring missing ones; 0 where both are
+  missing. """
+    pup = np.stack([pupL, pupR], axis=1)
+    pup[pup == MISSING] = np.nan
+    valid = ~np.isnan(pup)
+    n = valid.sum(axis=1)
+    total = np.where(valid, pup, 0.).sum(axis=1)
+    out = np.zeros(len(pup))
+    out[n > 0] = total[n > 0] / n[n > 0]
+    return out
+
+
+def smooth_span(sampling_interval, smooth_ms=SMOOTH_MS):
+    """ Span of blinkDetection.m's smooth() (made odd, as smooth() does). """
+    span = int(np.ceil(smooth_ms / sampling_interval))
+    if span % 2 == 0:
+        span -= 1
+    return max(span, 1)
+
+
+def moving_average(p, span, start, stop, n=None, base=0):
+    """ MATLAB's smooth(p, span) for samples <start>..<stop>-1 of a recording
+  of <n> samples, of which p holds samples <base>, <base> + 1, ...  Near the
+  ends the window shrinks to the samples available on both sides.  With
+  n=None the end of the recording isn't known yet, so no window may reach
+  past the last sample. """
+    h = (span - 1) // 2
+    i = np.arange(start, stop)
+    w = np.minimum(i, h)
+    if n is not None:
+        w = np.minimum(w, n - 1 - i)
+    acc = np.zeros(len(i))
+    for k in range(-h, h + 1):
+        use = np.abs(k) <= w
+        acc[use] += p[i[use] + k - base]
+    return acc / (2 * w + 1)
+
+
+def blink_onset(k, rises):
+    """ Blink onset (1-based) for onset candidate <k>: 2 samples after the
+  last rise of the smoothed pupil before it.  <rises> are the (1-based,
+  sorted) m >= 2 where diff(smoothed pupil)(m) > 0. """
+    if k < 0:  # the data start with a blink
+        return 3
+    i = np.searchsorted(rises, k, 'right') - 1
+    if i >= 0:
+        return int(rises[i]) + 1
+    return k + 2
+
+
+def clean_blinks(working, sampling_interval, blink_min=None, blink_max=None):
+    """ The end of blinkDetection.m: removes duplicated positions (where
+  consecutive sets were joined) and blinks outside the length limits, and
+  returns (onset, offset) rows. """
+    if blink_min is None:
+        blink_min = BLINK_MIN_MS / sampling_interval
+    if blink_max is None:
+        blink_max = BLINK_MAX_MS / sampling_interval
+    working = np.asarray(working, dtype=np.int64)
+    if len(working) > 0:
+        _, bin_, counts = np.unique(np.abs(working), return_inverse=True, return_counts=True)
+        bin_ = bin_.reshape(-1)
+        drop = counts[bin_] > 1
+        for b in np.flatnonzero((counts > 1) & (counts % 2 == 1)):
+            drop[np.flatnonzero(bin_ == b)[0]] = False  # an odd number: keep one
+        working = working[~drop]
+    pairs = working[:2 * (len(working) // 2)].reshape(-1, 2)
+    length = pairs[:, 1] - pairs[:, 0]
+    return pairs[(length >= blink_min) & (length <= blink_max)]
+
+
+def join_blinks(onsets, offsets, sampling_interval, gap_interval=GAP_INTERVAL, prev_offset=-1):
+    """ blinkDetection.m's loop over (onset, offset) pairs: a blink starting
+  within <gap_interval> ms of the previous one starts where that one ended.
+  Returns the working positions and the last offset. """
+    working = []
+    for onset, offset in zip(onsets, offsets):
+        if (sampling_interval * onset > gap_interval and
+                sampling_interval * onset - sampling_interval * prev_offset <= gap_interval):
+            onset = prev_offset
+        prev_offset = offset - 1
+        working += [onset, offset - 1]
+    return working, prev_offset
+
+
+def detect_blinks(pupil, sampling_rate=SAMPLING_RATE, gap_interval=GAP_INTERVAL, smooth_ms=SMOOTH_MS):
+    """ Blink (onset, offset) positions in samples, 1-based as in
+  blinkDetection.m. """
+    n = len(pupil)
+    si = 1000. / sampling_rate
+    z = pupil == 0
+    starts = list(np.flatnonzero(~z[:-1] & z[1:]) + 1)
+    stops = list(np.flatnonzero(z[:-1] & ~z[1:]) + 2)
+    if len(starts) == 0 or len(stops) == 0:
+        return np.zeros((0, 2), dtype=np.int64)
+    if z[0]:
+        starts.insert(0, -1)
+    if z[-1]:
+        stops.append(n)
+
+    smoothed = moving_average(pupil, smooth_span(si, smooth_ms), 0, n, n)
+    smoothed[smoothed == 0] = np.nan
+    d = np.diff(smoothed)
+    m = np.arange(1, n)  # 1-based index of each diff
+    rises = m[(d > 0) & (m >= 2)]
+    falls = m[d < 0]
+
+    onsets = [blink_onset(k, rises) for k in starts]
+    offsets = []
+    for j in stops:
+        i = np.searchsorted(falls, j, 'left')
+        offsets.append(int(falls[i]) + 1 if i < len(falls) else n)
+    working, _ = join_blinks(onsets, offsets, si, gap_interval)
+    return clean_blinks(working, si)
+
+
+def blink_column(n, blinks):
+    """ 0/1 per sample, 1 within each blink. """
+    out = np.zeros(n)
+    for onset, offset in blinks:
+        out[max(onset, 1) - 1:offset] = 1
+    return out
+
+
+## Trials (parse_et_totrials.m)
+
+def kept_rows(time):
+    """ Rows parse_et_totrials.m keeps: the earlier of two rows with the same
+  time stamp is dropped, and so is the last row. """
+    keep = np.zeros(len(time), dtype=bool)
+    keep[:-1] = time[:-1] != time[1:]
+    return keep
+
+
+def same_media(a, b):
+    return a.lower() == b.lower()
+
+
+def parse_trials(time, media):
+    """ Trials in rows that have been through kept_rows(): runs of rows with
+  the same media name, except '-9999' (between trials).  Returns (name, first
+  row, number of rows) for each. """
+    trials = []
+    n = len(time)
+    if n == 0:
+        return trials
+    if np.all(time[1:] > time[:-1]):
+        # each run starts where the last one ended, so the runs can be found
+        # all at once; the loop below stops before a run starting on the last row
+        keys = np.array([m.lower() for m in media], dtype=object)
+        starts = np.concatenate([[0], np.flatnonzero(keys[1:] != keys[:-1]) + 1])
+        ends = np.append(starts[1:], n)
+        trials = [(media[i], int(i), int(j - i)) for i, j in zip(starts, ends) if i < n - 1]
+        return [t for t in trials if not same_media(t[0], str(MISSING))]
+    curr = time[0]
+    while curr < time[n - 1]:
+        i = int(np.flatnonzero(time == curr)[0])
+        name = media[i]
+        j = i + 1
+        while j < n and same_media(media[j], name):
+            j += 1
+        trials.append((name, i, j - i))
+        if j == n:
+            break
+        curr = time[j]
+    return [t for t in trials if not same_media(t[0], str(MISSING))]
+
+
+## Interpolation (interpolate_data.m)
+
+def valid_gaze(validityL, validityR, strict=True):
+    """ Samples with usable gaze data. """
+    if strict:
+        # as in interpolate_data.m, the right eye's check uses the left eye's
+        # missing flag
+        return (validityL <= 1) & (validityL != MISSING) & (validityR <= 1) & (validityL != MISSING)
+    return (validityL != MISSING) & (validityR != MISSING)
+
+
+def nan_missing(v):
+    return np.nan if v == MISSING else v
+
+
+def interpolate_gap(before, after, n_gap, start=0, stop=None):
+    """ Linear interpolation across a gap of <n_gap> samples from <before> to
+  <after>: values for gap samples <start>..<stop>-1. """
+    if stop is None:
+        stop = n_gap
+    q = np.arange(start + 2, stop + 2)  # position in [before, gap, after]
+    return (after - before) / (n_gap + 1) * (q - 1) + before
+
+
+def interpolate_trial(time, gazeX, gazeY, valid):
+    """ Gaze with gaps filled in, for one trial.  Gaps at the start or end of
+  the trial are left missing.  Returns (gazeX_int, gazeY_int, proportion
+  missing). """
+    x = np.where(valid, gazeX, MISSING)
+    y = np.where(valid, gazeY, MISSING)
+    missing = x == MISSING
+    n = len(x)
+    prop = missing.sum() / n if n > 0 else np.nan
+    x_int = x.copy()
+    y_int = y.copy()
+    edges = np.diff(np.concatenate([[0], missing.astype(np.int8), [0]]))
+    for first, end in zip(np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)):
+        if first == 0 or end == n:
+            continue
+        if time[end - 1] - time[first] >= MAX_INTERPOLATE:
+            continue
+        x_int[first:end] = interpolate_gap(nan_missing(x[first - 1]), nan_missing(x[end]), end - first)
+        y_int[first:end] = interpolate_gap(nan_missing(y[first - 1]), nan_missing(y[end]), end - first)
+    return x_int, y_int, prop
+
+
+## Whole recording
+
+def interpolate_rows(trial):
+    """ interpolate_trial() on one trial's rows of the working columns (see
+  process_recording), writing into its gazeX_int / gazeY_int.  Returns the
+  proportion missing. """
+    x, y, prop = interpolate_trial(trial['timestamp'], trial['gazeX'], trial['gazeY'], trial['valid'])
+    trial['gazeX_int'][:] = x
+    trial['gazeY_int'][:] = y
+    return prop
+
+
+def process_recording(columns, sampling_rate=SAMPLING_RATE, strict=True, jobs=1):
+    """ Blinks, trials and interpolation for a recording read by read_txt().
+  Returns a dict with 'columns' (the rows kept, with 'row' (index into the
+  .txt), 'blink', 'trial' (1-based, 0 outside trials), 'gazeX_int' and
+  'gazeY_int'), 'trials' and 'blinks'.  With jobs > 1 the trials of a long
+  recording are interpolated by that many processes (see trial_pool.py). """
+    n = len(columns['timestamp'])
+    blinks = detect_blinks(pupil_signal(columns['pupL'], columns['pupR']), sampling_rate)
+    out = dict(columns)
+    out['row'] = np.arange(n)
+    out['blink'] = blink_column(n, blinks)
+
+    keep = kept_rows(columns['timestamp'])
+    out = {name: values[keep] for name, values in out.items()}
+    trials = parse_trials(out['timestamp'], out['media'])
+
+    out['trial'] = np.zeros(len(out['row']), dtype=np.int32)
+    valid = valid_gaze(out['validityL'], out['validityR'], strict)
+    out['gazeX_int'] = np.where(valid, out['gazeX'], MISSING)
+    out['gazeY_int'] = np.where(valid, out['gazeY'], MISSING)
+    jobs = trial_pool.usable_jobs(jobs, len(out['row']))
+    if jobs > 1:
+        out['gazeX_int'] = trial_pool.share(out['gazeX_int'])
+        out['gazeY_int'] = trial_pool.share(out['gazeY_int'])
+    for t, (name, first, n_rows) in enumerate(trials):
+        out['trial'][first:first + n_rows] = t + 1
+
+    working = {'timestamp': out['timestamp'], 'gazeX': out['gazeX'], 'gazeY': out['gazeY'],
+               'valid': valid, 'gazeX_int': out['gazeX_int'], 'gazeY_int': out['gazeY_int']}
+    props = trial_pool.map_trials(interpolate_rows, working,
+                                  [{'first_row': first, 'n_rows': n_rows} for _, first, n_rows in trials],
+                                  jobs)
+    table = [(name, first, n_rows, prop) for (name, first, n_rows), prop in zip(trials, props)]
+    return {'columns': out, 'trials': table, 'blinks': blinks}
@@ -0,0 +1,298 @@
+#!/usr/bin/python3
+# Cohort gaze-density maps, per stimulus and window of time.
+#
+# Bins the valid interpolated gaze samples (ParticData.Data column 2, see
+# interpolate_data.m) of every trial into a fixed grid over the screen: one
+# 2-D histogram per movie (calibration stimuli included) and per window of
+# time from the start of the movie.  With --by-aoi each map is also split by
+# the samples' AOI code (add_fix_faces.m: 0 = no face, 1-3 = faces from left
+# to right).  Visits are read through et_catalog.py as typed recordings (see
+# recording.py), so stores made by mat_to_columns.py are used, memory-mapped,
+# where they exist.
+#
+# Counts are saved in a .npz along with the visits they include, so running
+# it again only adds the new visits, and files made separately (e.g. by array
+# jobs on parts of the cohort) can be merged:
+#
+#   python3 gaze_heatmaps.py add heatmaps.npz ~/process-et-data/data --jobs 16
+#   python3 gaze_heatmaps.py add part1.npz ~/process-et-data/data --participants 'JE00000.*'
+#   python3 gaze_heatmaps.py merge heatmaps.npz part1.npz part2.npz
+#   python3 gaze_heatmaps.py show heatmaps.npz
+#
+# In python:
+#   maps = gaze_heatmaps.load('heatmaps.npz')
+#   density = maps.density('01_converted.avi', 2)   # third window; sums to 1
+import argparse
+import collections
+import concurrent.futures
+import json
+import os
+import re
+import sys
+
+import numpy as np
+
+from column_store import source_attrs
+from et_catalog import Catalog
+
+MISSING = -9999
+DEFAULTS = {'screen': [1920, 1080], 'bins': [64, 36], 'window': 1000., 'by_aoi': False}
+
+
+class Heatmaps:
+    """ Gaze counts over a <bins> (x, y) grid covering a <screen> (width,
+  height) in pixels, per (stimulus, window, aoi); window is the number of
+  <window> ms from the start of the trial (always 0 if window is 0), aoi is
+  None unless by_aoi. """
+
+    def __init__(self, screen=DEFAULTS['screen'], bins=DEFAULTS['bins'], window=DEFAULTS['window'],
+                 by_aoi=DEFAULTS['by_aoi']):
+        self.screen = [int(s) for s in screen]
+        self.bins = [int(b) for b in bins]
+        self.window = float(window)
+        self.by_aoi = bool(by_aoi)
+        self.counts = {}
+        self.visits = {}  # visit ('participant/visit') -> source_attrs of its _Parsed.mat
+
+    @property
+    def settings(self):
+        return {'screen': self.screen, 'bins': self.bins, 'window': self.window, 'by_aoi': self.by_aoi}
+
+    def _map(self, key):
+        if key not in self.counts:
+            self.counts[key] = np.zeros(self.bins[::-1], dtype=np.int64)
+        return self.counts[key]
+
+    def add_trial(self, stimulus, time, x, y, aoi=None):
+        """ Adds the valid samples of one trial: on the screen, not missing.
+  <time> is in ms (the windows start from the first sample). """
+        time, x, y = [np.asarray(a, dtype=np.float64) for a in (time, x, y)]
+        if len(time) == 0:
+            return 0
+        with np.errstate(invalid='ignore'):
+            valid = (np.isfinite(time) & (x != MISSING) & (y != MISSING) &
+                     (0 <= x) & (x < self.screen[0]) & (0 <= y) & (y < self.screen[1]))
+        if self.window > 0:
+            window = ((time - time[0]) // self.window).astype(np.int64)
+        else:
+            window = np.zeros(len(time), dtype=np.int64)
+        split = self.by_aoi and aoi is not None and len(aoi) == len(time)
+        if split:
+            code = np.nan_to_num(np.asarray(aoi, dtype=np.float64)).astype(np.int64)
+        else:
+            code = np.zeros(len(time), dtype=np.int64)
+        valid &= window >= 0
+        if not valid.any():
+            return 0
+
+        nx, ny = self.bins
+        ix = (x[valid] * nx / self.screen[0]).astype(np.int64)
+        iy = (y[valid] * ny / self.screen[1]).astype(np.int64)
+        groups, group = np.unique(np.stack([window[valid], code[valid]], axis=1), axis=0,
+                                  return_inverse=True)
+        counts = np.bincount(group.ravel() * (nx * ny) + iy * nx + ix,
+                             minlength=len(groups) * nx * ny).reshape(len(groups), ny, nx)
+        for (w, c), hist in zip(groups, counts):
+            self._map((stimulus, int(w), int(c) if split else None))[...] += hist
+        return int(valid.sum())
+
+    def add_visit(self, visit):
+        """ Adds every trial of an et_catalog Visit.  Returns the number of
+  samples added. """
+        n = 0
+        rec = visit.recording('parsed').select(['timestamp', 'gazeX_int', 'gazeY_int', 'aoi'])
+        for info, trial in zip(rec.attrs['trials'], rec.split(rec.attrs['trials'])):
+            aoi = None
+            if 'aoi' not in info.get('empty', []):
+                aoi = np.where(trial.missing('aoi'), MISSING, trial['aoi'])
+            n += self.add_trial(info['name'], trial['timestamp'], trial['gazeX_int'],
+                                trial['gazeY_int'], aoi)
+        self.visits[visit_key(visit)] = source_attrs(visit.file('parsed'))
+        return n
+
+    def merge(self, other):
+        """ Adds the counts of <other> (made with the same settings, from
+  other visits). """
+        if other.settings != self.settings:
+            raise ValueError("can't merge heatmaps made with different settings: %s, %s" %
+                             (self.settings, other.settings))
+        both = sorted(set(self.visits) & set(other.visits))
+        if len(both) > 0:
+            raise ValueError("%i visit(s) are in both sets of heatmaps, e.g. %s" % (len(both), both[0]))
+        for key, hist in other.counts.items():
+            self._map(key)[...] += hist
+        self.visits.update(other.visits)
+
+    def stimuli(self):
+        return sorted(set(key[0] for key in self.counts))
+
+    def map(self, stimulus, window=None, aoi=None):
+        """ Counts for one stimulus, summed over all windows (window=None) and,
+  if split by AOI, over all AOI codes (aoi=None). """
+        out = np.zeros(self.bins[::-1], dtype=np.int64)
+        for (s, w, c), hist in self.counts.items():
+            if s == stimulus and (window is None or w == window) and (aoi is None or c == aoi):
+                out += hist
+        return out
+
+    def density(self, stimulus, window=None, aoi=None):
+        """ map() scaled to sum to 1 (all zeros if there are no samples). """
+        hist = self.map(stimulus, window, aoi).astype(np.float64)
+        total = hist.sum()
+        return hist / total if total > 0 else hist
+
+    def save(self, path):
+        """ Saves to <path> (.npz); the file is replaced only once it's fully
+  written. """
+        keys = sorted(self.counts, key=lambda k: (k[0], k[1], -1 if k[2] is None else k[2]))
+        counts = (np.stack([self.counts[k] for k in keys]) if len(keys) > 0 else
+                  np.zeros([0] + self.bins[::-1], dtype=np.int64))
+        tmp_path = path + '.partial'
+        with open(tmp_path, 'wb') as f:
+            np.savez_compressed(f, counts=counts, keys=json.dumps(keys),
+                                settings=json.dumps(self.settings), visits=json.dumps(self.visits))
+        os.replace(tmp_path, path)
+
+
+def load(path):
+    """ Heatmaps saved by Heatmaps.save(). """
+    with np.load(path) as f:
+        maps = Heatmaps(**json.loads(str(f['settings'])))
+        maps.visits = json.loads(str(f['visits']))
+        counts = f['counts']
+        for i, key in enumerate(json.loads(str(f['keys']))):
+            maps.counts[tuple(key)] = counts[i].astype(np.int64)
+    return maps
+
+
+def visit_key(visit):
+    return "%s/%s" % (visit.participant, visit.name)
+
+
+_catalog = None  # each worker process opens the catalog once
+
+
+def _open_catalog(root):
+    global _catalog
+    _catalog = Catalog(root)
+
+
+def visits_heatmaps(keys, settings):
+    """ Heatmaps of the visits <keys> of the worker's catalog.  Returns
+  (heatmaps, {key: number of samples or error message}). """
+    maps = Heatmaps(**settings)
+    status = {}
+    for key in keys:
+        participant, name = key.split('/', 1)
+        one = Heatmaps(**settings)  # so a visit that fails part way adds nothing
+        try:
+            status[key] = one.add_visit(_catalog[participant][name])
+            maps.merge(one)
+        except Exception as e:
+            status[key] = "failed: %s: %s" % (type(e).__name__, e)
+        _catalog.cache.clear()
+    return maps, status
+
+
+def add(path, root, settings, participants=None, jobs=1):
+    """ Adds the visits under <root> that aren't in the heatmaps at <path> yet
+  (creating it if needed), <jobs> processes at a time. """
+    if os.path.exists(path):
+        maps = load(path)
+        given = {k: v for k, v in settings.items() if v is not None}
+        if any(maps.settings[k] != (float(v) if k == 'window' else v) for k, v in given.items()):
+            raise ValueError("%s was made with %s" % (path, maps.settings))
+    else:
+        maps = Heatmaps(**{k: DEFAULTS[k] if v is None else v for k, v in settings.items()})
+
+    catalog = Catalog(root)
+    todo = []
+    for visit in catalog.visits():
+        key = visit_key(visit)
+        if 'parsed' not in visit.files or (participants and not re.fullmatch(participants, visit.participant)):
+            continue
+        if key in maps.visits:
+            if maps.visits[key] != source_attrs(visit.file('parsed')):
+                print("%s: _Parsed.mat changed since it was added; make the heatmaps again to "
+                      "include the change" % key)
+            continue
+        todo.append((os.path.getsize(visit.file('parsed')), key))
+    print("%i visits to add (%i already in %s)" % (len(todo), len(maps.visits), path))
+    if len(todo) == 0:
+        return maps
+
+    # one batch per worker, so the (large) partial maps are only sent back once each
+    todo.sort(reverse=True)
+    batches = [[key for size, key in todo[i::jobs]] for i in range(min(jobs, len(todo)))]
+    n_failed = 0
+    with concurrent.futures.ProcessPoolExecutor(max_workers=len(batches), initializer=_open_catalog,
+                                                initargs=(catalog.root,)) as pool:
+        futures = [pool.submit(visits_heatmaps, batch, maps.settings) for batch in batches]
+        for future in concurrent.futures.as_completed(futures):
+            part, status = future.result()
+            for key in sorted(status):
+                failed = isinstance(status[key], str)
+                n_failed += failed
+                print("%s: %s" % (key, status[key] if failed else "%i samples" % status[key]))
+            maps.merge(part)
+    maps.save(path)
+    print("%i visits in %s (%i failed)" % (len(maps.visits), path, n_failed))
+    return maps
+
+
+def show(maps):
+    print("%i visits; screen %s px in %s bins, %s%s" % (
+        len(maps.visits), 'x'.join(map(str, maps.screen)), 'x'.join(map(str, maps.bins)),
+        "windows of %g ms" % maps.window if maps.window > 0 else "whole trials",
+        ', split by AOI' if maps.by_aoi else ''))
+    per_stimulus = collections.defaultdict(lambda: [0, set()])
+    for (s, w, c), hist in maps.counts.items():
+        per_stimulus[s][0] += int(hist.sum())
+        per_stimulus[s][1].add(w)
+    for s in sorted(per_stimulus):
+        print("  %-30s %10i samples %5i windows" % (s, per_stimulus[s][0], len(per_stimulus[s][1])))
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Gaze-density maps per stimulus and window of time.")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('add', help="add the visits under a data directory that aren't in the file yet")
+    p.add_argument('out', help=".npz to add to (made if it doesn't exist)")
+    p.add_argument('root', help="data directory (data/<participant>/<visit>/)")
+    p.add_argument('--participants', help="regular expression participant names have to match")
+    p.add_argument('--jobs', type=int, default=os.cpu_count(), help="processes (default: number of CPUs)")
+    p.add_argument('--screen', type=int, nargs=2, metavar=('WIDTH', 'HEIGHT'),
+                   help="screen size in pixels (default 1920 1080)")
+    p.add_argument('--bins', type=int, nargs=2, metavar=('NX', 'NY'), help="grid size (default 64 36)")
+    p.add_argument('--window', type=float, help="ms per time window, 0 for whole trials (default 1000)")
+    p.add_argument('--by-aoi', action='store_true', default=None, help="separate maps per AOI code")
+
+    p = sub.add_parser('merge', help="add up heatmaps made from different visits")
+    p.add_argument('out')
+    p.add_argument('inputs', nargs='+')
+
+    p = sub.add_parser('show', help="summary of a heatmaps file")
+    p.add_argument('path')
+
+    args = parser.parse_args(argv)
+    try:
+        if args.command == 'add':
+            settings = {'screen': args.screen, 'bins': args.bins, 'window': args.window,
+                        'by_aoi': args.by_aoi}
+            show(add(args.out, args.root, settings, args.participants, max(1, args.jobs)))
+        elif args.command == 'merge':
+            maps = load(args.inputs[0])
+            for path in args.inputs[1:]:
+                maps.merge(load(path))
+            maps.save(args.out)
+            show(maps)
+        else:
+            show(load(args.path))
+    except ValueError as e:  # different settings, or visits counted twice
+        print(e)
+        exit(1)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,62 @@
+# Helpers for reading the pipeline's .mat files (_RawData.mat, _Parsed.mat,
+# _segmentedTimeSeries.mat, ...) into Python.  Requires scipy.
+import numpy as np
+
+
+def load_mat(path, variable_names=None):
+    """ Loads variables from a .mat file.  Cell arrays come back as numpy
+  object arrays and structs as dicts. """
+    try:
+        from scipy.io import loadmat
+    except ImportError:
+        raise ImportError("Reading .mat files requires scipy (conda install scipy)")
+    out = loadmat(path, variable_names=variable_names, squeeze_me=True,
+                  struct_as_record=False, chars_as_strings=True)
+    return {k: to_python(v) for k, v in out.items() if not k.startswith('__')}
+
+
+def to_python(value):
+    """ Converts scipy's mat_struct objects (e.g. dataCol, segSummaryCol,
+  PrefBin) into dicts, recursively. """
+    if hasattr(value, '_fieldnames'):
+        return {f: to_python(getattr(value, f)) for f in value._fieldnames}
+    return value
+
+
+def as_cell_rows(cells, n_cols=None):
+    """ squeeze_me turns a 1-row cell array into a 1-d array; this puts the
+  row dimension back so every cell array can be indexed [row, col]. """
+    cells = np.asarray(cells, dtype=object)
+    if cells.ndim == 1 and (n_cols is None or cells.shape[0] == n_cols):
+        return cells.reshape(1, -1)
+    return cells
+
+
+def as_cell_list(cells):
+    """ A cell column (e.g. ParticData.Data or segmentedData) as a list.
+  Empty cells are kept as empty arrays. """
+    if isinstance(cells, np.ndarray) and cells.dtype == object:
+        return list(cells.ravel())
+    return [cells]
+
+
+def cell_column(cells, col, dtype=np.float64, missing=np.nan):
+    """ Pulls column <col> (1-based, like dataCol / segSummaryCol) out of a
+  cell array of per-sample values, as a typed numpy array.  Values that
+  can't be converted (e.g. text in a numeric column) become <missing>. """
+    column = as_cell_rows(cells)[:, col - 1]
+    if np.dtype(dtype).kind in 'OUS':
+        try:
+            return column.astype(str).astype(dtype)
+        except ValueError:  # empty cells come back as empty arrays
+            return np.array([str(v) for v in column], dtype=dtype)
+    try:
+        return column.astype(dtype)
+    except (TypeError, ValueError):
+        out = np.empty(len(column), dtype=dtype)
+        for i, v in enumerate(column):
+            try:
+                out[i] = float(v)
+            except (TypeError, ValueError):
+                out[i] = missing
+        return out
@@ -0,0 +1,275 @@
+#!/usr/bin/python3
+# Converts the MATLAB pipeline's outputs into column stores.
+#
+# _RawData.mat, _Parsed.mat, _segmentedTimeSeries.mat and
+# _calVerTimeSeries.mat keep every sample in its own MATLAB cell, which is
+# slow to decode every time a file is loaded.  This decodes each file once
+# and writes <file>_columns/ next to it (see column_store.py): one typed
+# array per column, named from dataCol / segSummaryCol / calVerCol, with the
+# trials (or segments) one after another and 'trial' (or 'segment') giving
+# the one each row belongs to (from 1).  Columns are stored in the types
+# recording.py uses (int64 time stamps, int8 validity codes and flags, ...)
+# when every value fits, so recording.from_store() can use them as they are;
+# -9999 in an int8 column is stored as -128 (the column's 'missing' code).
+# Float columns stay float64, as in the .mat.  et_catalog.py reads these
+# stores instead of the .mat files when they're up to date.
+#
+#   python3 mat_to_columns.py ~/process-et-data/data --jobs 16
+#   python3 mat_to_columns.py path/to/id_Parsed.mat --force
+#
+# A store is skipped if it was made from the .mat as it is now (same size and
+# modification time), unless --force is given.
+import argparse
+import collections
+import concurrent.futures
+import os
+import sys
+import time
+
+import numpy as np
+
+import recording
+from column_store import CATEGORY, ColumnWriter, is_current, source_attrs
+from et_catalog import (FILE_KINDS, PARSED_EXTRA_COLS, STORE_SUFFIX, STRING_COLS, file_kind,
+                        store_path, typed_column)
+from mat_io import as_cell_list, as_cell_rows, load_mat
+
+KINDS = ['raw', 'parsed', 'segmented', 'calver']  # the kinds of .mat that are converted
+
+
+def json_safe(value):
+    """ A small MATLAB variable (e.g. PrefBin) as something json can write. """
+    if isinstance(value, dict):
+        return {k: json_safe(v) for k, v in value.items()}
+    if isinstance(value, np.ndarray):
+        return [json_safe(v) for v in value.ravel()] if value.ndim > 0 else json_safe(value[()])
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, (str, int, float, bool)) or value is None:
+        return value
+    return str(value)
+
+
+def column_type(name, values):
+    """ (dtype, missing code) to store a numeric column as: its integer type
+  in recording.SCHEMA if every value fits, with a missing code if -9999
+  doesn't; float64 (and no code) otherwise. """
+    dtype = np.dtype(recording.SCHEMA.get(name, np.float64))
+    if dtype.kind == 'f':
+        return np.dtype(np.float64), None
+    values = np.asarray(values, dtype=np.float64)
+    missing = values == recording.MISSING
+    present = values[~missing]
+    info = np.iinfo(dtype)
+    code = None
+    if missing.any() and recording.MISSING < info.min:
+        code = info.min
+    lo = info.min + (code is not None)  # the code can't also be a value
+    if len(present) > 0 and not (np.all(present == np.round(present)) and present.min() >= lo and
+                                 present.max() <= info.max):
+        return np.dtype(np.float64), None  # NaN, fractions or out of range
+    return dtype, code
+
+
+def store_column(values, dtype, code):
+    """ A numeric column in the type chosen by column_type(). """
+    values = np.asarray(values, dtype=np.float64)
+    if code is not None:
+        values = np.where(values == recording.MISSING, code, values)
+    return values.astype(dtype)
+
+
+def store_types(names, parts):
+    """ (columns, missing codes) for a ColumnWriter, for the columns <names>
+  of <parts> (dicts of arrays, written one after another); text as
+  categories. """
+    columns, missing = collections.OrderedDict(), {}
+    for c in names:
+        if c in STRING_COLS:
+            columns[c] = CATEGORY
+            continue
+        values = np.concatenate([p[c] for p in parts]) if len(parts) > 0 else np.zeros(0)
+        columns[c], code = column_type(c, values)
+        if code is not None:
+            missing[c] = code
+    return columns, missing
+
+
+def typed_parts(parts, columns, missing):
+    """ <parts> with their numeric columns converted as store_types() chose. """
+    return [{c: v if columns.get(c, CATEGORY) == CATEGORY else
+             store_column(v, columns[c], missing.get(c)) for c, v in p.items()} for p in parts]
+
+
+def ordered(cols):
+    """ Column names of a dataCol-like struct, in column order. """
+    return sorted(cols, key=lambda c: cols[c])
+
+
+def find_dataCol(mat_path):
+    """ dataCol for a _Parsed.mat: saved with it when process_individual.m
+  was run stage by stage, otherwise taken from the visit's _RawData.mat. """
+    dataCol = load_mat(mat_path, ['dataCol']).get('dataCol')
+    if dataCol is not None:
+        return dataCol
+    path = os.path.dirname(mat_path)
+    for f in sorted(os.listdir(path)):
+        if file_kind(f) == 'raw':
+            return load_mat(os.path.join(path, f), ['dataCol'])['dataCol']
+    raise ValueError("no dataCol for %s (no _RawData.mat next to it)" % mat_path)
+
+
+def convert_raw(mat_path, writer_args):
+    mat = load_mat(mat_path, ['data', 'dataCol'])
+    data, dataCol = mat['data'], mat['dataCol']
+    names = ordered(dataCol)
+    values = {c: typed_column(data, dataCol[c], c) for c in names}
+    columns, missing = store_types(names, [values])
+    with ColumnWriter(*writer_args(columns, missing)) as writer:
+        writer.attrs['dataCol'] = json_safe(dataCol)
+        writer.append(typed_parts([values], columns, missing)[0])
+        return writer.n_rows
+
+
+def convert_parsed(mat_path, writer_args):
+    cols = find_dataCol(mat_path)
+    mat = load_mat(mat_path, ['ParticData', 'PrefBin'])
+    trials = as_cell_rows(mat['ParticData']['Data'], 3)
+    prefbin = mat.get('PrefBin', {})
+    names = [str(m) for m in np.atleast_1d(prefbin.get('MovieListAsPresented', []))]
+    cols = dict(cols)
+    if 'blink' not in cols:  # added by process_individual.m before parsing
+        cols['blink'] = max(cols.values()) + 1
+    data_names = ordered(cols)
+
+    parts, table = [], []
+    first = 0
+    for t in range(trials.shape[0]):
+        values = {c: typed_column(trials[t, 0], cols[c], c) for c in data_names}
+        n = len(values[data_names[0]])
+        xy = np.asarray(trials[t, 1], dtype=np.float64)
+        xy = xy.reshape(-1, 2) if xy.size > 0 else np.full((n, 2), np.nan)
+        aoi = np.asarray(trials[t, 2], dtype=np.float64).ravel()
+        values['gazeX_int'] = xy[:, 0]
+        values['gazeY_int'] = xy[:, 1]
+        # no AOIs for this movie: missing, so the column can stay int8
+        values['aoi'] = aoi if aoi.size == n else np.full(n, float(recording.MISSING))
+        values['trial'] = np.full(n, t + 1, dtype=np.int32)
+        # extra columns that were empty in the .mat (padded here)
+        empty = [c for c, cell in [('gazeX_int', trials[t, 1]), ('gazeY_int', trials[t, 1]),
+                                   ('aoi', trials[t, 2])] if np.size(cell) == 0]
+        table.append({'name': names[t] if t < len(names) else '', 'first_row': first,
+                      'n_rows': n, 'empty': empty})
+        parts.append(values)
+        first += n
+
+    columns, missing = store_types(data_names + PARSED_EXTRA_COLS, parts)
+    columns['trial'] = np.int32
+    with ColumnWriter(*writer_args(columns, missing)) as writer:
+        for values in typed_parts(parts, columns, missing):
+            writer.append(values)
+        writer.attrs['dataCol'] = json_safe(cols)
+        writer.attrs['PrefBin'] = json_safe(prefbin)
+        writer.attrs['trials'] = table
+        return writer.n_rows
+
+
+def convert_segments(mat_path, writer_args, kind):
+    if kind == 'segmented':
+        var, col_var = 'segmentedData', 'segSummaryCol'
+    else:
+        var, col_var = 'segmentedData_calVer', 'calVerCol'
+    mat = load_mat(mat_path, [var, col_var])
+    cols = mat[col_var]
+    names = ordered(cols)
+    segs = [s for s in as_cell_list(mat[var]) if np.size(s) > 0]
+    parts = [{c: typed_column(seg, cols[c], c) for c in names} for seg in segs]
+    columns, missing = store_types(names, parts)
+    columns['segment'] = np.int32
+
+    with ColumnWriter(*writer_args(columns, missing)) as writer:
+        table = []
+        for i, values in enumerate(typed_parts(parts, columns, missing)):
+            n = len(values[names[0]])
+            values['segment'] = np.full(n, i + 1, dtype=np.int32)
+            entry = {'first_row': writer.n_rows, 'n_rows': n}
+            if n > 0 and 'trial' in values:
+                entry['trial'] = str(values['trial'][0])
+            if n > 0 and 'seg' in values:
+                entry['seg'] = json_safe(values['seg'][0])
+            table.append(entry)
+            writer.append(values)
+        writer.attrs[col_var] = json_safe(cols)
+        writer.attrs['segments'] = table
+        return writer.n_rows
+
+
+def convert(mat_path, force=False):
+    """ Converts one .mat.  Returns (path, status, rows, seconds); status is
+  'converted', 'current' (store already up to date) or an error message. """
+    start = time.time()
+    kind = file_kind(os.path.basename(mat_path))
+    if kind not in KINDS:
+        return mat_path, "not a pipeline .mat file", 0, 0.
+    if not force and is_current(store_path(mat_path), mat_path):
+        return mat_path, 'current', 0, 0.
+    info = source_attrs(mat_path)
+
+    def writer_args(columns, missing):
+        return store_path(mat_path), columns, dict(info, kind=kind), missing
+
+    try:
+        if kind == 'raw':
+            n = convert_raw(mat_path, writer_args)
+        elif kind == 'parsed':
+            n = convert_parsed(mat_path, writer_args)
+        else:
+            n = convert_segments(mat_path, writer_args, kind)
+    except Exception as e:
+        return mat_path, "failed: %s: %s" % (type(e).__name__, e), 0, time.time() - start
+    return mat_path, 'converted', n, time.time() - start
+
+
+def find_mat_files(paths, kinds=KINDS):
+    """ Pipeline .mat files of the given kinds under <paths> (files or
+  directories). """
+    out = []
+    for path in paths:
+        if os.path.isfile(path):
+            out.append(path)
+            continue
+        for dirpath, dirs, files in os.walk(path):
+            dirs[:] = sorted(d for d in dirs if not d.startswith('.') and not d.endswith(STORE_SUFFIX))
+            out += [os.path.join(dirpath, f) for f in sorted(files) if file_kind(f) in kinds]
+    return out
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Convert pipeline .mat files into column stores.")
+    parser.add_argument('paths', nargs='+', help=".mat files, or directories to search for them")
+    parser.add_argument('--jobs', type=int, default=os.cpu_count(),
+                        help="files converted at once (default: number of CPUs)")
+    parser.add_argument('--kinds', nargs='+', choices=KINDS, default=KINDS,
+                        help="which outputs to convert (default: all)")
+    parser.add_argument('--force', action='store_true', help="convert even if the store is up to date")
+    args = parser.parse_args(argv)
+
+    files = find_mat_files(args.paths, args.kinds)
+    # largest first, so one big file doesn't hold up the end of the run
+    files.sort(key=lambda f: -os.path.getsize(f))
+    print("%i files (%s)" % (len(files), ', '.join(FILE_KINDS[k] for k in args.kinds)))
+    counts = collections.Counter()
+    with concurrent.futures.ProcessPoolExecutor(max_workers=args.jobs) as pool:
+        futures = [pool.submit(convert, f, args.force) for f in files]
+        for future in concurrent.futures.as_completed(futures):
+            path, status, n, seconds = future.result()
+            counts[status.split(':')[0]] += 1
+            if status != 'current':
+                print("%s: %s (%i rows, %.1f s)" % (path, status, n, seconds))
+    print(', '.join("%i %s" % (n, status) for status, n in sorted(counts.items())))
+    if counts['failed'] > 0:
+        exit(1)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
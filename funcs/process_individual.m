@@ -5,14 +5,48 @@ function [success] = process_individual(path, varargin)
 % assumes that data{} and dataCol.() have already been created by
 % read_et_data.m. There should already be a folder for each visit in
 % inFilePath
+%
+% Optional inputs (name-value pairs):
+% stages - cell array of the stages to run: 'blinks', 'trials',
+% 'interpolate', 'aoi', 'timeseries' (default: all of them).  When stages
+% are given, each stage saves its output (id_Blinks.mat, id_Trials.mat,
+% id_Interpolated.mat, id_Parsed.mat, then the time series), and a stage
+% that isn't run is loaded from its file, so that a visit can be picked up
+% after the last stage that worked (see run_visits.py).
+% rootDir - path to the fractal-eye-analyses folder (default: found from pwd)
 success = 0;
 
+%% Check varargin
+allStages = {'blinks', 'trials', 'interpolate', 'aoi', 'timeseries'};
+stages = allStages;
+saveStages = 0;
+rootDir = '';
+if nargin>1
+    for v=1:2:length(varargin)
+        switch varargin{v}
+            case 'stages'
+                stages = varargin{v+1};
+                saveStages = 1;
+            case 'rootDir'
+                rootDir = varargin{v+1};
+            otherwise
+                error(['Input ' varargin{v} ' not recognized']);
+        end
+    end
+end
+unknown = stages(~ismember(stages, allStages));
+if ~isempty(unknown)
+    error(['Unknown stage: ' unknown{1}]);
+end
+runStage = @(s) any(strcmp(stages, s));
 
 %% set paths
 % For paths to set correctly, must by in "fractal-eye-analyses" folder
-[s, e]=regexp(pwd, 'fractal-eye-analyses');
-rootDir = pwd;
-rootDir = rootDir(1:e);
+if isempty(rootDir)
+    [s, e]=regexp(pwd, 'fractal-eye-analyses');
+    rootDir = pwd;
+    rootDir = rootDir(1:e);
+end
 
 addpath(genpath(rootDir));
 aoiPath = [rootDir '/dynamic_aoi/'];
@@ -20,8 +54,10 @@ aoiPath = [rootDir '/dynamic_aoi/'];
 
 %%
 % read in bounding boxes & make data structure of bounding boxes
-[master_AOI, aoi_headers] = read_AOI(aoiPath);
-[aoiStruct] = make_aoi_struct(master_AOI, aoi_headers);
+if runStage('aoi')
+    [master_AOI, aoi_headers] = read_AOI(aoiPath);
+    [aoiStruct] = make_aoi_struct(master_AOI, aoi_headers);
+end
 
 %%
 %% clear workspace & set up output directory
@@ -31,70 +67,115 @@ disp(['Attempting to read in data for ' path]);
 myDir = dir(path);
 files = {myDir.name};
 f = files(contains(files, 'RawData.mat')); % Should only be one match
-f= f{1};
 
-if isempty(f) 
+if isempty(f)
     disp('Did not find _RawData.mat');
     return
 end
+f= f{1};
 
 %% % Load raw et data
 fullPath =  [path, '/', f];
 % get id
 temp=strsplit(f, '_');
 id = [temp{1}, '_', temp{2}, '_', temp{3}];
+outPrefix = [path '/' id];
 
 try
     %% Reading in et data
-    load(fullPath);
+    if runStage('blinks') || runStage('trials')
+        load(fullPath);
+    end
     %% %% Flag Blinks
-    disp(' ');
-    disp(['----------------------------------------']);
-    disp('Identify Blinks');
-    pup = [cell2mat(data(:, dataCol.pupL))     cell2mat(data(:, dataCol.pupR))];
-    pup(pup==-9999) = NaN;
-    pup = mean(pup, 2, 'omitnan');
-    pup(isnan(pup)) = 0;
-    blinksPositions = blinkDetection(pup,300);
-    
-    % Fill BlinkBool Column with 1 for blinks
-    data(:,size(data,2)+1) = {0};
-    for i = 1:size(blinksPositions,1)
-        data(blinksPositions(i,1):blinksPositions(i,2), size(data,2) ) = {1};
+    if runStage('blinks')
+        disp(' ');
+        disp(['----------------------------------------']);
+        disp('Identify Blinks');
+        pup = [cell2mat(data(:, dataCol.pupL))     cell2mat(data(:, dataCol.pupR))];
+        pup(pup==-9999) = NaN;
+        pup = mean(pup, 2, 'omitnan');
+        pup(isnan(pup)) = 0;
+        blinksPositions = blinkDetection(pup,300);
+        if saveStages
+            save([outPrefix '_Blinks'], 'blinksPositions');
+        end
+    elseif runStage('trials')
+        load([outPrefix '_Blinks'], 'blinksPositions');
     end
-    % update dataCol field
-    dataCol.blink = size(data, 2);
-    
+
     %% Parse data into trials
-    disp('Parse trials');
-    [PrefBin, ParticData] = parse_et_totrials(id, data, dataCol);
+    if runStage('trials')
+        % Fill BlinkBool Column with 1 for blinks
+        data(:,size(data,2)+1) = {0};
+        for i = 1:size(blinksPositions,1)
+            data(blinksPositions(i,1):blinksPositions(i,2), size(data,2) ) = {1};
+        end
+        % update dataCol field
+        dataCol.blink = size(data, 2);
+
+        disp('Parse trials');
+        [PrefBin, ParticData] = parse_et_totrials(id, data, dataCol);
+        clear data
+        if saveStages
+            save([outPrefix '_Trials'], 'ParticData', 'PrefBin', 'dataCol');
+        end
+    elseif runStage('interpolate')
+        load([outPrefix '_Trials'], 'ParticData', 'PrefBin', 'dataCol');
+    end
+
     %% Interpolate data
-    disp('Interpolate missing data');
-    plotFlag = 0;
-    [propInterpolated, ParticData, PrefBin] = interpolate_data(ParticData, PrefBin, plotFlag, dataCol, 'strict');
-    
+    if runStage('interpolate')
+        disp('Interpolate missing data');
+        plotFlag = 0;
+        [propInterpolated, ParticData, PrefBin] = interpolate_data(ParticData, PrefBin, plotFlag, dataCol, 'strict');
+        if saveStages
+            save([outPrefix '_Interpolated'], 'ParticData', 'PrefBin', 'dataCol', 'propInterpolated');
+        end
+    elseif runStage('aoi')
+        load([outPrefix '_Interpolated'], 'ParticData', 'PrefBin', 'dataCol', 'propInterpolated');
+    end
+
     %% Flag fixations on Aois (based on interpolated data)
-    [ParticData, PrefBin] = add_fix_faces(ParticData, PrefBin,aoiStruct);
-    
-    % Save  data
-    disp('Save data & interpolated data & aoi data');
-    save([path '/' id '_Parsed'], 'ParticData', 'PrefBin');
-    %% dl time series
-    disp('Create time series');
-    [segmentedData,segSummaryCol]  = generate_timeseries(ParticData, PrefBin, dataCol);
-    disp('Saving segmented data');
-    save([path '/' id '_segmentedTimeSeries'],'segmentedData', 'segSummaryCol');
-    
-    %% calver time series
-    disp('Make calver time series');
-    [segmentedData_calVer, calVerCol] = generate_timeseries_calver(PrefBin, ParticData, dataCol);
-    disp('Saving CalVer time series');
-    save([path '/' id '_calVerTimeSeries'],'segmentedData_calVer', 'calVerCol');
+    if runStage('aoi')
+        [ParticData, PrefBin] = add_fix_faces(ParticData, PrefBin,aoiStruct);
+
+        % Save  data
+        disp('Save data & interpolated data & aoi data');
+        if saveStages
+            % dataCol and propInterpolated are needed to make the time series
+            save([outPrefix '_Parsed'], 'ParticData', 'PrefBin', 'dataCol', 'propInterpolated');
+        else
+            save([outPrefix '_Parsed'], 'ParticData', 'PrefBin');
+        end
+    elseif runStage('timeseries')
+        load([outPrefix '_Parsed'], 'ParticData', 'PrefBin', 'dataCol', 'propInterpolated');
+    end
+
+    if runStage('timeseries')
+        %% dl time series
+        disp('Create time series');
+        [segmentedData,segSummaryCol]  = generate_timeseries(ParticData, PrefBin, dataCol);
+        disp('Saving segmented data');
+        save([outPrefix '_segmentedTimeSeries'],'segmentedData', 'segSummaryCol');
+
+        %% calver time series
+        disp('Make calver time series');
+        [segmentedData_calVer, calVerCol] = generate_timeseries_calver(PrefBin, ParticData, dataCol);
+        disp('Saving CalVer time series');
+        save([outPrefix '_calVerTimeSeries'],'segmentedData_calVer', 'calVerCol');
+
+        %% data-quality summary (indexed by quality_index.py)
+        disp('Saving data-quality summary');
+        write_quality_summary([outPrefix '_quality.csv'], ParticData, PrefBin, dataCol, ...
+            propInterpolated, segmentedData, segSummaryCol);
+    end
     %%
     success = 1;
     disp([id ' finished!']);
 catch ME
-    disp([ME.identifier ' ' id])
+    % report the whole error (message and stack), not just its identifier
+    disp(['Error processing ' id ':']);
+    disp(getReport(ME, 'extended', 'hyperlinks', 'off'));
     return
 end
 
@@ -0,0 +1,323 @@
+#!/usr/bin/python3
+# Indexed store of data-quality measures, so that cohort inclusion queries
+# don't have to reload every .mat file.
+#
+# process_individual.m writes <id>_quality.csv for each visit (one row per
+# trial and per time-series segment; see write_quality_summary.m).
+# calibration.py writes <dir>_results.db (or, for older runs, <dir>_output.csv
+# and <dir>_distances_summary.csv).
+# This script gathers all of them into one SQLite database:
+#
+#   python3 quality_index.py update quality.db ~/process-et-data/data/ path/to/calver_output.csv
+#   python3 quality_index.py query quality.db --max-missing 0.3 --max-accuracy 3 --visits
+#
+# Files are only re-read when they have changed since the last update.
+import argparse
+import csv
+import os
+import sqlite3
+import sys
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS segments (
+    participant TEXT NOT NULL,
+    visit TEXT NOT NULL,
+    trial TEXT NOT NULL,
+    segment INTEGER NOT NULL,  -- 0 = whole trial
+    n_samples INTEGER,
+    prop_missing REAL,
+    prop_interpolated REAL,
+    longest_fix_dur REAL,
+    n_blinks INTEGER,
+    validity_0 INTEGER,
+    validity_1 INTEGER,
+    validity_2 INTEGER,
+    validity_3 INTEGER,
+    validity_4 INTEGER,
+    validity_missing INTEGER,
+    mean_distance REAL,
+    PRIMARY KEY (participant, visit, trial, segment)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS segments_prop_missing ON segments (prop_missing);
+CREATE INDEX IF NOT EXISTS segments_prop_interpolated ON segments (prop_interpolated);
+CREATE INDEX IF NOT EXISTS segments_trial ON segments (trial, segment);
+
+CREATE TABLE IF NOT EXISTS calibration (
+    participant TEXT NOT NULL,
+    visit TEXT NOT NULL,
+    stimulus TEXT NOT NULL,
+    accuracy REAL,  -- min. euclidean distance, degrees
+    duration REAL,
+    precision_sd_x REAL,
+    precision_sd_y REAL,
+    precision_rms_x REAL,
+    precision_rms_y REAL,
+    PRIMARY KEY (participant, visit, stimulus)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS calibration_accuracy ON calibration (accuracy);
+
+CREATE TABLE IF NOT EXISTS distances (
+    participant TEXT NOT NULL,
+    visit TEXT NOT NULL,
+    mean_distance REAL,  -- average eye-to-screen distance from calibration.py
+    PRIMARY KEY (participant, visit)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS sources (
+    path TEXT PRIMARY KEY,
+    mtime REAL
+);
+
+CREATE VIEW IF NOT EXISTS quality AS
+SELECT s.*,
+       d.mean_distance AS calibration_distance,
+       c.accuracy AS calibration_accuracy,
+       c.n_valid AS calibration_n_valid
+FROM segments s
+LEFT JOIN distances d USING (participant, visit)
+LEFT JOIN (SELECT participant, visit, AVG(accuracy) AS accuracy, COUNT(accuracy) AS n_valid
+           FROM calibration GROUP BY participant, visit) c USING (participant, visit);
+"""
+
+SEGMENT_COLS = ['participant', 'visit', 'trial', 'segment', 'n_samples', 'prop_missing',
+                'prop_interpolated', 'longest_fix_dur', 'n_blinks', 'validity_0', 'validity_1',
+                'validity_2', 'validity_3', 'validity_4', 'validity_missing', 'mean_distance']
+
+
+def connect(db_path):
+    """ Opens (and if needed creates) the quality database. """
+    conn = sqlite3.connect(db_path, timeout=60)
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def split_id(name):
+    """ Splits a participant name (e.g. JE000053_03_03) into participant and
+  visit, the same way parse_et_totrials.m does. """
+    parts = name.strip().split('_')
+    if len(parts) < 3:
+        return name.strip(), ''
+    return parts[0] + '_' + parts[1], parts[2]
+
+
+def to_number(value):
+    """ Converts a value from a .csv to a float; missing values become None. """
+    value = value.strip()
+    if value in ['', 'N/A', 'NaN', 'nan', '-9999']:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+def ingest_quality_csv(conn, path):
+    """ Loads an <id>_quality.csv written by write_quality_summary.m.  Rows
+  for the visit are replaced, so re-processed visits don't leave stale segments. """
+    with open(path, newline='') as f:
+        rows = list(csv.DictReader(f))
+    if len(rows) == 0:
+        return 0
+
+    records = []
+    for row in rows:
+        record = [row['participant'], row['visit'], row['trial'], int(row['segment'])]
+        record += [to_number(row[c]) for c in SEGMENT_COLS[4:]]
+        records.append(record)
+
+    with conn:
+        for (participant, visit) in set((r[0], r[1]) for r in records):
+            conn.execute("DELETE FROM segments WHERE participant = ? AND visit = ?",
+                         (participant, visit))
+        conn.executemany("INSERT OR REPLACE INTO segments VALUES (%s)" % ', '.join('?' * len(SEGMENT_COLS)),
+                         records)
+    return len(records)
+
+
+def ingest_calibration_output(conn, path):
+    """ Loads a <dir>_output.csv written by calibration.py.  The file holds one
+  block per participant (name, header, one row per stimulus, averages); blocks
+  appended by later runs replace earlier ones. """
+    records = {}
+    participant = None
+    with open(path, newline='') as f:
+        for row in csv.reader(f):
+            if len(row) == 0:
+                continue
+            if len(row) == 1:
+                participant = split_id(row[0])
+            elif row[0] in ['Stimulus', 'Averages:', 'Number valid:'] or participant is None:
+                continue
+            else:
+                values = [to_number(v) for v in row[1:]]
+                # Stimulus, distance, coord x, coord y, duration, SD x, SD y, RMS x, RMS y
+                records[participant + (row[0],)] = [values[0], values[3]] + values[4:8]
+
+    with conn:
+        conn.executemany("INSERT OR REPLACE INTO calibration VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                         [list(k) + v for k, v in records.items()])
+    return len(records)
+
+
+def ingest_distances(conn, path):
+    """ Loads a <dir>_distances_summary.csv written by calibration.py. """
+    records = {}
+    with open(path, newline='') as f:
+        for row in csv.reader(f):
+            if len(row) != 2 or row[0].startswith('Participant Name') or row[0].startswith('Ave. dist.'):
+                continue
+            records[split_id(row[0])] = to_number(row[1])
+
+    with conn:
+        conn.executemany("INSERT OR REPLACE INTO distances VALUES (?, ?, ?)",
+                         [list(k) + [v] for k, v in records.items()])
+    return len(records)
+
+
+def ingest_results_store(conn, path):
+    """ Loads calibration results and distances from a <dir>_results.db
+  written by calibration.py (see calibration_verification/results_store.py). """
+    store = sqlite3.connect(path, timeout=60)
+    try:
+        runs = store.execute("SELECT participant, distance FROM runs ORDER BY rowid").fetchall()
+        results = store.execute("""SELECT r.participant, r.stimulus, r.min_dist, r.duration,
+            r.prec_sd_x, r.prec_sd_y, r.prec_rms_x, r.prec_rms_y
+            FROM results r JOIN runs USING (file_hash, params_hash) ORDER BY runs.rowid""").fetchall()
+    finally:
+        store.close()
+
+    with conn:
+        conn.executemany("INSERT OR REPLACE INTO distances VALUES (?, ?, ?)",
+                         [list(split_id(name)) + [distance] for (name, distance) in runs])
+        conn.executemany("INSERT OR REPLACE INTO calibration VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                         [list(split_id(row[0])) + list(row[1:]) for row in results])
+    return len(results)
+
+
+def ingest_file(conn, path):
+    """ Picks the loader for a file based on its name.  Returns the number
+  of rows loaded, or None if the file isn't one we index. """
+    if path.endswith('_quality.csv'):
+        return ingest_quality_csv(conn, path)
+    elif path.endswith('_distances_summary.csv'):
+        return ingest_distances(conn, path)
+    elif path.endswith('_output.csv'):
+        return ingest_calibration_output(conn, path)
+    elif path.endswith('_results.db'):
+        return ingest_results_store(conn, path)
+    return None
+
+
+def find_sources(paths):
+    """ Lists the indexable files in <paths> (files, or directories to walk). """
+    suffixes = ('_quality.csv', '_distances_summary.csv', '_output.csv', '_results.db')
+    for path in paths:
+        if os.path.isfile(path):
+            yield os.path.abspath(path)
+            continue
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for f in sorted(files):
+                if f.endswith(suffixes):
+                    yield os.path.abspath(os.path.join(root, f))
+
+
+def update(conn, paths, verbose=True):
+    """ Loads every new or changed file under <paths> into the index. """
+    seen = dict(conn.execute("SELECT path, mtime FROM sources"))
+    n_files = 0
+    for path in find_sources(paths):
+        mtime = os.path.getmtime(path)
+        if os.path.exists(path + '-wal'):  # sqlite databases in WAL mode
+            mtime = max(mtime, os.path.getmtime(path + '-wal'))
+        if seen.get(path) == mtime:
+            continue
+        n = ingest_file(conn, path)
+        if n is None:
+            continue
+        with conn:
+            conn.execute("INSERT OR REPLACE INTO sources VALUES (?, ?)", (path, mtime))
+        n_files += 1
+        if verbose:
+            print("Indexed %i rows from %s" % (n, path))
+    return n_files
+
+
+def query(conn, max_missing=None, max_interpolated=None, min_longest_fix=None,
+          max_accuracy=None, trial=None, segments_only=False, where=None, visits=False):
+    """ Returns the rows of the <quality> view that pass the given criteria.
+  With <visits>, returns one row per participant / visit with the number of
+  trials / segments that passed instead. """
+    clauses = []
+    params = []
+    if max_missing is not None:
+        clauses.append("prop_missing <= ?")
+        params.append(max_missing)
+    if max_interpolated is not None:
+        clauses.append("prop_interpolated <= ?")
+        params.append(max_interpolated)
+    if min_longest_fix is not None:
+        clauses.append("longest_fix_dur >= ?")
+        params.append(min_longest_fix)
+    if max_accuracy is not None:
+        clauses.append("calibration_accuracy <= ?")
+        params.append(max_accuracy)
+    if trial is not None:
+        clauses.append("trial LIKE ?")
+        params.append(trial)
+    if segments_only:
+        clauses.append("segment > 0")
+    if where is not None:
+        clauses.append("(%s)" % where)
+
+    if visits:
+        sql = "SELECT participant, visit, COUNT(*) AS n_passed FROM quality"
+    else:
+        sql = "SELECT * FROM quality"
+    if len(clauses) > 0:
+        sql += " WHERE " + " AND ".join(clauses)
+    if visits:
+        sql += " GROUP BY participant, visit"
+    sql += " ORDER BY participant, visit"
+
+    cursor = conn.execute(sql, params)
+    header = [c[0] for c in cursor.description]
+    return header, cursor.fetchall()
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Indexed store of per-visit data-quality measures.")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('update', help="index new or changed quality / calibration files")
+    p.add_argument('db')
+    p.add_argument('paths', nargs='+', help="data directories or individual files")
+
+    p = sub.add_parser('query', help="print rows that pass inclusion criteria as .csv")
+    p.add_argument('db')
+    p.add_argument('--max-missing', type=float)
+    p.add_argument('--max-interpolated', type=float)
+    p.add_argument('--min-longest-fix', type=float, help="ms")
+    p.add_argument('--max-accuracy', type=float, help="mean calibration accuracy, degrees")
+    p.add_argument('--trial', help="SQL LIKE pattern, e.g. '0%%_converted.avi'")
+    p.add_argument('--segments-only', action='store_true', help="ignore trial-level rows")
+    p.add_argument('--where', help="extra SQL condition on the quality view")
+    p.add_argument('--visits', action='store_true', help="one row per participant / visit")
+
+    args = parser.parse_args(argv)
+    conn = connect(args.db)
+    if args.command == 'update':
+        n = update(conn, args.paths)
+        print("Updated %i file(s) in %s" % (n, args.db))
+    else:
+        header, rows = query(conn, args.max_missing, args.max_interpolated, args.min_longest_fix,
+                             args.max_accuracy, args.trial, args.segments_only, args.where,
+                             args.visits)
+        wf = csv.writer(sys.stdout)
+        wf.writerow(header)
+        wf.writerows(rows)
+    conn.close()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
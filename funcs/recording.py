@@ -0,0 +1,229 @@
+# Compact in-memory recording: typed columns that Python stages can share.
+#
+# The MATLAB pipeline keeps a recording as a cell array with one cell per
+# sample and column, and each stage converts the columns it needs again
+# (cell2mat(data(:, dataCol.X))).  A Recording converts each column once, to
+# a small type that holds it: int64 time stamps, float32 raw gaze, int8 validity
+# codes, and text (media names, ...) as integer codes into the list of its
+# distinct values.  Missing values (-9999, or text that isn't a number) are
+# marked in a boolean mask per column instead of by a sentinel; float columns
+# also hold NaN there.  Slicing a Recording (one trial, one segment) gives a
+# Recording that shares its memory.
+#
+# et_catalog.py's Visit.recording() decodes a .mat straight into one (or uses
+# a mat_to_columns.py store's typed columns as they are), and gaze_heatmaps.py
+# reads visits that way.  et_processing.py and et_chunked.py still work on
+# float64 columns with -9999, as the MATLAB code does, so that their results
+# match it exactly; from_columns() / from_store() convert their output.
+#
+#   import recording
+#   rec = recording.from_columns(et_processing.read_txt('.../JE000053_03_03.txt'))
+#   rec = recording.from_store(column_store.ColumnStore('.../JE000053_03_03_Interpolated_columns'))
+#   rec = visit.recording('parsed')        # see et_catalog.py
+#   for name, trial in rec.trials():
+#       x = trial['gazeX_int']             # float64, NaN where missing
+#       ok = ~trial.missing('gazeX_int')
+#       media = trial.text('media')
+#   columns = rec.legacy(['gazeX', 'validityL'])   # float64 with -9999, like the .mat
+import numpy as np
+
+MISSING = -9999
+
+# type of each known column; columns not listed here are kept as float64.
+# Pupil size, distance and the interpolated gaze stay float64, since blink
+# detection, the distance averages and interpolation are compared with
+# MATLAB's (double) results.
+SCHEMA = {
+    'timestamp': np.int64,
+    'gazeLx': np.float32, 'gazeLy': np.float32, 'gazeRx': np.float32, 'gazeRy': np.float32,
+    'gazeX': np.float32, 'gazeY': np.float32,
+    'gazeEventDur': np.float32, 'saccAmp': np.float32,
+    'validityL': np.int8, 'validityR': np.int8, 'blink': np.int8, 'aoi': np.int8,
+    'fixIdx': np.int32, 'saccIdx': np.int32, 'trial': np.int32, 'segment': np.int32,
+    'row': np.int64,
+    # segmentedData / segmentedData_calVer (generate_timeseries.m)
+    'blinkBool': np.int8, 'longestFixBool': np.int8, 'vl': np.int8, 'vr': np.int8, 'seg': np.int32}
+
+
+def code_dtype(n_categories):
+    """ Smallest integer type for codes into <n_categories> values. """
+    for dtype in (np.int8, np.int16, np.int32):
+        if n_categories <= np.iinfo(dtype).max + 1:
+            return dtype
+    return np.int64
+
+
+def encode(values):
+    """ (codes, categories) for an array of strings. """
+    categories, codes = np.unique(np.asarray(values, dtype=object).astype(str), return_inverse=True)
+    return codes.astype(code_dtype(len(categories))), [str(c) for c in categories]
+
+
+def typed(name, values):
+    """ (array, mask) for a numeric column: <values> converted to the column's
+  type, with a mask of the missing values (None if there are none). """
+    values = np.asarray(values)
+    missing = values == MISSING
+    if values.dtype.kind == 'f':
+        missing |= np.isnan(values)
+    mask = missing if missing.any() else None
+    dtype = np.dtype(SCHEMA.get(name, np.float64))
+
+    if dtype.kind == 'f':
+        out = values.astype(dtype)
+        if mask is not None:
+            out[mask] = np.nan
+        return out, mask
+    present = values[~missing] if mask is not None else values
+    info = np.iinfo(dtype)
+    if len(present) > 0 and (np.any(present != np.round(present)) or present.min() < info.min or
+                             present.max() > info.max):
+        return typed(None, values)  # doesn't fit; keep as float64
+    out = np.where(missing, 0, values).astype(dtype)
+    return out, mask
+
+
+class Recording:
+    """ Typed columns of equal length, with masks of the missing values and
+  the categories of text columns; <attrs> are any other information (e.g.
+  the trials table of a store).  Build with from_columns() or from_store(). """
+
+    __slots__ = ('n_rows', 'attrs', '_data', '_masks', '_categories')
+
+    def __init__(self, n_rows, data, masks=None, categories=None, attrs=None):
+        self.n_rows = n_rows
+        self._data = data
+        self._masks = masks or {}
+        self._categories = categories or {}
+        self.attrs = attrs if attrs is not None else {}
+
+    def __len__(self):
+        return self.n_rows
+
+    def __contains__(self, name):
+        return name in self._data
+
+    def __repr__(self):
+        return "Recording(%i rows, %i columns, %.1f MB)" % (self.n_rows, len(self._data),
+                                                            self.nbytes / 1e6)
+
+    @property
+    def columns(self):
+        return list(self._data)
+
+    @property
+    def nbytes(self):
+        return (sum(a.nbytes for a in self._data.values()) +
+                sum(m.nbytes for m in self._masks.values()))
+
+    def __getitem__(self, name):
+        """ One column as stored (codes for text columns). """
+        return self._data[name]
+
+    def missing(self, name):
+        """ Which rows of a column are missing. """
+        mask = self._masks.get(name)
+        return mask if mask is not None else np.zeros(self.n_rows, dtype=bool)
+
+    def categories(self, name):
+        """ The strings a text column's codes refer to (None for other
+  columns). """
+        return self._categories.get(name)
+
+    def text(self, name):
+        """ A text column decoded, as an object array of str. """
+        return np.asarray(self._categories[name], dtype=object)[self._data[name]]
+
+    def legacy(self, names=None):
+        """ Columns in the form the .mat files / et_processing.py have them:
+  float64 with -9999 where missing, and object arrays for text.  Values of
+  float32 columns (see SCHEMA) come back rounded to float32, about 7
+  significant digits; the other columns come back exactly. """
+        out = {}
+        for name in names if names is not None else self.columns:
+            if name in self._categories:
+                out[name] = self.text(name)
+                continue
+            values = self._data[name].astype(np.float64)
+            if name in self._masks:
+                values[self._masks[name]] = MISSING
+            out[name] = values
+        return out
+
+    def rows(self, start, stop):
+        """ Rows <start>:<stop>, sharing this recording's memory. """
+        start, stop, _ = slice(start, stop).indices(self.n_rows)
+        stop = max(start, stop)
+        return Recording(stop - start, {k: v[start:stop] for k, v in self._data.items()},
+                         {k: m[start:stop] for k, m in self._masks.items()}, self._categories,
+                         self.attrs)
+
+    def select(self, names):
+        """ A recording with only the columns <names> (no copying). """
+        return Recording(self.n_rows, {k: self._data[k] for k in names},
+                         {k: self._masks[k] for k in names if k in self._masks},
+                         {k: self._categories[k] for k in names if k in self._categories},
+                         self.attrs)
+
+    def split(self, table):
+        """ Views of the parts in a table of {'first_row', 'n_rows', ...}
+  (e.g. attrs['trials'] or attrs['segments'] of a store). """
+        return [self.rows(part['first_row'], part['first_row'] + part['n_rows']) for part in table]
+
+    def trials(self):
+        """ (name, Recording) for each trial in attrs['trials']. """
+        table = self.attrs.get('trials', [])
+        return [(t.get('name', ''), r) for t, r in zip(table, self.split(table))]
+
+    def segments(self):
+        """ A Recording for each segment in attrs['segments']. """
+        return self.split(self.attrs.get('segments', []))
+
+
+def from_columns(columns, attrs=None):
+    """ A Recording from a dict of columns: numbers (float, with -9999 or NaN
+  for missing values) or object arrays of text, e.g. from
+  et_processing.read_txt() or et_catalog.  <columns> can also be (name,
+  values) pairs, e.g. a generator decoding one column at a time, so only
+  the typed columns are kept. """
+    data, masks, categories = {}, {}, {}
+    n_rows = None
+    for name, values in columns.items() if hasattr(columns, 'items') else columns:
+        values = np.asarray(values)
+        if n_rows is None:
+            n_rows = len(values)
+        elif len(values) != n_rows:
+            raise ValueError("column %s has %i rows, expected %i" % (name, len(values), n_rows))
+        if values.dtype.kind in 'OUS':
+            data[name], categories[name] = encode(values)
+        else:
+            data[name], mask = typed(name, values)
+            if mask is not None:
+                masks[name] = mask
+    return Recording(n_rows or 0, data, masks, categories, attrs)
+
+
+def from_store(store, names=None):
+    """ A Recording of (some of the) columns of a column_store.ColumnStore.
+  Integer columns already stored in their type (see mat_to_columns.py) are
+  used memory-mapped as they are; text columns' int32 codes are narrowed to
+  the type from_columns() would give them. """
+    data, masks, categories = {}, {}, {}
+    for name in names if names is not None else store.columns:
+        cats = store.categories(name)
+        values = store[name]
+        if cats is not None:
+            dtype = code_dtype(len(cats))
+            data[name] = values if values.dtype == dtype else values.astype(dtype)
+            categories[name] = cats
+            continue
+        if values.dtype.kind in 'iu' and values.dtype == np.dtype(SCHEMA.get(name, np.float64)):
+            code = store.missing_code(name)
+            data[name] = values
+            mask = values == (code if code is not None else MISSING)
+            mask = mask if mask.any() else None
+        else:
+            data[name], mask = typed(name, values)
+        if mask is not None:
+            masks[name] = mask
+    return Recording(len(store), data, masks, categories, dict(store.attrs))
@@ -0,0 +1,190 @@
+#!/usr/bin/python3
+# Resamples trials / time-series segments onto a uniform time grid.
+#
+# Tobii time stamps jitter and samples get dropped, so the data are never
+# exactly 300 Hz and segments of the same movie end up with different
+# lengths.  This puts each segment's gaze coordinates (linear interpolation)
+# and validity / blink / AOI flags (nearest neighbour) onto an evenly spaced
+# grid, so that segments can be stacked into 2-D arrays (segments x samples)
+# and processed together.
+#
+#   python3 resample_timeseries.py path/to/id_segmentedTimeSeries.mat --rate 300
+#
+# writes id_segmentedTimeSeries_resampled.npz, with one 2-D array per column.
+import argparse
+import os
+import sys
+
+import numpy as np
+
+# columns of segmentedData (see generate_timeseries.m) and how to resample them
+LINEAR_COLS = ['x', 'y']
+NEAREST_COLS = {'blinkBool': np.int16, 'longestFixBool': np.int16, 'aoi': np.int16,
+                'vl': np.int16, 'vr': np.int16}
+
+
+def uniform_grid(t_start, t_end, rate_hz):
+    """ Time stamps (ms) from <t_start> to <t_end> (inclusive, if it falls on
+  the grid) at <rate_hz>. """
+    step = 1000. / rate_hz
+    n = int(np.floor((t_end - t_start) / step + 1e-9)) + 1
+    return t_start + step * np.arange(n)
+
+
+def clean_time(time):
+    """ Returns the order in which to take samples so that time stamps are
+  strictly increasing.  Of samples with the same time stamp, the last one is
+  kept (as in parse_et_totrials.m). """
+    time = np.asarray(time, dtype=np.float64)
+    order = np.argsort(time, kind='stable')
+    t = time[order]
+    keep = np.append(t[1:] != t[:-1], True)
+    return order[keep]
+
+
+def resample_linear(time, values, grid, missing=-9999, max_gap=None):
+    """ Linearly interpolates <values> at <grid>.  Grid points next to a missing
+  sample (<missing> or NaN), outside the recording, or inside a gap between
+  samples longer than <max_gap> ms are NaN. """
+    values = np.asarray(values, dtype=np.float64).copy()
+    values[values == missing] = np.nan
+    right = np.clip(np.searchsorted(time, grid, side='right'), 1, len(time) - 1)
+    left = right - 1
+    dt = time[right] - time[left]
+    w = (grid - time[left]) / dt
+    out = values[left] * (1. - w) + values[right] * w
+    # samples that fall exactly on a time stamp don't depend on the next one
+    exact = grid == time[left]
+    out[exact] = values[left][exact]
+    exact = grid == time[right]
+    out[exact] = values[right][exact]
+    out[(grid < time[0]) | (grid > time[-1])] = np.nan
+    if max_gap is not None:
+        out[(dt > max_gap) & ~(grid == time[left]) & ~(grid == time[right])] = np.nan
+    return out
+
+
+def nearest_index(time, grid):
+    """ Index of the sample closest in time to each grid point (the earlier
+  sample wins ties). """
+    right = np.clip(np.searchsorted(time, grid, side='left'), 1, len(time) - 1)
+    left = right - 1
+    return np.where(grid - time[left] <= time[right] - grid, left, right)
+
+
+def resample(time, columns, rate_hz=300, linear=LINEAR_COLS, t_start=None, n_samples=None,
+             max_gap=None, missing=-9999):
+    """ Resamples one trial or segment.  <columns> maps column names to arrays
+  the same length as <time> (ms).  Columns in <linear> are interpolated; the
+  rest take the value of the nearest sample (<missing> outside the
+  recording).  The grid starts at <t_start> (default: first time stamp) and
+  has <n_samples> points (default: as many as fit before the last time
+  stamp).  Returns a dict with 'time' and the resampled columns. """
+    time = np.asarray(time, dtype=np.float64)
+    order = clean_time(time)
+    time = time[order]
+    if t_start is None:
+        t_start = time[0]
+    if n_samples is None:
+        grid = uniform_grid(t_start, time[-1], rate_hz)
+    else:
+        grid = t_start + (1000. / rate_hz) * np.arange(n_samples)
+
+    out = {'time': grid}
+    if len(time) == 1:
+        time = np.array([time[0], time[0] + 1])
+        order = np.array([order[0], order[0]])
+    idx = nearest_index(time, grid)
+    for name, values in columns.items():
+        values = np.asarray(values)[order]
+        if name in linear:
+            out[name] = resample_linear(time, values, grid, missing, max_gap)
+        else:
+            out[name] = values[idx]
+            out[name][(grid < time[0]) | (grid > time[-1])] = missing
+    return out
+
+
+def stack(resampled, column, n_samples=None, fill=np.nan):
+    """ Stacks one column of several resampled segments into a 2-D array
+  (segments x samples).  Segments are cut to <n_samples> (default: the
+  longest segment) and shorter ones are padded with <fill>. """
+    lengths = [len(r[column]) for r in resampled]
+    if n_samples is None:
+        n_samples = max(lengths) if len(lengths) > 0 else 0
+    dtype = np.result_type(*[r[column].dtype for r in resampled]) if len(resampled) > 0 else np.float64
+    if isinstance(fill, float) and np.isnan(fill):
+        dtype = np.result_type(dtype, np.float64)
+    out = np.full((len(resampled), n_samples), fill, dtype=dtype)
+    for i, r in enumerate(resampled):
+        n = min(n_samples, len(r[column]))
+        out[i, :n] = r[column][:n]
+    return out
+
+
+def amplitude(x, y, rate_hz):
+    """ Amplitude and arc tan of gaze, as in generate_timeseries.m, for 2-D
+  arrays of evenly spaced samples (one row per segment).  The last sample of
+  each row is 0. """
+    dx2 = np.diff(x, axis=-1) ** 2
+    dy2 = np.diff(y, axis=-1) ** 2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        amp = np.sqrt(dx2 + dy2) / (1000. / rate_hz)
+        arctan = np.arctan(dy2 / dx2)
+    pad = [(0, 0)] * (amp.ndim - 1) + [(0, 1)]
+    return np.pad(amp, pad), np.pad(arctan, pad)
+
+
+def resample_segments(segmentedData, segSummaryCol, rate_hz=300, n_samples=None, max_gap=None):
+    """ Resamples every segment in segmentedData (from _segmentedTimeSeries.mat)
+  and stacks them.  Returns a dict of 2-D arrays (segments x samples) plus the
+  trial name, segment number and number of grid samples of each segment. """
+    from mat_io import as_cell_list, cell_column
+
+    resampled = []
+    trials = []
+    segs = []
+    for seg in as_cell_list(segmentedData):
+        if np.size(seg) == 0:
+            continue
+        time = cell_column(seg, segSummaryCol['timestamp'])
+        columns = {c: cell_column(seg, segSummaryCol[c]) for c in LINEAR_COLS}
+        for c, dtype in NEAREST_COLS.items():
+            columns[c] = cell_column(seg, segSummaryCol[c], missing=-9999).astype(dtype)
+        r = resample(time, columns, rate_hz, n_samples=n_samples, max_gap=max_gap)
+        # time relative to the start of the segment
+        r['time'] = r['time'] - r['time'][0]
+        resampled.append(r)
+        trials.append(str(cell_column(seg, segSummaryCol['trial'], dtype=object)[0]))
+        segs.append(int(cell_column(seg, segSummaryCol['seg'])[0]))
+
+    out = {'trial': np.array(trials), 'seg': np.array(segs),
+           'n_samples': np.array([len(r['time']) for r in resampled])}
+    for c in ['time'] + LINEAR_COLS:
+        out[c] = stack(resampled, c, n_samples)
+    for c, dtype in NEAREST_COLS.items():
+        out[c] = stack(resampled, c, n_samples, fill=-9999)
+    out['amp'], out['arctan'] = amplitude(out['x'], out['y'], rate_hz)
+    return out
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Resample time-series segments onto a uniform grid.")
+    parser.add_argument('mat_file', help="_segmentedTimeSeries.mat")
+    parser.add_argument('--rate', type=float, default=300., help="Hz (default 300)")
+    parser.add_argument('--n-samples', type=int, help="fixed number of samples per segment")
+    parser.add_argument('--max-gap', type=float, help="don't interpolate coordinates across gaps longer than this (ms)")
+    parser.add_argument('--out', help="output .npz (default: next to the input)")
+    args = parser.parse_args(argv)
+
+    from mat_io import load_mat
+    mat = load_mat(args.mat_file, ['segmentedData', 'segSummaryCol'])
+    out = resample_segments(mat['segmentedData'], mat['segSummaryCol'], args.rate, args.n_samples,
+                            args.max_gap)
+    out_file = args.out or os.path.splitext(args.mat_file)[0] + '_resampled.npz'
+    np.savez_compressed(out_file, rate=args.rate, **out)
+    print("Resampled %i segments to %s" % (len(out['trial']), out_file))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,301 @@
+#!/usr/bin/python3
+# Runs the per-visit pipeline for a whole cohort on a local process pool.
+#
+# Every directory under data/ holding a Tobii export (.tsv), a prepped .txt or
+# a _RawData.mat is a visit.  Each visit goes through the stages
+#
+#   prep (prep_tobii_output_individual.R)  .tsv          -> .txt, _colnames.txt
+#   read (read_et_data_individual.m)       .txt          -> _RawData.mat
+#   blinks, trials, interpolate, aoi, timeseries (process_individual.m)
+#                                          _RawData.mat  -> _Blinks.mat -> _Trials.mat
+#                                          -> _Interpolated.mat -> _Parsed.mat
+#                                          -> _segmentedTimeSeries.mat, _calVerTimeSeries.mat,
+#                                             _quality.csv
+#
+# A stage is skipped if its outputs are newer than its inputs, so a rerun only
+# redoes what changed and a visit that failed picks up at the stage that
+# failed.  Visits run in parallel, largest input first, one single-threaded
+# MATLAB / R process per worker:
+#
+#   python3 funcs/run_visits.py ~/process-et-data/data --jobs 32
+#
+# Each visit's MATLAB / R output goes to <visit>/run_visits.log, and
+# data/run_status.csv gets one row per visit (status, stages run, the stage
+# that failed, time taken).
+import argparse
+import collections
+import concurrent.futures
+import csv
+import datetime
+import os
+import re
+import shutil
+import subprocess
+import sys
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# stage -> tool that runs it, in pipeline order
+STAGES = collections.OrderedDict([
+    ('prep', 'R'),
+    ('read', 'matlab'),
+    ('blinks', 'matlab'),
+    ('trials', 'matlab'),
+    ('interpolate', 'matlab'),
+    ('aoi', 'matlab'),
+    ('timeseries', 'matlab')])
+
+LOG_FILE = 'run_visits.log'
+STATUS_HEADER = ['participant', 'visit', 'path', 'status', 'stages_run', 'failed_stage',
+                 'input_mb', 'seconds', 'log']
+
+
+def is_export(name):
+    return name.endswith('.tsv')
+
+
+def is_prepped(name):
+    # read_et_data_individual.m reads every .txt but the _colnames.txt
+    return name.endswith('.txt') and 'colnames' not in name and name != LOG_FILE
+
+
+def is_raw(name):
+    return name.endswith('_RawData.mat')
+
+
+def find_visits(root):
+    """ Every directory under <root> with an export, a prepped .txt or a
+  _RawData.mat, as (participant, visit, path).  The first directory level is
+  the participant; the rest of the path is the visit. """
+    visits = []
+    for path, dirs, files in os.walk(root):
+        dirs[:] = sorted(d for d in dirs if not d.startswith('.'))
+        if any(is_export(f) or is_prepped(f) or is_raw(f) for f in files):
+            rel = os.path.relpath(path, root).split(os.sep)
+            visits.append((rel[0], '/'.join(rel[1:]), path))
+    return visits
+
+
+def stage_files(path, files, aoi_files):
+    """ (inputs, outputs) of every stage for the visit in <path>, which holds
+  <files>.  The file names follow the MATLAB / R scripts. """
+    tsv = sorted(f for f in files if is_export(f))
+    txt = sorted(f for f in files if is_prepped(f))
+    raw = sorted(f for f in files if is_raw(f))
+    if len(tsv) > 0:
+        base = tsv[-1][:-len('.tsv')]  # the R script names its output after the last .tsv
+    elif len(txt) > 0:
+        base = txt[0][:-len('.txt')]
+    else:
+        base = raw[0][:-len('_RawData.mat')]
+    raw_file = raw[0] if len(raw) > 0 else base + '_RawData.mat'
+    temp = raw_file.split('_')
+    id = '_'.join(temp[:3])
+
+    def j(*names):
+        return [os.path.join(path, n) for n in names]
+
+    return collections.OrderedDict([
+        ('prep', (j(*tsv), j(base + '.txt', base + '_colnames.txt'))),
+        ('read', (j(base + '.txt', base + '_colnames.txt'), j(raw_file))),
+        ('blinks', (j(raw_file), j(id + '_Blinks.mat'))),
+        ('trials', (j(raw_file, id + '_Blinks.mat'), j(id + '_Trials.mat'))),
+        ('interpolate', (j(id + '_Trials.mat'), j(id + '_Interpolated.mat'))),
+        ('aoi', (j(id + '_Interpolated.mat') + aoi_files, j(id + '_Parsed.mat'))),
+        ('timeseries', (j(id + '_Parsed.mat'),
+                        j(id + '_segmentedTimeSeries.mat', id + '_calVerTimeSeries.mat',
+                          id + '_quality.csv')))])
+
+
+def mtime(f):
+    try:
+        return os.path.getmtime(f)
+    except OSError:
+        return None
+
+
+def up_to_date(inputs, outputs):
+    """ True if every output exists and is newer than every input.  A stage
+  whose inputs are all gone (e.g. the .tsv was archived) is up to date as long
+  as its outputs exist. """
+    out_times = [mtime(f) for f in outputs]
+    if None in out_times:
+        return False
+    in_times = [t for t in (mtime(f) for f in inputs) if t is not None]
+    return len(in_times) == 0 or min(out_times) >= max(in_times)
+
+
+def plan(path, aoi_files, force=False):
+    """ The stages to run for one visit: everything from the first stage
+  that isn't up to date.  Leading stages with nothing to run them from (e.g.
+  prep, for a visit that was prepped by hand) are left out.  Returns (stages,
+  input_bytes), where input_bytes is the size of the first stage's inputs
+  (used to balance the load). """
+    files = stage_files(path, os.listdir(path), aoi_files)
+    stages = list(STAGES)
+    while len(stages) > 0:
+        (inputs, outputs) = files[stages[0]]
+        if all(mtime(f) is None for f in inputs):
+            stages.pop(0)
+        elif not force and up_to_date(inputs, outputs):
+            stages.pop(0)
+        else:
+            break
+    if len(stages) == 0:
+        return [], 0
+    size = sum(os.path.getsize(f) for f in files[stages[0]][0] if os.path.isfile(f))
+    return stages, size
+
+
+def r_string(s):
+    return "'" + s.replace('\\', '\\\\').replace("'", "\\'") + "'"
+
+
+def matlab_string(s):
+    return "'" + s.replace("'", "''") + "'"
+
+
+def commands(path, stages, matlab='matlab', rscript='Rscript'):
+    """ [(stages, command)] for one visit: consecutive stages that use the same
+  tool run in one process, so MATLAB starts at most once per visit. """
+    path = os.path.abspath(path)
+    groups = []
+    for stage in stages:
+        if len(groups) > 0 and STAGES[groups[-1][0][-1]] == STAGES[stage]:
+            groups[-1][0].append(stage)
+        else:
+            groups.append(([stage], STAGES[stage]))
+
+    out = []
+    for (group, tool) in groups:
+        if tool == 'R':
+            script = "source(%s); cat(prep_tobii_output_individual(%s, overwrite = 1), '\\n')" % (
+                r_string(os.path.join(ROOT_DIR, 'funcs', 'prep_tobii_output_individual.R')),
+                r_string(path))
+            out.append((group, [rscript, '-e', script]))
+        else:
+            script = "addpath(genpath(%s)); " % matlab_string(ROOT_DIR)
+            process = [s for s in group if s != 'read']
+            if 'read' in group:
+                script += "read_et_data_individual(%s); " % matlab_string(path)
+            if len(process) > 0:
+                script += "if ~process_individual(%s, 'rootDir', %s, 'stages', {%s}), exit(1); end" % (
+                    matlab_string(path), matlab_string(ROOT_DIR),
+                    ', '.join(matlab_string(s) for s in process))
+            out.append((group, [matlab, '-nodisplay', '-singleCompThread', '-batch', script]))
+    return out
+
+
+def run_visit(participant, visit, path, stages, input_bytes, aoi_files, matlab='matlab',
+              rscript='Rscript'):
+    """ Runs <stages> for one visit and returns its row of the status report.
+  Output of the tools is appended to <path>/run_visits.log. """
+    start = time.time()
+    log_path = os.path.join(path, LOG_FILE)
+    done = []
+    failed = ''
+    with open(log_path, 'a') as log:
+        log.write("==== %s: running %s\n" % (datetime.datetime.now(), ' '.join(stages)))
+        for (group, command) in commands(path, stages, matlab, rscript):
+            log.write("---- %s\n" % ' '.join(command))
+            log.flush()
+            try:
+                returncode = subprocess.call(command, stdout=log, stderr=subprocess.STDOUT,
+                                             stdin=subprocess.DEVNULL, cwd=path)
+            except OSError as e:
+                log.write("Could not run %s: %s\n" % (command[0], e))
+                returncode = -1
+            # the tools don't always fail loudly; check that every stage
+            # actually brought its outputs up to date
+            files = stage_files(path, os.listdir(path), aoi_files)
+            for stage in group:
+                if not up_to_date(*files[stage]):
+                    failed = stage
+                    break
+                done.append(stage)
+            if failed == '' and returncode != 0:
+                failed = done.pop()
+            if failed != '':
+                log.write("**** failed at stage %s (exit code %i)\n" % (failed, returncode))
+                break
+
+    return {'participant': participant, 'visit': visit, 'path': path,
+            'status': 'failed' if failed != '' else 'ok',
+            'stages_run': ' '.join(done), 'failed_stage': failed,
+            'input_mb': '%.1f' % (input_bytes / 1e6), 'seconds': '%.1f' % (time.time() - start),
+            'log': log_path}
+
+
+def write_status(report_path, rows):
+    with open(report_path, 'w', newline='') as fp:
+        wf = csv.DictWriter(fp, fieldnames=STATUS_HEADER)
+        wf.writeheader()
+        wf.writerows(sorted(rows, key=lambda r: r['path']))
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Run the eye-tracking pipeline on every visit under a "
+                                                 "data directory, in parallel.")
+    parser.add_argument('root', help="data directory (data/<participant>/<visit>/)")
+    parser.add_argument('--jobs', type=int, default=os.cpu_count(),
+                        help="visits to run at once (default: number of cores)")
+    parser.add_argument('--only', help="regular expression; only run visits whose path matches")
+    parser.add_argument('--force', action='store_true', help="rerun every stage")
+    parser.add_argument('--dry-run', action='store_true', help="print what would run, and stop")
+    parser.add_argument('--matlab', default='matlab', help="MATLAB executable")
+    parser.add_argument('--rscript', default='Rscript', help="Rscript executable")
+    parser.add_argument('--report', help="status report (default: <root>/run_status.csv)")
+    args = parser.parse_args(argv)
+
+    aoi_dir = os.path.join(ROOT_DIR, 'dynamic_aoi')
+    aoi_files = sorted(os.path.join(aoi_dir, f) for f in os.listdir(aoi_dir) if f.endswith('.csv'))
+    report_path = args.report or os.path.join(args.root, 'run_status.csv')
+    # the tools run inside each visit's directory
+    (matlab, rscript) = [os.path.abspath(shutil.which(tool)) if shutil.which(tool) else tool
+                         for tool in (args.matlab, args.rscript)]
+
+    rows = []
+    jobs = []
+    for (participant, visit, path) in find_visits(args.root):
+        if args.only is not None and re.search(args.only, path) is None:
+            continue
+        stages, size = plan(path, aoi_files, args.force)
+        if len(stages) == 0:
+            rows.append({'participant': participant, 'visit': visit, 'path': path,
+                         'status': 'up to date', 'stages_run': '', 'failed_stage': '',
+                         'input_mb': '', 'seconds': '', 'log': ''})
+            continue
+        jobs.append((participant, visit, path, stages, size))
+
+    # Largest first: the long visits start right away, and the small ones fill
+    # in around them at the end.
+    jobs.sort(key=lambda j: j[4], reverse=True)
+    print("%i visit(s) found, %i up to date, %i to run on %i worker(s)."
+          % (len(rows) + len(jobs), len(rows), len(jobs), args.jobs))
+    if args.dry_run:
+        for (participant, visit, path, stages, size) in jobs:
+            print("%8.1f MB  %s: %s" % (size / 1e6, path, ' '.join(stages)))
+        return
+
+    start = time.time()
+    with concurrent.futures.ProcessPoolExecutor(max_workers=args.jobs) as pool:
+        futures = [pool.submit(run_visit, participant, visit, path, stages, size, aoi_files,
+                               matlab, rscript)
+                   for (participant, visit, path, stages, size) in jobs]
+        for n, future in enumerate(concurrent.futures.as_completed(futures)):
+            row = future.result()
+            rows.append(row)
+            print("[%i/%i] %s: %s%s (%s s)" % (
+                n + 1, len(jobs), row['path'], row['status'],
+                ' at ' + row['failed_stage'] if row['failed_stage'] else '', row['seconds']))
+            # keep the report current, so a killed run still leaves one
+            write_status(report_path, rows)
+
+    write_status(report_path, rows)
+    failed = [r for r in rows if r['status'] == 'failed']
+    print("Done in %.0f s: %i failed.  Status report: %s" % (time.time() - start, len(failed), report_path))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,177 @@
+#!/usr/bin/python3
+# Runs a function on every trial of one visit, in parallel.
+#
+# run_visits.py, mat_to_columns.py etc. process visits in parallel, but one
+# visit's trials one after another, so the longest visit sets the wall time.
+# map_trials() gives a visit's trials to a pool of processes instead.  The
+# pool is forked after the columns are in memory, so every process sees the
+# parent's arrays (or the memory-mapped store files) as they are: nothing is
+# pickled or copied, only the trial numbers are sent to the processes and
+# what the function returns is sent back.  Arrays the function writes into
+# (e.g. the interpolated gaze) must be made with share(), so the writes are
+# seen by the parent.  Results come back in the order of the trials table
+# (MovieListAsPresented for et_catalog visits), whatever order the trials
+# finish in; the longest trials are started first.
+#
+# Most of a recording's time goes into reading the .txt, so
+# et_processing.read_txt(filename, jobs) parses it in pieces with
+# map_parallel(), and blinks and trials are found in one pass over the whole
+# recording.  No more processes are used than there are CPUs, and small work
+# (under MIN_ROWS samples, or et_processing.MIN_PARALLEL_BYTES of .txt) is
+# done here, serially: starting the processes would take longer than that.
+# Steps of the MATLAB pipeline not ported here (add_fix_faces.m,
+# generate_timeseries.m) can be run per trial with map_recording().
+#
+#   import trial_pool
+#   rec = visit.recording('parsed')         # see et_catalog.py
+#   means = trial_pool.map_recording(lambda trial: np.nanmean(trial['gazeX_int']), rec, jobs=8)
+#   result = et_processing.process_recording(columns, jobs=8)
+#
+# or, for a visit's .txt (writes the same store as et_chunked.py, holding the
+# whole recording in memory):
+#
+#   python3 trial_pool.py data/JE000053_03/v03 --jobs 8
+#
+# Forking is needed (Linux, macOS); elsewhere, or with jobs=1, everything is
+# run one after another in this process.
+import argparse
+import mmap
+import multiprocessing
+import os
+import sys
+import time
+
+import numpy as np
+
+import recording
+
+MIN_ROWS = 100000  # smaller recordings take less time than starting the processes
+
+_work = None  # (func, args), set before the pool is forked
+
+
+def share(values):
+    """ A copy of array <values> in memory shared with processes forked
+  later, so what they write into it is seen here. """
+    values = np.asarray(values)
+    buf = mmap.mmap(-1, max(values.nbytes, 1))  # anonymous, MAP_SHARED
+    out = np.frombuffer(buf, dtype=values.dtype, count=values.size).reshape(values.shape)
+    out[...] = values
+    return out
+
+
+def can_fork():
+    return 'fork' in multiprocessing.get_all_start_methods()
+
+
+def n_cpus():
+    """ CPUs this process may run on. """
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:  # not on Linux
+        return os.cpu_count() or 1
+
+
+def usable_jobs(jobs, size=None, min_size=MIN_ROWS):
+    """ How many processes to use for work of <size> (rows, bytes, ...):
+  <jobs>, but no more than there are CPUs, and 1 (run here, serially) for
+  work smaller than <min_size> or where processes can't be forked. """
+    if size is not None and size < min_size or not can_fork():
+        return 1
+    return max(1, min(jobs, n_cpus()))
+
+
+def _run(item):
+    i, x = item
+    func, args = _work
+    return i, func(x, *args)
+
+
+def map_parallel(func, items, jobs=1, args=(), sizes=None):
+    """ [func(item, *args) for item in items], on <jobs> forked processes
+  (capped at the number of CPUs); items with the largest <sizes> are
+  started first.  <func> and <args> are inherited, not pickled, so can be
+  anything; the items and what <func> returns are pickled. """
+    global _work
+    jobs = usable_jobs(jobs)
+    if jobs <= 1 or len(items) <= 1:
+        return [func(item, *args) for item in items]
+    order = list(range(len(items)))
+    if sizes is not None:
+        order.sort(key=lambda i: -sizes[i])
+    results = [None] * len(items)
+    _work = (func, args)
+    try:
+        with multiprocessing.get_context('fork').Pool(min(jobs, len(items))) as pool:
+            for i, result in pool.imap_unordered(_run, [(i, items[i]) for i in order]):
+                results[i] = result
+    finally:
+        _work = None
+    return results
+
+
+def trial_rows(data, first, n_rows):
+    """ Rows of one trial: a view of a recording.Recording, or of each array
+  in a dict. """
+    if isinstance(data, recording.Recording):
+        return data.rows(first, first + n_rows)
+    return {name: values[first:first + n_rows] for name, values in data.items()}
+
+
+def map_trials(func, data, table, jobs=1, args=()):
+    """ [func(trial, *args) for each trial in <table>], where <table> is a list
+  of {'first_row', 'n_rows', ...} and trial is that trial's rows of <data> (a
+  recording.Recording or a dict of arrays), using <jobs> processes; the
+  longest trials are started first.  <func> doesn't need to be picklable,
+  but what it returns does. """
+    def run(t):
+        return func(trial_rows(data, t['first_row'], t['n_rows']), *args)
+    return map_parallel(run, table, jobs, sizes=[t['n_rows'] for t in table])
+
+
+def map_recording(func, rec, jobs=1, args=()):
+    """ map_trials() over rec.attrs['trials'], e.g. for a Recording from
+  et_catalog's Visit.recording('parsed'). """
+    return map_trials(func, rec, rec.attrs.get('trials', []), jobs, args)
+
+
+def main(argv):
+    import et_chunked
+    import et_processing as etp
+    from column_store import ColumnWriter
+
+    parser = argparse.ArgumentParser(description="Blinks, trials and interpolation for a "
+                                                 "recording, read and interpolated in parallel.")
+    parser.add_argument('path', help="visit directory or .txt file (from prep_tobii_output_individual.R)")
+    parser.add_argument('--jobs', type=int, default=os.cpu_count(), help="processes (default: number of CPUs)")
+    parser.add_argument('--rate', type=float, default=etp.SAMPLING_RATE,
+                        help="sampling rate in Hz (default %i)" % etp.SAMPLING_RATE)
+    parser.add_argument('--lenient', action='store_true',
+                        help="only treat missing gaze as invalid (not validity codes above 1)")
+    parser.add_argument('--out', help="store to write (default <id>%s next to the .txt)"
+                                      % et_chunked.OUT_SUFFIX)
+    args = parser.parse_args(argv)
+
+    files = et_chunked.find_txt(args.path)
+    if len(files) == 0:
+        print("No .txt file in %s" % args.path)
+        exit(1)
+    for filename in files:
+        out = args.out if args.out is not None and len(files) == 1 else et_chunked.out_path(filename)
+        print("Processing %s" % filename)
+        start = time.time()
+        jobs = max(1, args.jobs)
+        result = etp.process_recording(etp.read_txt(filename, jobs), args.rate, not args.lenient, jobs)
+        attrs = {'source': os.path.basename(filename), 'sampling_rate': args.rate,
+                 'strict': not args.lenient,
+                 'trials': [{'name': name, 'first_row': int(first), 'n_rows': int(n),
+                             'prop_interpolated': prop} for name, first, n, prop in result['trials']],
+                 'blinks': result['blinks'].tolist()}
+        with ColumnWriter(out, et_chunked.output_columns(), attrs) as writer:
+            writer.append(result['columns'])
+        print("%i trials, %i blinks -> %s (%.1f s)" % (len(result['trials']), len(result['blinks']),
+                                                      out, time.time() - start))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
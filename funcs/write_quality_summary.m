@@ -0,0 +1,85 @@
+function [quality] = write_quality_summary(outFile, ParticData, PrefBin, dataCol, propInterpolated, segmentedData, segSummaryCol)
+%% write_quality_summary
+% Writes one row of data-quality measures per trial and per time-series
+% segment to a .csv (e.g. JE000053_03_03_quality.csv). The .csv is picked
+% up by quality_index.py, which keeps an indexed store of these rows so
+% that cohort inclusion queries don't need to reload every .mat file.
+%
+% Trial-level rows have segment = 0. Segment-level rows come from the
+% output of generate_timeseries.m.
+%
+% Columns:
+% participant, visit, trial, segment, n_samples, prop_missing,
+% prop_interpolated, longest_fix_dur, n_blinks, validity_0 ... validity_4,
+% validity_missing, mean_distance
+% Validity counts use the worse of the two eyes' validity codes.
+
+quality = {};
+%% Trial-level rows
+for t = 1:length(PrefBin.MovieListAsPresented)
+    data = ParticData.Data{t,1};
+    if isempty(data)
+        continue
+    end
+    gazeX = cell2mat(data(:, dataCol.gazeX));
+    vl = cell2mat(data(:, dataCol.validityL));
+    vr = cell2mat(data(:, dataCol.validityR));
+    blink = cell2mat(data(:, dataCol.blink));
+    % distance columns are stored as text in _RawData.mat
+    distL = str2double(data(:, dataCol.distL));
+    distR = str2double(data(:, dataCol.distR));
+    dist = [distL distR];
+    dist(dist == -9999 | dist == 0) = NaN;
+    dist = mean(dist, 2); % both eyes must be tracked
+
+    quality(end+1, :) = {PrefBin.MovieListAsPresented{t}, 0, length(gazeX), ...
+        sum(gazeX == -9999) / length(gazeX), propInterpolated(t), NaN, ...
+        count_blinks(blink), count_validity(vl, vr), mean(dist, 'omitnan')};
+end
+
+%% Segment-level rows
+for s = 1:length(segmentedData)
+    seg = segmentedData{s};
+    if isempty(seg)
+        continue
+    end
+    vl = cell2mat(seg(:, segSummaryCol.vl));
+    vr = cell2mat(seg(:, segSummaryCol.vr));
+    blink = cell2mat(seg(:, segSummaryCol.blinkBool));
+
+    quality(end+1, :) = {seg{1, segSummaryCol.trial}, seg{1, segSummaryCol.seg}, size(seg, 1), ...
+        seg{1, segSummaryCol.propMissing}, seg{1, segSummaryCol.propInterpolated}, ...
+        seg{1, segSummaryCol.longestFixDur}, count_blinks(blink), count_validity(vl, vr), NaN};
+end
+
+%% Write .csv
+fid = fopen(outFile, 'w');
+if fid == -1
+    disp(['Could not open ' outFile ' for writing']);
+    return
+end
+fprintf(fid, ['participant,visit,trial,segment,n_samples,prop_missing,prop_interpolated,' ...
+    'longest_fix_dur,n_blinks,validity_0,validity_1,validity_2,validity_3,validity_4,' ...
+    'validity_missing,mean_distance\n']);
+for r = 1:size(quality, 1)
+    v = quality{r, 8};
+    fprintf(fid, '%s,%s,%s,%d,%d,%.6f,%.6f,%.6f,%d,%d,%d,%d,%d,%d,%d,%.6f\n', ...
+        PrefBin.ParticipantName, PrefBin.SessionNumber, quality{r, 1}, quality{r, 2}, ...
+        quality{r, 3}, quality{r, 4}, quality{r, 5}, quality{r, 6}, quality{r, 7}, ...
+        v(1), v(2), v(3), v(4), v(5), v(6), quality{r, 9});
+end
+fclose(fid);
+end
+
+function [n] = count_blinks(blink)
+% number of blink onsets in a 0/1 blink column
+blink = double(blink(:) == 1);
+n = sum(diff([0; blink]) == 1);
+end
+
+function [counts] = count_validity(vl, vr)
+% counts of samples for validity codes 0-4, plus missing (-9999)
+v = max(vl, vr);
+v(vl == -9999 | vr == -9999) = -9999;
+counts = [arrayfun(@(c) sum(v == c), 0:4) sum(v == -9999)];
+end